@@ -1,30 +1,35 @@
 #!/usr/bin/env python
 
 import argparse
+import collections
 import datetime
+import multiprocessing
 import os
-import re
 import shutil
-import StringIO
 import sys
 import urlparse
 
 import pygments
 import pygments.formatters
-import pygments.lexers
 import yaml
-import Cheetah.Template as template
 
+import cache
 import errors
+import functions
+import highlight
+import manifest
 import model
 import model_parser
 import output
+import template_registry
 import utils
+import watch
 
 class Config(object):
     def __init__(self, template_homepage_path, template_postpage_path, template_feedpage_path, 
                  template_foundation_dir, template_blogula_css_path, template_img_dir,
-                 template_sitemap_xml_path, template_robots_txt_path, template_humans_txt_path):
+                 template_sitemap_xml_path, template_robots_txt_path, template_humans_txt_path,
+                 function_registry, lexer_aliases):
         assert isinstance(template_homepage_path, str)
         assert isinstance(template_postpage_path, str)
         assert isinstance(template_feedpage_path, str)
@@ -34,6 +39,10 @@ class Config(object):
         assert isinstance(template_sitemap_xml_path, str)
         assert isinstance(template_robots_txt_path, str)
         assert isinstance(template_humans_txt_path, str)
+        assert isinstance(function_registry, functions.FunctionRegistry)
+        assert isinstance(lexer_aliases, dict)
+        assert all(isinstance(l, str) for l in lexer_aliases.keys())
+        assert all(isinstance(n, str) for n in lexer_aliases.values())
 
         self._template_homepage_path = template_homepage_path
         self._template_postpage_path = template_postpage_path
@@ -44,6 +53,8 @@ class Config(object):
         self._template_sitemap_xml_path = template_sitemap_xml_path
         self._template_robots_txt_path = template_robots_txt_path
         self._template_humans_txt_path = template_humans_txt_path
+        self._function_registry = function_registry
+        self._lexer_aliases = lexer_aliases
         self._presentation_title_heading_level = 1
         self._presentation_article_title_heading_level = 2
         self._presentation_article_subtitle_heading_level_min = 3
@@ -85,6 +96,14 @@ class Config(object):
     def template_humans_txt_path(self):
         return self._template_humans_txt_path
 
+    @property
+    def function_registry(self):
+        return self._function_registry
+
+    @property
+    def lexer_aliases(self):
+        return self._lexer_aliases
+
     @property
     def presentation_title_heading_level(self):
         return self._presentation_title_heading_level
@@ -124,63 +143,128 @@ def _ParseConfig(config_path):
     template_robots_txt_path = utils.Extract(templates_raw, 'RobotsTxtPath', str)
     template_humans_txt_path = utils.Extract(templates_raw, 'HumansTxtPath', str)
 
+    # Sites can define their own functions, each as a text and an HTML format string, which
+    # the arguments of the function fill in.
+    function_registry = functions.FunctionRegistry()
+
+    if 'Functions' in config_raw:
+        functions_raw = utils.Extract(config_raw, 'Functions', dict)
+
+        for (function_name, function_raw) in functions_raw.iteritems():
+            if not isinstance(function_name, str) or not isinstance(function_raw, dict):
+                raise errors.Error('Invalid Functions entry')
+
+            text_format = utils.Extract(function_raw, 'Text', str)
+            html_format = utils.Extract(function_raw, 'HTML', str)
+            function_registry.RegisterFormat(function_name, text_format, html_format)
+
+    # Code blocks can name their language the way posts usually do, and the config maps these
+    # names to Pygments lexer names.
+    lexer_aliases = {}
+
+    if 'Lexers' in config_raw:
+        lexers_raw = utils.Extract(config_raw, 'Lexers', dict)
+
+        for (language, lexer_name) in lexers_raw.iteritems():
+            if not isinstance(language, str) or not isinstance(lexer_name, str):
+                raise errors.Error('Invalid Lexers entry')
+
+            lexer_aliases[language] = lexer_name
+
     return Config(template_homepage_path=template_homepage_path, template_postpage_path=template_postpage_path,
                   template_feedpage_path=template_feedpage_path, template_foundation_dir=template_foundation_dir,
                   template_blogula_css_path=template_blogula_css_path, template_img_dir=template_img_dir,
                   template_sitemap_xml_path=template_sitemap_xml_path, template_robots_txt_path=template_robots_txt_path,
-                  template_humans_txt_path=template_humans_txt_path)
+                  template_humans_txt_path=template_humans_txt_path, function_registry=function_registry,
+                  lexer_aliases=lexer_aliases)
 
 class SiteBuilder(object):
-    def __init__(self, info_path, config, info, post_db):
+    def __init__(self, info_path, config, info, post_db, input_manifest=None, previous_manifest=None,
+                 template_cache=None, highlight_cache=None, jobs=1):
         assert isinstance(info_path, str)
         assert isinstance(config, Config)
         assert isinstance(info, model.Info)
         assert isinstance(post_db, model.PostDB)
+        assert input_manifest is None or isinstance(input_manifest, manifest.Manifest)
+        assert previous_manifest is None or isinstance(previous_manifest, manifest.Manifest)
+        assert previous_manifest is None or input_manifest is not None
+        assert template_cache is None or isinstance(template_cache, cache.DiskCache)
+        assert highlight_cache is None or isinstance(highlight_cache, cache.DiskCache)
+        assert isinstance(jobs, int)
+        assert jobs >= 1
 
         self._info_path = info_path
         self._config = config
         self._info = info
         self._post_db = post_db
-
-    @staticmethod
-    def _UniformPath(path):
-        def EliminateNonAlpha(word):
-            good_word_file = StringIO.StringIO()
-
-            for ch in word:
-                if re.match('[a-z0-9_]', ch):
-                    good_word_file.write(ch)
-
-            good_word = good_word_file.getvalue()
-            good_word_file.close()
-
-            return good_word
-
-        return '_'.join(EliminateNonAlpha(w) for w in path.lower().split())
+        self._input_manifest = input_manifest
+        self._previous_manifest = previous_manifest
+        self._post_pages = {}
+        self._output_fingerprints = {}
+        self._templates = template_registry.TemplateRegistry(template_cache)
+        self._highlighter = highlight.CodeHighlighter(highlight_cache, config.lexer_aliases)
+        self._jobs = jobs
+        self._text_texts = {}
+        self._text_htmls = {}
+        self._new_evaluated_texts = None
+        self._info_context = self._InfoContext()
+        self._post_db.IndexSlugs(self._TextToText)
 
     def _UrlForPost(self, post):
-        return os.path.join(
-            '/',
-            self._info.output_posts_dir,
-            SiteBuilder._UniformPath(SiteBuilder._EvaluateTextToText(post.title))) + '.html'
+        return self._post_db.url_map[post.path]
+
+    def _PostpagePath(self, post):
+        return self._post_db.postpage_path_map[post.path]
+
+    def _InfoContext(self):
+        # The same for every page, so it is built once and shared. Pages only read it.
+        info_context = {}
+        info_context['title_text'] = self._TextToText(self._info.title)
+        info_context['title_html'] = self._TextToHTML(self._info.title)
+        info_context['author'] = self._info.author
+        info_context['avatar_url'] = '/img/avatar.jpg'
+        info_context['description_text'] = self._TextToText(self._info.description)
+        info_context['description_html'] = self._TextToHTML(self._info.description)
+
+        return info_context
+
+    def _TextToText(self, text):
+        # Titles, descriptions, tags and series show up on many pages, so each distinct one is
+        # evaluated once per build. Texts from post bodies show up on a single page, and are
+        # not kept around.
+        return self._EvaluateTextOnce(text, self._text_texts, SiteBuilder._EvaluateTextToText)
+
+    def _TextToHTML(self, text):
+        return self._EvaluateTextOnce(text, self._text_htmls, SiteBuilder._EvaluateTextToHTML)
+
+    def _EvaluateTextOnce(self, text, evaluated_texts, evaluate):
+        # The unknown functions of a text are counted again whenever it is used, so they are
+        # reported the same as if it were evaluated every time.
+        function_registry = self._config.function_registry
+        evaluated_text = evaluated_texts.get(text)
+
+        if evaluated_text is None:
+            evaluated_text = (evaluate(text, function_registry),
+                              [f.name for f in text.functions if not function_registry.IsKnown(f.name)])
+            evaluated_texts[text] = evaluated_text
+
+            if self._new_evaluated_texts is not None:
+                self._new_evaluated_texts.append((evaluated_texts is self._text_htmls, text, evaluated_text))
+        else:
+            function_registry.unknown_names.update(evaluated_text[1])
+
+        return evaluated_text[0]
 
     def _GenerateHomepage(self):
-        homepage_template_text = utils.QuickRead(self._config.template_homepage_path)
-        homepage_template = template.Template(homepage_template_text)
-        homepage_template.info = {}
-        homepage_template.info['title_text'] = SiteBuilder._EvaluateTextToText(self._info.title)
-        homepage_template.info['title_html'] = SiteBuilder._EvaluateTextToHTML(self._info.title)
-        homepage_template.info['author'] = self._info.author
-        homepage_template.info['avatar_url'] = '/img/avatar.jpg'
-        homepage_template.info['description_text'] = SiteBuilder._EvaluateTextToText(self._info.description)
-        homepage_template.info['description_html'] = SiteBuilder._EvaluateTextToHTML(self._info.description)
+        homepage_template = self._templates.New(self._config.template_homepage_path)
+        homepage_template.info = self._info_context
         homepage_template.posts = []
 
         for post in self._post_db.post_map.itervalues():
             homepage_template.posts.append({})
-            homepage_template.posts[-1]['title_html'] = SiteBuilder._EvaluateTextToHTML(post.title)
-            homepage_template.posts[-1]['description_html'] = SiteBuilder._EvaluateTextToHTML(post.description)
-            homepage_template.posts[-1]['tags_html'] = [SiteBuilder._EvaluateTextToHTML(t) for t in post.tags]
+            homepage_template.posts[-1]['title_html'] = self._TextToHTML(post.title)
+            homepage_template.posts[-1]['description_html'] = self._TextToHTML(post.description)
+            homepage_template.posts[-1]['tags_html'] = [self._TextToHTML(t) for t in post.tags]
             homepage_template.posts[-1]['url'] = self._UrlForPost(post)
             homepage_template.posts[-1]['date_str'] = post.date.strftime('%d %B %Y')
 
@@ -196,35 +280,30 @@ class SiteBuilder(object):
         return output.File('text/html', output.CrawlMode.CRAWLABLE, homepage_text)
 
     def _GeneratePostpage(self, post):
-        (line_units, extra_image_units) = SiteBuilder._LinearizeSectionToLineUnits(self._info_path, self._config, post.root_section, 0)
-        postpage_template_text = utils.QuickRead(self._config.template_postpage_path)
-        postpage_template = template.Template(postpage_template_text)
+        (line_units, extra_image_units) = SiteBuilder._LinearizeEventsToLineUnits(
+            self._info_path, self._config, self._highlighter, post.path, model_parser.PostEvents(post))
+        postpage_template = self._templates.New(self._config.template_postpage_path)
 
-        postpage_template.info = {}
-        postpage_template.info['title_text'] = SiteBuilder._EvaluateTextToText(self._info.title)
-        postpage_template.info['title_html'] = SiteBuilder._EvaluateTextToHTML(self._info.title)
-        postpage_template.info['author'] = self._info.author
-        postpage_template.info['avatar_url'] = '/img/avatar.jpg'
-        postpage_template.info['description_html'] = SiteBuilder._EvaluateTextToHTML(self._info.description)
+        postpage_template.info = self._info_context
 
         postpage_template.post = {}
-        postpage_template.post['title_text'] = SiteBuilder._EvaluateTextToText(post.title)
-        postpage_template.post['title_html'] = SiteBuilder._EvaluateTextToHTML(post.title)
-        postpage_template.post['description_text'] = SiteBuilder._EvaluateTextToText(post.description)
+        postpage_template.post['title_text'] = self._TextToText(post.title)
+        postpage_template.post['title_html'] = self._TextToHTML(post.title)
+        postpage_template.post['description_text'] = self._TextToText(post.description)
         postpage_template.post['lineunits'] = line_units            
-        postpage_template.post['tags_html'] = [SiteBuilder._EvaluateTextToHTML(t) for t in post.tags]
+        postpage_template.post['tags_html'] = [self._TextToHTML(t) for t in post.tags]
 
         if post.prev_post is not None:
             postpage_template.post['prev_post'] = {}
             postpage_template.post['prev_post']['url'] = self._UrlForPost(post.prev_post)
-            postpage_template.post['prev_post']['title_html'] = SiteBuilder._EvaluateTextToHTML(post.prev_post.title)
+            postpage_template.post['prev_post']['title_html'] = self._TextToHTML(post.prev_post.title)
         else:
             postpage_template.post['prev_post'] = None
 
         if post.next_post is not None:
             postpage_template.post['next_post'] = {}
             postpage_template.post['next_post']['url'] = self._UrlForPost(post.next_post)
-            postpage_template.post['next_post']['title_html'] = SiteBuilder._EvaluateTextToHTML(post.next_post.title)
+            postpage_template.post['next_post']['title_html'] = self._TextToHTML(post.next_post.title)
         else:
             postpage_template.post['next_post'] = None
 
@@ -232,19 +311,19 @@ class SiteBuilder(object):
 
         for s in post.series:
             postpage_template.post['series'].append({})
-            postpage_template.post['series'][-1]['title_html'] = SiteBuilder._EvaluateTextToHTML(s)
+            postpage_template.post['series'][-1]['title_html'] = self._TextToHTML(s)
 
             if post.prev_post_by_series[s] is not None:
                 postpage_template.post['series'][-1]['prev_post'] = {}
                 postpage_template.post['series'][-1]['prev_post']['url'] = self._UrlForPost(post.prev_post_by_series[s])
-                postpage_template.post['series'][-1]['prev_post']['title_html'] = SiteBuilder._EvaluateTextToHTML(post.prev_post_by_series[s].title)
+                postpage_template.post['series'][-1]['prev_post']['title_html'] = self._TextToHTML(post.prev_post_by_series[s].title)
             else:
                 postpage_template.post['series'][-1]['prev_post'] = None
 
             if post.next_post_by_series[s] is not None:
                 postpage_template.post['series'][-1]['next_post'] = {}
                 postpage_template.post['series'][-1]['next_post']['url'] = self._UrlForPost(post.next_post_by_series[s])
-                postpage_template.post['series'][-1]['next_post']['title_html'] = SiteBuilder._EvaluateTextToHTML(post.next_post_by_series[s].title)
+                postpage_template.post['series'][-1]['next_post']['title_html'] = self._TextToHTML(post.next_post_by_series[s].title)
             else:
                 postpage_template.post['series'][-1]['next_post'] = None
 
@@ -257,12 +336,52 @@ class SiteBuilder(object):
         postpage_text = str(postpage_template)
         return (output.File('text/html', output.CrawlMode.CRAWLABLE, postpage_text), extra_image_units)
 
+    def _GeneratePostpages(self, posts):
+        if self._jobs == 1 or len(posts) <= 1:
+            return (self._GeneratePostpage(post) for post in posts)
+
+        return iter(self._GeneratePostpagesInParallel(posts))
+
+    def _GeneratePostpagesInParallel(self, posts):
+        # Workers are forked with this builder as their site context, so they get the post db,
+        # config and compiled templates once, and each task only names a post. Pages are taken
+        # as they come back, so an error stops the pool without waiting for the other pages.
+        pool = multiprocessing.Pool(self._jobs, _InitPostpageWorker, (self,))
+        postpages = []
+
+        try:
+            chunk_size = max(1, len(posts) // (self._jobs * 4))
+            generated_postpages = pool.imap(_GeneratePostpageInWorker, [post.path for post in posts], chunk_size)
+
+            # The first error is the one a serial build would have reported.
+            for (postpage, unknown_names, guessed_blocks, new_evaluated_texts, generate_error) in generated_postpages:
+                if generate_error is not None:
+                    raise generate_error
+
+                self._config.function_registry.unknown_names.update(unknown_names)
+
+                for (lexer_name, block_names) in guessed_blocks.iteritems():
+                    self._highlighter.guessed_blocks[lexer_name].extend(block_names)
+
+                # Every worker evaluates the shared texts its pages use, so several may send
+                # back the same one. This builder keeps a single evaluation of each.
+                for (is_html, text, evaluated_text) in new_evaluated_texts:
+                    (self._text_htmls if is_html else self._text_texts).setdefault(text, evaluated_text)
+
+                postpages.append(postpage)
+
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        return postpages
+
     def _GenerateFeed(self):
-        feedpage_template_text = utils.QuickRead(self._config.template_feedpage_path)
-        feedpage_template = template.Template(feedpage_template_text)
-        feedpage_template.info = {}
-        feedpage_template.info['title_text'] = SiteBuilder._EvaluateTextToText(self._info.title)
-        feedpage_template.info['description_text'] = SiteBuilder._EvaluateTextToText(self._info.description)
+        feedpage_template = self._templates.New(self._config.template_feedpage_path)
+        feedpage_template.info = dict(self._info_context)
         feedpage_template.info['url'] = self._info.url
         feedpage_template.info['copyright_year'] = datetime.datetime.now().year
         feedpage_template.info['author'] = self._info.author
@@ -272,10 +391,10 @@ class SiteBuilder(object):
 
         for post in self._post_db.post_map.values()[-self._info.nr_of_posts_in_feed:]:
             feedpage_template.posts.append({})
-            feedpage_template.posts[-1]['title_text'] = SiteBuilder._EvaluateTextToText(post.title)
+            feedpage_template.posts[-1]['title_text'] = self._TextToText(post.title)
             feedpage_template.posts[-1]['url'] = self._UrlForPost(post)
-            feedpage_template.posts[-1]['description_text'] = SiteBuilder._EvaluateTextToText(post.description)
-            feedpage_template.posts[-1]['tags_text'] = [SiteBuilder._EvaluateTextToText(t) for t in post.tags]
+            feedpage_template.posts[-1]['description_text'] = self._TextToText(post.description)
+            feedpage_template.posts[-1]['tags_text'] = [self._TextToText(t) for t in post.tags]
             feedpage_template.posts[-1]['pub_date_str'] = post.date.strftime('%A, %d %B %Y 00:00:00 %Z')
 
         feedpage_template.posts.reverse()
@@ -283,8 +402,7 @@ class SiteBuilder(object):
         return output.File('application/xml', output.CrawlMode.CRAWLABLE, feedpage_text)
 
     def _GenerateHumansTxt(self):
-        humans_txt_template_text = utils.QuickRead(self._config.template_humans_txt_path)
-        humans_txt_template = template.Template(humans_txt_template_text)
+        humans_txt_template = self._templates.New(self._config.template_humans_txt_path)
         humans_txt_template.author = self._info.author
         humans_txt_template.email = self._info.email
         humans_txt_template.twitter = self._info.twitter
@@ -295,30 +413,12 @@ class SiteBuilder(object):
 
         return output.File('text/plain', output.CrawlMode.CRAWLABLE, humans_txt_text)
 
-    def _GenerateSitemapXml(self, robots_txt_path, out_dir):
-        def LinearizeUnits(path, unit):
-            if unit.crawl_mode is output.CrawlMode.NON_CRAWLABLE:
-                return []
-
-            if isinstance(unit, output.File):
-                return [{'host': self._info.url,
-                         'path': path,
-                         'build_date_str': datetime.datetime.now().strftime('%Y-%M-%d')}]
-            elif isinstance(unit, output.Copy):
-                if unit.is_dir:
-                    raise Error('Copy directory "%s" cannot be crawlable' % path)
-
-                return [{'host': self._info.url,
-                         'path': path,
-                         'build_date_str': datetime.datetime.now().strftime('%Y-%M-%d')}]
-            elif isinstance(unit, output.Dir):
-                linearized_units = [LinearizeUnits(os.path.join(path, subpath), subunit)
-                                    for (subpath, subunit) in unit.units.iteritems()]
-                return [item for sublist in linearized_units for item in sublist]
-
-        sitemap_xml_template_text = utils.QuickRead(self._config.template_sitemap_xml_path)
-        sitemap_xml_template = template.Template(sitemap_xml_template_text)
-        sitemap_xml_template.urls = LinearizeUnits('/', out_dir)
+    def _GenerateSitemapXml(self, robots_txt_path, crawlable_paths):
+        sitemap_xml_template = self._templates.New(self._config.template_sitemap_xml_path)
+        sitemap_xml_template.urls = [{'host': self._info.url,
+                                      'path': path,
+                                      'build_date_str': datetime.datetime.now().strftime('%Y-%M-%d')}
+                                     for path in crawlable_paths]
         sitemap_xml_template.robots_txt = {}
         sitemap_xml_template.robots_txt['host'] = self._info.url
         sitemap_xml_template.robots_txt['path'] = robots_txt_path
@@ -328,56 +428,94 @@ class SiteBuilder(object):
 
         return output.File('text/plain', output.CrawlMode.CRAWLABLE, sitemap_xml_text)
 
-    def _GenerateRobotsTxt(self, sitemap_xml_path, out_dir):
-        def LinearizeUnits(path, unit):
-            if unit.crawl_mode is output.CrawlMode.CRAWLABLE:
-                if isinstance(unit, (output.File, output.Copy)):
-                    return []
-                elif isinstance(unit, output.Dir):
-                    linearized_units = [LinearizeUnits(os.path.join(path, subpath), subunit)
-                                        for (subpath, subunit) in unit.units.iteritems()]
-                    return [item for sublist in linearized_units for item in sublist]
-            else:
-                if isinstance(unit, output.File):
-                    return [{'path': path}]
-                elif isinstance(unit, output.Copy):
-                    if unit.is_dir:
-                        return [{'path': '%s/' % path}]
-                    else:
-                        return [{'path': path}]
-                elif isinstance(unit, output.Dir):
-                    return [{'path': '%s/' % path}]
-
-        robots_txt_template_text = utils.QuickRead(self._config.template_robots_txt_path)
-        robots_txt_template = template.Template(robots_txt_template_text)
+    def _GenerateRobotsTxt(self, sitemap_xml_path, non_crawlable_paths):
+        robots_txt_template = self._templates.New(self._config.template_robots_txt_path)
         robots_txt_template.sitemap_xml_host = self._info.url
         robots_txt_template.sitemap_xml_path = sitemap_xml_path
-        robots_txt_template.urls = LinearizeUnits('', out_dir)
+        robots_txt_template.urls = [{'path': path} for path in non_crawlable_paths]
 
         robots_txt_text = str(robots_txt_template)
 
         return output.File('text/plain', output.CrawlMode.CRAWLABLE, robots_txt_text)
 
+    @staticmethod
+    def _CrawlablePaths(path, unit):
+        if unit.crawl_mode is output.CrawlMode.NON_CRAWLABLE:
+            return []
+
+        if isinstance(unit, (output.File, output.Keep)):
+            return [path]
+        elif isinstance(unit, output.Copy):
+            if unit.is_dir:
+                raise errors.Error('Copy directory "%s" cannot be crawlable' % path)
+
+            return [path]
+        elif isinstance(unit, output.Dir):
+            linearized_units = [SiteBuilder._CrawlablePaths(os.path.join(path, subpath), subunit)
+                                for (subpath, subunit) in unit.units.iteritems()]
+            return [item for sublist in linearized_units for item in sublist]
+
+    @staticmethod
+    def _NonCrawlablePaths(path, unit):
+        if unit.crawl_mode is output.CrawlMode.CRAWLABLE:
+            if isinstance(unit, (output.File, output.Keep, output.Copy)):
+                return []
+            elif isinstance(unit, output.Dir):
+                linearized_units = [SiteBuilder._NonCrawlablePaths(os.path.join(path, subpath), subunit)
+                                    for (subpath, subunit) in unit.units.iteritems()]
+                return [item for sublist in linearized_units for item in sublist]
+        else:
+            if isinstance(unit, (output.File, output.Keep)):
+                return [path]
+            elif isinstance(unit, output.Copy):
+                if unit.is_dir:
+                    return ['%s/' % path]
+                else:
+                    return [path]
+            elif isinstance(unit, output.Dir):
+                return ['%s/' % path]
+
     def Generate(self):
         out_dir = output.Dir(output.CrawlMode.CRAWLABLE)
 
         # generate home page
-        homepage_unit = self._GenerateHomepage()
+        homepage_unit = self._GenerateOrKeep(self._info.output_homepage_path, self._HomepageDeps(),
+                                             self._GenerateHomepage)
         out_dir.Add(self._info.output_homepage_path, homepage_unit)
 
         # generate one page for each article
         posts_dir = output.Dir(output.CrawlMode.CRAWLABLE)
         extra_image_units = []
+        postpages = []
 
         for post in self._post_db.post_map.itervalues():
-            (postpage_unit, post_extra_image_units) = self._GeneratePostpage(post)
-            posts_dir.Add(SiteBuilder._UniformPath(SiteBuilder._EvaluateTextToText(post.title)) + '.html', postpage_unit)
+            postpage_path = self._PostpagePath(post)
+            postpage_fingerprint = SiteBuilder._Fingerprint(self._PostpageDeps(post))
+            can_keep = self._CanKeepPostpage(post, postpage_path, postpage_fingerprint)
+            postpages.append((post, postpage_path, postpage_fingerprint, can_keep))
+
+        # Pages come back in the order of their posts, so the output is the same however many
+        # processes generate them.
+        generated_postpages = self._GeneratePostpages([p for (p, _, _, k) in postpages if not k])
+
+        for (post, postpage_path, postpage_fingerprint, can_keep) in postpages:
+            if can_keep:
+                (_, _, post_extra_images) = self._previous_manifest.post_pages[post.path]
+                postpage_unit = output.Keep(output.CrawlMode.CRAWLABLE)
+                post_extra_image_units = [(basename, output.Copy(output.CrawlMode.CRAWLABLE, original_path))
+                                          for (basename, original_path) in post_extra_images]
+            else:
+                (postpage_unit, post_extra_image_units) = next(generated_postpages)
+
+            posts_dir.Add(postpage_path, postpage_unit)
             extra_image_units.extend(post_extra_image_units)
+            self._post_pages[post.path] = (postpage_fingerprint, postpage_path,
+                                           [(basename, unit.original_path) for (basename, unit) in post_extra_image_units])
 
         out_dir.Add(self._info.output_posts_dir, posts_dir)
 
         # generate rss feed
-        feed_unit = self._GenerateFeed()
+        feed_unit = self._GenerateOrKeep('feed.xml', self._FeedDeps(), self._GenerateFeed)
         out_dir.Add('feed.xml', feed_unit)
 
         # generate projects page (from projects description)
@@ -418,19 +556,110 @@ class SiteBuilder(object):
         out_dir.Add('img', image_dir)
 
         # Generate humans.txt file.
-        humans_txt_unit = self._GenerateHumansTxt()
+        humans_txt_unit = self._GenerateOrKeep('humans.txt', self._HumansTxtDeps(), self._GenerateHumansTxt)
         out_dir.Add('humans.txt', humans_txt_unit)
 
         # Generate sitemap.xml file.
-        sitemap_xml_unit = self._GenerateSitemapXml('/robots.txt', out_dir)
+        crawlable_paths = SiteBuilder._CrawlablePaths('/', out_dir)
+        sitemap_xml_unit = self._GenerateOrKeep(
+            'sitemap.xml', (self._SiteInputHashes(self._config.template_sitemap_xml_path), crawlable_paths),
+            lambda: self._GenerateSitemapXml('/robots.txt', crawlable_paths))
         out_dir.Add('sitemap.xml', sitemap_xml_unit)
 
         # Generate robots.txt file.
-        robots_txt_unit = self._GenerateRobotsTxt('/sitemap.xml', out_dir)
+        non_crawlable_paths = SiteBuilder._NonCrawlablePaths('', out_dir)
+        robots_txt_unit = self._GenerateOrKeep(
+            'robots.txt', (self._SiteInputHashes(self._config.template_robots_txt_path), non_crawlable_paths),
+            lambda: self._GenerateRobotsTxt('/sitemap.xml', non_crawlable_paths))
         out_dir.Add('robots.txt', robots_txt_unit)
 
         return out_dir
 
+    def _GenerateOrKeep(self, output_path, output_deps, generate):
+        # Every generated output has a list of the inputs it is rendered from. It is rendered
+        # again only if the fingerprint of those differs from the one recorded by the previous
+        # build. The build date shown by some outputs is not one of their inputs, so it only
+        # moves when something else does.
+        output_fingerprint = SiteBuilder._Fingerprint(output_deps)
+        self._output_fingerprints[output_path] = output_fingerprint
+
+        if self._previous_manifest is not None and \
+           self._previous_manifest.output_fingerprints.get(output_path) == output_fingerprint and \
+           os.path.isfile(os.path.join(self._info.output_dir, output_path)):
+            return output.Keep(output.CrawlMode.CRAWLABLE)
+
+        return generate()
+
+    @staticmethod
+    def _Fingerprint(output_deps):
+        return utils.HashText(repr(output_deps))
+
+    @staticmethod
+    def _TextDeps(text):
+        # A text stands in the inputs of an output by its compact form. Working out whether
+        # an output must be generated again does not evaluate any text, so unknown functions
+        # are only counted for the outputs which are.
+        return (text.words_text, text.function_offsets,
+                tuple((f.name, tuple(f.arg_list)) for f in text.functions))
+
+    def _InputHash(self, input_path):
+        if self._input_manifest is None:
+            return None
+
+        return self._input_manifest.ContentHash(input_path)
+
+    def _SiteInputHashes(self, template_path):
+        # Every output depends on the info file, the config and its own template.
+        return (self._InputHash(self._info_path), self._InputHash('config'), self._InputHash(template_path))
+
+    def _HomepageDeps(self):
+        # The homepage lists the title, date, description and tags of every post. The title and
+        # date come from the post path.
+        posts_deps = tuple((post.path, SiteBuilder._TextDeps(post.description),
+                            tuple(SiteBuilder._TextDeps(t) for t in post.tags))
+                           for post in self._post_db.post_map.itervalues())
+
+        return (self._SiteInputHashes(self._config.template_homepage_path), posts_deps)
+
+    def _FeedDeps(self):
+        posts_deps = tuple((post.path, SiteBuilder._TextDeps(post.description),
+                            tuple(SiteBuilder._TextDeps(t) for t in post.tags))
+                           for post in self._post_db.post_map.values()[-self._info.nr_of_posts_in_feed:])
+
+        return (self._SiteInputHashes(self._config.template_feedpage_path), posts_deps)
+
+    def _HumansTxtDeps(self):
+        return self._SiteInputHashes(self._config.template_humans_txt_path)
+
+    def _PostpageDeps(self, post):
+        # Besides the post itself, a post page shows the titles and links of its neighbours, which
+        # are all derived from their paths.
+        def PathOrNone(p):
+            return p.path if p is not None else None
+
+        series_deps = tuple((SiteBuilder._TextDeps(s), PathOrNone(post.prev_post_by_series[s]),
+                             PathOrNone(post.next_post_by_series[s])) for s in post.series)
+
+        return (self._SiteInputHashes(self._config.template_postpage_path),
+                self._InputHash(self._info.posts_dir + post.path),
+                PathOrNone(post.prev_post), PathOrNone(post.next_post), series_deps)
+
+    def _CanKeepPostpage(self, post, postpage_path, postpage_fingerprint):
+        if self._previous_manifest is None:
+            return False
+
+        previous_post_page = self._previous_manifest.post_pages.get(post.path)
+
+        if previous_post_page is None:
+            return False
+
+        (previous_fingerprint, previous_postpage_path, _) = previous_post_page
+
+        if previous_fingerprint != postpage_fingerprint or previous_postpage_path != postpage_path:
+            return False
+
+        return os.path.isfile(os.path.join(self._info.output_dir, self._info.output_posts_dir, postpage_path))
+
     @property
     def config(self):
         return self._config
@@ -443,191 +672,359 @@ class SiteBuilder(object):
     def post_db(self):
         return self._post_db
 
-    @staticmethod
-    def _EvaluateTextToText(text):
-        text_file = StringIO.StringIO()
-
-        for atom in text.atoms:
-            if isinstance(atom, model.Word):
-                text_file.write(atom.text)
-                text_file.write(' ')
-            elif isinstance(atom, model.Function):
-                if atom.name == 'slash':
-                    text_file.write('\\')
-                    text_file.write(' ')
-                elif atom.name == 'brace-beg':
-                    text_file.write('{')
-                    text_file.write(' ')
-                elif atom.name == 'brace-end':
-                    text_file.write('}')
-                    text_file.write(' ')
-                elif atom.name == 'f':
-                    text_file.write(atom.arg_list[0])
-                    text_file.write(' ')
-                elif atom.name == 'def':
-                    text_file.write(atom.arg_list[0])
-                    text_file.write(' ')
-                elif atom.name == 'ref':
-                    text_file.write(atom.arg_list[0])
-                    text_file.write(' ')
-                else:
-                    print('Unknown function %s - skipping' % atom.name)
-            else:
-                raise errors.Error('Unknown atom')
+    @property
+    def post_pages(self):
+        return self._post_pages
 
-        text_file.seek(-1, 2)
-        text_str = text_file.getvalue()
-        text_file.close()
+    @property
+    def output_fingerprints(self):
+        return self._output_fingerprints
 
-        return text_str
+    @property
+    def highlighter(self):
+        return self._highlighter
 
     @staticmethod
-    def _EvaluateTextToHTML(text):
-        html_file = StringIO.StringIO()
-
-        for atom in text.atoms:
-            if isinstance(atom, model.Word):
-                html_file.write(atom.text)
-                html_file.write(' ')
-            elif isinstance(atom, model.Function):
-                if atom.name == 'slash':
-                    html_file.write('&#92;')
-                    html_file.write(' ')
-                elif atom.name == 'brace-beg':
-                    html_file.write('{')
-                    html_file.write(' ')
-                elif atom.name == 'brace-end':
-                    html_file.write('}')
-                    html_file.write(' ')
-                elif atom.name == 'f':
-                    html_file.write('\(')
-                    html_file.write(atom.arg_list[0])
-                    html_file.write('\)')
-                    html_file.write(' ')
-                elif atom.name == 'def':
-                    html_file.write('<strong>')
-                    html_file.write(atom.arg_list[0])
-                    html_file.write('</strong>')
-                    html_file.write(' ')
-                elif atom.name == 'ref':
-                    html_file.write('<a href="#">')
-                    html_file.write(atom.arg_list[0])
-                    html_file.write('</a>')
-                    html_file.write(' ')
-                else:
-                    print('Unknown function %s - skipping' % atom.name)
-            else:
-                raise errors.Error('Unknown atom')
+    def _EvaluateTextToText(text, function_registry):
+        return SiteBuilder._EvaluateText(text, function_registry.EvaluateToText)
 
-        html_file.seek(-1, 2)
-        html_str = html_file.getvalue()
-        html_file.close()
+    @staticmethod
+    def _EvaluateTextToHTML(text, function_registry):
+        return SiteBuilder._EvaluateText(text, function_registry.EvaluateToHTML)
+
+    @staticmethod
+    def _EvaluateText(text, evaluate_function):
+        # Words are stored the way they are rendered, so only the functions need any work.
+        if len(text.functions) == 0:
+            return text.words_text
+
+        words_text = text.words_text
+        pieces = []
+        c_pos = 0
 
-        return html_str
+        for (function_offset, function) in zip(text.function_offsets, text.functions):
+            pieces.append(words_text[c_pos:function_offset])
+            pieces.append(evaluate_function(function))
+            c_pos = function_offset
+
+        pieces.append(words_text[c_pos:])
+
+        return ''.join(pieces)
 
     @staticmethod
-    def _LinearizeSectionToLineUnits(info_path, config, section, level):
+    def _LinearizeEventsToLineUnits(info_path, config, highlighter, post_path, events):
+        # Line units are built straight from parse events, which come in document order, so
+        # no section tree needs to be walked. Code blocks are numbered in that order, to name
+        # them in the guessed lexers report.
         line_units = []
         extra_image_units = []
+        code_block_count = 0
 
-        if level >= 1:
-            line_units.append({})
-            line_units[-1]['type'] = 'header'
-            line_units[-1]['level'] = \
-                min(config.presentation_article_subtitle_heading_level_min + level - 1,
-                    config.presentation_article_subtitle_heading_level_max)
-            line_units[-1]['text_html'] = SiteBuilder._EvaluateTextToHTML(section.title)
-
-        for paragraph in section.paragraphs:
-            line_units.append({})
-
-            if isinstance(paragraph.cell, model.Textual):
-                line_units[-1]['type'] = 'textual'
-                line_units[-1]['text_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.text)
-            elif isinstance(paragraph.cell, model.List):
-                line_units[-1]['type'] = 'list'
-                if paragraph.cell.header_text is not None:
-                    line_units[-1]['has_header'] = True
-                    line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text)
-                else:
-                    line_units[-1]['has_header'] = False
-                line_units[-1]['items'] = [SiteBuilder._EvaluateTextToHTML(l) for l in paragraph.cell.items]
-            elif isinstance(paragraph.cell, model.Formula):
-                line_units[-1]['type'] = 'formula'
-                if paragraph.cell.header_text is not None:
-                    line_units[-1]['has_header'] = True
-                    line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text)
-                else:
-                    line_units[-1]['has_header'] = False
-                line_units[-1]['formula'] = paragraph.cell.formula
-            elif isinstance(paragraph.cell, model.CodeBlock):
-                line_units[-1]['type'] = 'code-block'
-                if paragraph.cell.header_text is not None:
-                    line_units[-1]['has_header'] = True
-                    line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text)
+        for (kind, level, payload) in events:
+            if kind == model_parser.PARAGRAPH:
+                if isinstance(payload.cell, model.CodeBlock):
+                    code_block_count += 1
+                    code_block_name = '%s#%d' % (post_path, code_block_count)
                 else:
-                    line_units[-1]['has_header'] = False
-
-                try:
-                    lexer = pygments.lexers.get_lexer_by_name(paragraph.cell.language)
-                except pygments.util.ClassNotFound as e:
-                    lexer = pygments.lexers.guess_lexer(paragraph.cell.code)
-
-                formatter = pygments.formatters.HtmlFormatter(linenos=True, cssclass='code-block-highlight', cssstyles='font-size:0.75em;')
-
-                line_units[-1]['code_html'] = pygments.highlight(paragraph.cell.code, lexer, formatter)
-            elif isinstance(paragraph.cell, model.Image):
-                line_units[-1]['type'] = 'image'
-                if paragraph.cell.header_text is not None:
-                    line_units[-1]['has_header'] = True
-                    line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text)
-                    line_units[-1]['alt_text'] = SiteBuilder._EvaluateTextToText(paragraph.cell.header_text)
-                else:
-                    line_units[-1]['has_header'] = False
-                    line_units[-1]['alt_text'] = ''
+                    code_block_name = None
+
+                SiteBuilder._LinearizeParagraph(info_path, config, highlighter, payload, code_block_name,
+                                                line_units, extra_image_units)
+            elif kind == model_parser.SECTION_START and level >= 1:
+                line_units.append({})
+                line_units[-1]['type'] = 'header'
+                line_units[-1]['level'] = \
+                    min(config.presentation_article_subtitle_heading_level_min + level - 1,
+                        config.presentation_article_subtitle_heading_level_max)
+                line_units[-1]['text_html'] = SiteBuilder._EvaluateTextToHTML(payload, config.function_registry)
+
+        return (line_units, extra_image_units)
 
-                split_path = urlparse.urlparse(paragraph.cell.path)
+    @staticmethod
+    def _LinearizeParagraph(info_path, config, highlighter, paragraph, code_block_name, line_units,
+                            extra_image_units):
+        line_units.append({})
+
+        if isinstance(paragraph.cell, model.Textual):
+            line_units[-1]['type'] = 'textual'
+            line_units[-1]['text_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.text, config.function_registry)
+        elif isinstance(paragraph.cell, model.List):
+            line_units[-1]['type'] = 'list'
+            if paragraph.cell.header_text is not None:
+                line_units[-1]['has_header'] = True
+                line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text, config.function_registry)
+            else:
+                line_units[-1]['has_header'] = False
+            line_units[-1]['items'] = [SiteBuilder._EvaluateTextToHTML(l, config.function_registry) for l in paragraph.cell.items]
+        elif isinstance(paragraph.cell, model.Formula):
+            line_units[-1]['type'] = 'formula'
+            if paragraph.cell.header_text is not None:
+                line_units[-1]['has_header'] = True
+                line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text, config.function_registry)
+            else:
+                line_units[-1]['has_header'] = False
+            line_units[-1]['formula'] = paragraph.cell.formula
+        elif isinstance(paragraph.cell, model.CodeBlock):
+            line_units[-1]['type'] = 'code-block'
+            if paragraph.cell.header_text is not None:
+                line_units[-1]['has_header'] = True
+                line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text, config.function_registry)
+            else:
+                line_units[-1]['has_header'] = False
+
+            line_units[-1]['code_html'] = highlighter.Highlight(paragraph.cell.code, paragraph.cell.language,
+                                                                code_block_name)
+        elif isinstance(paragraph.cell, model.Image):
+            line_units[-1]['type'] = 'image'
+            if paragraph.cell.header_text is not None:
+                line_units[-1]['has_header'] = True
+                line_units[-1]['header_html'] = SiteBuilder._EvaluateTextToHTML(paragraph.cell.header_text, config.function_registry)
+                line_units[-1]['alt_text'] = SiteBuilder._EvaluateTextToText(paragraph.cell.header_text, config.function_registry)
+            else:
+                line_units[-1]['has_header'] = False
+                line_units[-1]['alt_text'] = ''
 
-                if split_path.scheme == 'http' or split_path.scheme == 'https':
-                    line_units[-1]['path'] = paragraph.cell.path
-                elif split_path.scheme == '':
-                    image_basename = os.path.normpath(paragraph.cell.path).replace('/', '_')
-                    line_units[-1]['path'] = '/img/%s' % image_basename
+            split_path = urlparse.urlparse(paragraph.cell.path)
 
-                    if os.path.isabs(paragraph.cell.path):
-                        extra_image_path = paragraph.cell.path
-                    else:
-                        extra_image_path = os.path.join(os.path.dirname(info_path), paragraph.cell.path)
+            if split_path.scheme == 'http' or split_path.scheme == 'https':
+                line_units[-1]['path'] = paragraph.cell.path
+            elif split_path.scheme == '':
+                image_basename = os.path.normpath(paragraph.cell.path).replace('/', '_')
+                line_units[-1]['path'] = '/img/%s' % image_basename
 
-                    extra_image_units.append((image_basename, output.Copy(output.CrawlMode.CRAWLABLE, extra_image_path)))
+                if os.path.isabs(paragraph.cell.path):
+                    extra_image_path = paragraph.cell.path
                 else:
-                    raise errors.Error('Unsupported path format')
+                    extra_image_path = os.path.join(os.path.dirname(info_path), paragraph.cell.path)
+
+                extra_image_units.append((image_basename, output.Copy(output.CrawlMode.CRAWLABLE, extra_image_path)))
             else:
-                raise errors.Error('Q')
+                raise errors.Error('Unsupported path format')
+        else:
+            raise errors.Error('Q')
 
-        for subsection in section.subsections:
-            (sub_line_units, sub_extra_image_units) = SiteBuilder._LinearizeSectionToLineUnits(info_path, config, subsection, level+1)
-            line_units.extend(sub_line_units)
-            extra_image_units.extend(sub_extra_image_units)
+# The site builder a pool worker generates post pages with, set once when the worker starts.
+_postpage_worker_site_builder = None
 
-        return (line_units, extra_image_units)
+def _InitPostpageWorker(site_builder):
+    global _postpage_worker_site_builder
+
+    _postpage_worker_site_builder = site_builder
+
+def _GeneratePostpageInWorker(post_path):
+    # Returns errors instead of raising them. What the page adds to the unknown functions and
+    # guessed lexers reports is sent back too, for the main process to merge, along with the
+    # shared texts this worker evaluated for the first time, and the unknown functions of each.
+    site_builder = _postpage_worker_site_builder
+    unknown_names = site_builder._config.function_registry.unknown_names
+    guessed_blocks = site_builder.highlighter.guessed_blocks
+    unknown_names.clear()
+    guessed_blocks.clear()
+    site_builder._new_evaluated_texts = []
+
+    try:
+        postpage = site_builder._GeneratePostpage(site_builder._post_db.post_map[post_path])
+
+        return (postpage, collections.Counter(unknown_names), dict(guessed_blocks),
+                site_builder._new_evaluated_texts, None)
+    except errors.Error as e:
+        return (None, None, None, None, e)
 
 HELP_DESCRIPTION = 'Blogula - a blog generator'
 HELP_INFO = 'Path to blog information file'
+HELP_CACHE_DIR = 'Directory for caches kept between builds (default: .blogula_cache next to the info file)'
+HELP_NO_PARSE_CACHE = 'Parse every post from scratch, without reading or writing the parse cache'
+HELP_JOBS = 'Number of processes to parse posts and generate post pages with (default: 1)'
+HELP_FULL = 'Rebuild the whole output dir, even if an earlier build can be updated in place'
+HELP_WATCH = 'Keep running, and rebuild whenever a post, template or other input changes'
+HELP_LAZY_BODIES = 'In watch mode, keep only post headers in memory, and load each post body again when its page is generated'
+HELP_LIST = 'List the posts, from the post index where possible, without building anything'
+
+PARSE_CACHE_MAX_SIZE = 256 * 1024 * 1024
+TEMPLATE_CACHE_MAX_SIZE = 16 * 1024 * 1024
+HIGHLIGHT_CACHE_MAX_SIZE = 64 * 1024 * 1024
+WATCH_PARSE_CACHE_MAX_ENTRIES = 4096
 
 def main(argv):
     arg_parser = argparse.ArgumentParser(description=HELP_DESCRIPTION)
     arg_parser.add_argument('-i', '--info_path', metavar='PATH', type=str, help=HELP_INFO, required=True)
+    arg_parser.add_argument('--cache-dir', metavar='PATH', type=str, help=HELP_CACHE_DIR)
+    arg_parser.add_argument('--no-parse-cache', action='store_true', help=HELP_NO_PARSE_CACHE)
+    arg_parser.add_argument('--jobs', metavar='N', type=int, default=1, help=HELP_JOBS)
+    arg_parser.add_argument('--full', action='store_true', help=HELP_FULL)
+    arg_parser.add_argument('--watch', action='store_true', help=HELP_WATCH)
+    arg_parser.add_argument('--lazy-bodies', action='store_true', help=HELP_LAZY_BODIES)
+    arg_parser.add_argument('--list', action='store_true', help=HELP_LIST)
     args = arg_parser.parse_args(argv[1:])
 
+    if args.jobs < 1:
+        arg_parser.error('--jobs must be at least 1')
+
+    if args.cache_dir is not None:
+        cache_dir = args.cache_dir
+    else:
+        cache_dir = os.path.join(os.path.dirname(args.info_path), '.blogula_cache')
+
+    if args.no_parse_cache:
+        parse_cache = None
+    else:
+        parse_cache = cache.DiskCache(os.path.join(cache_dir, 'parse'), PARSE_CACHE_MAX_SIZE)
+
+    template_cache = cache.DiskCache(os.path.join(cache_dir, 'templates'), TEMPLATE_CACHE_MAX_SIZE)
+    highlight_cache = cache.DiskCache(os.path.join(cache_dir, 'highlight'), HIGHLIGHT_CACHE_MAX_SIZE)
+    manifest_path = os.path.join(cache_dir, 'manifest')
+    previous_manifest = manifest.Manifest.Load(manifest_path)
+    post_index_path = os.path.join(cache_dir, 'posts')
+
+    if args.list:
+        _List(args.info_path, parse_cache, previous_manifest, post_index_path)
+        return
+
+    if not args.watch:
+        _Build(args.info_path, parse_cache, template_cache, highlight_cache, args.jobs, args.full, previous_manifest,
+               manifest_path, post_index_path, args.lazy_bodies)
+        return
+
+    _Watch(args.info_path, parse_cache, template_cache, highlight_cache, args.jobs, args.full, previous_manifest,
+           manifest_path, post_index_path, args.lazy_bodies)
+
+def _List(info_path, parse_cache, previous_manifest, post_index_path):
+    config = _ParseConfig('config')
+    info = model_parser.ParseInfo(info_path)
+
+    # Only posts which changed since the last build are opened. The manifest is not saved, as
+    # it must keep describing the last build.
+    post_paths = model_parser.ListPostPaths(info)
+    input_manifest = previous_manifest.Scan([p for (_, p) in post_paths])
+    headers_index = model_parser.LoadPostIndex(post_index_path, info)
+    post_db = model_parser.ParsePostDB(info, parse_cache, 1, input_manifest, None, True, headers_index)
+    headers_index.Save(post_index_path)
+
+    for post in post_db.post_map.itervalues():
+        post_line = '%s  %s' % (post.date.isoformat(), SiteBuilder._EvaluateTextToText(post.title, config.function_registry).strip())
+
+        if len(post.series) > 0:
+            post_line += '  [%s]' % ', '.join(SiteBuilder._EvaluateTextToText(s, config.function_registry).strip() for s in post.series)
+
+        if len(post.tags) > 0:
+            post_line += '  (%s)' % ', '.join(SiteBuilder._EvaluateTextToText(t, config.function_registry).strip() for t in post.tags)
+
+        print post_line
+
+def _Build(info_path, parse_cache, template_cache, highlight_cache, jobs, full, previous_manifest,
+           manifest_path, post_index_path, lazy_bodies, parse_states=None):
     config = _ParseConfig('config')
-    info = model_parser.ParseInfo(args.info_path)
-    post_db = model_parser.ParsePostDB(info)
+    info = model_parser.ParseInfo(info_path)
+
+    # The manifest of the previous build tells which inputs changed since. Only the pages
+    # which depend on them are generated again, and the output dir is updated in place.
+    post_paths = model_parser.ListPostPaths(info)
+    site_input_paths = _SiteInputPaths(info_path, config, info)
+    input_manifest = previous_manifest.Scan(site_input_paths + [p for (_, p) in post_paths])
+
+    in_place = (not full and previous_manifest.output_dir == info.output_dir and
+                os.path.isdir(info.output_dir))
+
+    # A single build generates each post page at most once, so post bodies are only loaded,
+    # from the parse cache or the post file, as their pages are generated. Watch mode keeps
+    # the trees between builds, to parse edits to them again quickly, unless bodies are lazy.
+    headers_index = model_parser.LoadPostIndex(post_index_path, info)
+    post_db = model_parser.ParsePostDB(info, parse_cache, jobs, input_manifest, parse_states,
+                                       lazy_bodies or parse_states is None, headers_index)
+
+    if in_place:
+        site_generator = SiteBuilder(info_path, config, info, post_db, input_manifest, previous_manifest,
+                                     template_cache, highlight_cache, jobs)
+    else:
+        site_generator = SiteBuilder(info_path, config, info, post_db, input_manifest, None, template_cache,
+                                     highlight_cache, jobs)
 
-    site_generator = SiteBuilder(args.info_path, config, info, post_db)
     out_dir = site_generator.Generate()
+    unknown_functions_report = config.function_registry.UnknownNamesReport()
+
+    guessed_lexers_report = site_generator.highlighter.GuessedLexersReport()
+
+    if unknown_functions_report is not None:
+        print unknown_functions_report
+
+    if guessed_lexers_report is not None:
+        print guessed_lexers_report
+
+    output.WriteLocalOutput(info.output_dir, out_dir, in_place)
+    build_manifest = input_manifest.WithOutputs(info.output_dir, site_generator.post_pages,
+                                                site_generator.output_fingerprints)
+    build_manifest.Save(manifest_path)
+    headers_index.Save(post_index_path)
+
+    return (build_manifest, [info.posts_dir], site_input_paths)
+
+def _Watch(info_path, parse_cache, template_cache, highlight_cache, jobs, full, previous_manifest,
+           manifest_path, post_index_path, lazy_bodies):
+    # Parse results stay in memory between builds, and the manifest of the last build is
+    # kept around instead of being loaded again. Only the first build uses process pools, as
+    # later ones only parse the posts which changed, and only the paragraphs which changed in
+    # them, and only generate the pages which depend on these. Lazy bodies are not kept in
+    # memory, so they are only cached on disk.
+    if not lazy_bodies:
+        memory_parse_cache = cache.MemoryCache(WATCH_PARSE_CACHE_MAX_ENTRIES, parse_cache)
+    else:
+        memory_parse_cache = parse_cache
+
+    parse_states = {}
+    build_parse_cache = memory_parse_cache if jobs == 1 else parse_cache
+    watcher = None
+    # Until a build gets far enough to know its inputs, watch everything next to the info file,
+    # except for what builds write themselves, which would trigger builds.
+    watch_dir_paths = [os.path.dirname(info_path) or '.']
+    watch_file_paths = ['config']
+    cache_dir = os.path.dirname(manifest_path) or '.'
 
-    output.WriteLocalOutput(info.output_dir, out_dir)
+    try:
+        while True:
+            try:
+                (previous_manifest, watch_dir_paths, watch_file_paths) = \
+                    _Build(info_path, build_parse_cache, template_cache, highlight_cache, jobs, full, previous_manifest,
+                           manifest_path, post_index_path, lazy_bodies, parse_states)
+                print 'Built at %s' % datetime.datetime.now().strftime('%H:%M:%S')
+                full = False
+            except errors.Error as e:
+                # Keep watching the inputs of the last good build, so fixing the error
+                # triggers a new one.
+                print 'Build failed: %s' % e
+
+            (build_parse_cache, jobs) = (memory_parse_cache, 1)
+
+            excluded_dir_paths = _BuildOutputDirPaths(info_path, cache_dir)
+
+            if watcher is None or watcher.dir_paths != watch_dir_paths or watcher.file_paths != watch_file_paths or \
+               watcher.excluded_dir_paths != excluded_dir_paths:
+                if watcher is not None:
+                    watcher.Close()
+
+                watcher = watch.NewWatcher(watch_dir_paths, watch_file_paths, excluded_dir_paths)
+
+            watcher.Wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.Close()
+
+def _BuildOutputDirPaths(info_path, cache_dir):
+    # The output dir is only known if the info file parses.
+    try:
+        return [model_parser.ParseInfo(info_path).output_dir, cache_dir]
+    except errors.Error:
+        return [cache_dir]
+
+def _SiteInputPaths(info_path, config, info):
+    # Every input other than the posts themselves. A change to any of them can show up on
+    # every page.
+    return [info_path, 'config', config.template_homepage_path, config.template_postpage_path,
+            config.template_feedpage_path, config.template_blogula_css_path,
+            config.template_sitemap_xml_path, config.template_robots_txt_path,
+            config.template_humans_txt_path,
+            os.path.join(os.path.dirname(info_path), info.avatar_path)]
 
 if __name__ == '__main__':
     main(sys.argv)
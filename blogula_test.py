@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+import blogula
+import cache
+import manifest
+import model_parser as mp
+import output
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_INFO = '''Title: Blog
+URL: example.com
+Author: A
+Email: a@example.com
+Twitter: a
+Location: B
+AvatarPath: avatar.jpg
+Description: A blog
+Series: [Series]
+NrOfPostsInFeed: 2
+PostsDir: posts
+OutputDir: out
+Output:
+  HomePagePath: index.html
+  PostsDir: posts
+'''
+
+class _SiteTestCase(unittest.TestCase):
+    # Builds a small site in a temporary dir, with the templates and config of the repo.
+
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+        self._cwd = os.getcwd()
+        os.chdir(self._dir_path)
+        self._mtime = 1000000000
+
+        shutil.copytree(os.path.join(_REPO_DIR, 'templates'), 'templates')
+        os.mkdir(os.path.join('templates', 'foundation'))
+        os.mkdir('posts')
+        self._Write('config', open(os.path.join(_REPO_DIR, 'config')).read())
+        self._Write('info', _INFO)
+        self._Write('avatar.jpg', 'avatar')
+
+        self._info_path = os.path.join(self._dir_path, 'info')
+        self._manifest_path = os.path.join(self._dir_path, 'cache', 'manifest')
+        self._post_index_path = os.path.join(self._dir_path, 'cache', 'posts')
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._dir_path)
+
+    def _Write(self, path, text):
+        # Every write gets a later mtime, so the manifest sees it even if the size is the same.
+        with open(path, 'w') as written_file:
+            written_file.write(text)
+
+        self._mtime = self._mtime + 10
+        os.utime(path, (self._mtime, self._mtime))
+
+    def _WritePost(self, name, text):
+        self._Write(os.path.join('posts', name), text)
+
+    def _Build(self, jobs=1, lazy_bodies=False, parse_cache=None):
+        # Runs a build like the command line does, and returns the output units it produced,
+        # by path. The units of kept outputs are output.Keep ones.
+        out_dirs = []
+        write_local_output = blogula.output.WriteLocalOutput
+
+        def WriteLocalOutput(base_dir_path, out_dir, incremental=False):
+            out_dirs.append(out_dir)
+            write_local_output(base_dir_path, out_dir, incremental)
+
+        blogula.output.WriteLocalOutput = WriteLocalOutput
+
+        try:
+            blogula._Build(self._info_path, parse_cache, None, None, jobs, False,
+                           manifest.Manifest.Load(self._manifest_path), self._manifest_path,
+                           self._post_index_path, lazy_bodies)
+        finally:
+            blogula.output.WriteLocalOutput = write_local_output
+
+        return _Units('', out_dirs[0])
+
+class TestLazyBodies(_SiteTestCase):
+    def test_LoadedOncePerPage(self):
+        for ii in range(3):
+            self._WritePost('2014.01.%02d - Post %d' % (ii + 1, ii),
+                            'Post %d.\n\n=Part=\n\n%%code{c}{int x;}\n\nMore.\n' % ii)
+
+        load_post_events = mp._LoadPostEvents
+        loads = collections.Counter()
+
+        def LoadPostEvents(post_path_full, content_hash, parse_cache):
+            loads[os.path.basename(post_path_full)] += 1
+            return load_post_events(post_path_full, content_hash, parse_cache)
+
+        mp._LoadPostEvents = LoadPostEvents
+
+        try:
+            self._Build()
+            self.assertEqual({'2014.01.01 - Post 0': 1, '2014.01.02 - Post 1': 1, '2014.01.03 - Post 2': 1}, loads)
+
+            loads.clear()
+            self._WritePost('2014.01.02 - Post 1', 'Post 1, edited.\n')
+            self._Build()
+            self.assertEqual({'2014.01.02 - Post 1': 1}, loads)
+        finally:
+            mp._LoadPostEvents = load_post_events
+
+class TestParseCache(_SiteTestCase):
+    def test_UnchangedPostsNotParsedAgain(self):
+        parse_cache = cache.DiskCache(os.path.join(self._dir_path, 'cache', 'parse'), 1024 * 1024)
+
+        for ii in range(3):
+            self._WritePost('2014.01.%02d - Post %d' % (ii + 1, ii), 'Post %d.\n\n=Part=\n\nMore.\n' % ii)
+
+        self._Build(parse_cache=parse_cache)
+
+        # Every post page is generated again, from the bodies in the parse cache.
+        self._Write(os.path.join('templates', 'postpage.html'),
+                    open(os.path.join('templates', 'postpage.html')).read() + '\n')
+        parse_post_headers = mp._ParsePostHeaders
+
+        def FailParsePostHeaders(*args, **kwargs):
+            raise AssertionError('Post parsed again')
+
+        mp._ParsePostHeaders = FailParsePostHeaders
+
+        try:
+            units = self._Build(parse_cache=parse_cache)
+        finally:
+            mp._ParsePostHeaders = parse_post_headers
+
+        self.assertEqual([output.File] * 3, [type(units['posts/post_%d.html' % ii]) for ii in range(3)])
+
+class TestSharedTexts(_SiteTestCase):
+    def setUp(self):
+        super(TestSharedTexts, self).setUp()
+
+        for ii in range(3):
+            self._WritePost('2014.01.%02d - Post %d' % (ii + 1, ii),
+                            'Tags: \\missing{x} shared, other\nPost %d, \\missing{y}.\n' % ii)
+
+    def _Generate(self, site_builder_class):
+        config = blogula._ParseConfig('config')
+        info = mp.ParseInfo(self._info_path)
+        site_builder_class(self._info_path, config, info, mp.ParsePostDB(info)).Generate()
+
+        return config.function_registry.unknown_names
+
+    def test_EvaluatedOnce(self):
+        evaluate_text_to_text = blogula.SiteBuilder._EvaluateTextToText
+        evaluate_text_to_html = blogula.SiteBuilder._EvaluateTextToHTML
+        evaluations = collections.Counter()
+
+        def EvaluateTextToText(text, function_registry):
+            evaluations[('text', text.words_text)] += 1
+            return evaluate_text_to_text(text, function_registry)
+
+        def EvaluateTextToHTML(text, function_registry):
+            evaluations[('html', text.words_text)] += 1
+            return evaluate_text_to_html(text, function_registry)
+
+        blogula.SiteBuilder._EvaluateTextToText = staticmethod(EvaluateTextToText)
+        blogula.SiteBuilder._EvaluateTextToHTML = staticmethod(EvaluateTextToHTML)
+
+        try:
+            self._Generate(blogula.SiteBuilder)
+        finally:
+            blogula.SiteBuilder._EvaluateTextToText = staticmethod(evaluate_text_to_text)
+            blogula.SiteBuilder._EvaluateTextToHTML = staticmethod(evaluate_text_to_html)
+
+        # The shared tag is on the homepage, the feed and every post page.
+        self.assertEqual(1, evaluations[('text', 'shared ')])
+        self.assertEqual(1, evaluations[('html', 'shared ')])
+
+    def test_UnknownNamesAsUncached(self):
+        class UncachedSiteBuilder(blogula.SiteBuilder):
+            def _EvaluateTextOnce(self, text, evaluated_texts, evaluate):
+                return evaluate(text, self._config.function_registry)
+
+        unknown_names = self._Generate(blogula.SiteBuilder)
+
+        self.assertEqual(self._Generate(UncachedSiteBuilder), unknown_names)
+        self.assertGreater(unknown_names['missing'], 6)
+
+class TestGuessedLexers(_SiteTestCase):
+    def test_BlocksNamedByPostAndIndex(self):
+        self._WritePost('2014.01.01 - Post', 'Text.\n\n%code{c}{int x;}\n\n%code{no-such-language}{x}\n')
+        config = blogula._ParseConfig('config')
+        info = mp.ParseInfo(self._info_path)
+        site_builder = blogula.SiteBuilder(self._info_path, config, info, mp.ParsePostDB(info))
+        site_builder.Generate()
+
+        self.assertEqual([['/2014.01.01 - Post#2 (no-such-language)']],
+                         site_builder.highlighter.guessed_blocks.values())
+
+class TestParallelBuild(_SiteTestCase):
+    def setUp(self):
+        super(TestParallelBuild, self).setUp()
+
+        os.mkdir('imgs')
+
+        for ii in range(8):
+            self._Write(os.path.join('imgs', '%d.png' % ii), 'image %d' % ii)
+            self._WritePost('2014.01.%02d - Post %d' % (ii + 1, ii),
+                            ('Series: Series\n' if ii % 2 == 0 else '') +
+                            'Tags: \\missing{x} shared, tag %d\n' % (ii % 3) +
+                            'Post %d, \\missing{y}.\n\n=Part=\n\n%%image{imgs/%d.png}\n\n' % (ii, ii) +
+                            '%%code{c}{int x;}\n\n%%code{no-such-language}{x = %d}\n' % ii)
+
+    def _Generate(self, jobs):
+        config = blogula._ParseConfig('config')
+        info = mp.ParseInfo(self._info_path)
+        site_builder = blogula.SiteBuilder(self._info_path, config, info, mp.ParsePostDB(info), jobs=jobs)
+        units = _Units('', site_builder.Generate())
+
+        # The build date on these changes from one build to the next.
+        for path in ['feed.xml', 'humans.txt']:
+            units[path] = output.File('text/plain', units[path].crawl_mode, '')
+
+        return (dict((p, _UnitState(u)) for (p, u) in units.iteritems()), site_builder.post_pages,
+                config.function_registry.unknown_names, dict(site_builder.highlighter.guessed_blocks),
+                site_builder._text_texts, site_builder._text_htmls)
+
+    def test_SameAsSerial(self):
+        self.assertEqual(self._Generate(1), self._Generate(3))
+
+class TestWatch(_SiteTestCase):
+    def test_BuildOutputDirPaths(self):
+        cache_dir = os.path.join(self._dir_path, 'cache')
+
+        self.assertEqual([os.path.join(self._dir_path, 'out'), cache_dir],
+                         blogula._BuildOutputDirPaths(self._info_path, cache_dir))
+
+        # Without an info file, only the cache dir is known.
+        self._Write('info', 'Title: [')
+        self.assertEqual([cache_dir], blogula._BuildOutputDirPaths(self._info_path, cache_dir))
+
+class TestIncrementalBuild(_SiteTestCase):
+    # Changes one kind of input after a first build, and checks which pages the next build
+    # generates again, and which it keeps from the first one.
+
+    _PAGES = ['index.html', 'feed.xml', 'humans.txt', 'sitemap.xml', 'robots.txt', 'posts/alpha.html',
+              'posts/beta.html', 'posts/gamma.html', 'posts/delta.html']
+
+    def setUp(self):
+        super(TestIncrementalBuild, self).setUp()
+
+        os.mkdir('imgs')
+        self._Write(os.path.join('imgs', 'a.png'), 'image')
+        self._WritePost('2014.01.01 - Alpha', 'Series: Series\nAlpha text.\n\n%image{imgs/a.png}\n')
+        self._WritePost('2014.01.02 - Beta', 'Tags: one\nBeta text.\n\nMore beta text.\n')
+        self._WritePost('2014.01.03 - Gamma', 'Series: Series\nGamma text.\n')
+        self._WritePost('2014.01.04 - Delta', 'Delta text.\n')
+        self._AssertRebuilt(self._PAGES)
+
+    def _AssertRebuilt(self, regenerated_pages, pages=None):
+        units = self._Build()
+        pages = pages if pages is not None else self._PAGES
+
+        self.assertEqual(dict((p, output.File if p in regenerated_pages else output.Keep) for p in pages),
+                         dict((p, type(u)) for (p, u) in units.iteritems() if isinstance(u, (output.File, output.Keep))
+                              and p != 'code_highlight.css'))
+
+    def test_NoChange(self):
+        self._AssertRebuilt([])
+
+    def test_PostEdit(self):
+        self._WritePost('2014.01.02 - Beta', 'Tags: one\nBeta text.\n\nEdited beta text.\n')
+        self._AssertRebuilt(['posts/beta.html'])
+
+    def test_DescriptionEdit(self):
+        self._WritePost('2014.01.02 - Beta', 'Tags: one\nEdited beta text.\n\nMore beta text.\n')
+        self._AssertRebuilt(['index.html', 'posts/beta.html'])
+
+        # The feed lists only the latest posts.
+        self._WritePost('2014.01.04 - Delta', 'Edited delta text.\n')
+        self._AssertRebuilt(['index.html', 'feed.xml', 'posts/delta.html'])
+
+    def test_TagsEdit(self):
+        self._WritePost('2014.01.02 - Beta', 'Tags: two\nBeta text.\n\nMore beta text.\n')
+        self._AssertRebuilt(['index.html', 'posts/beta.html'])
+
+    def test_Rename(self):
+        os.rename(os.path.join('posts', '2014.01.02 - Beta'), os.path.join('posts', '2014.01.02 - Bravo'))
+        self._AssertRebuilt(['index.html', 'sitemap.xml', 'posts/alpha.html', 'posts/bravo.html', 'posts/gamma.html'],
+                            [p for p in self._PAGES if p != 'posts/beta.html'] + ['posts/bravo.html'])
+
+    def test_SeriesEdit(self):
+        # The pages of the posts next to it in the series link to it now.
+        self._WritePost('2014.01.02 - Beta', 'Series: Series\nTags: one\nBeta text.\n\nMore beta text.\n')
+        self._AssertRebuilt(['posts/alpha.html', 'posts/beta.html', 'posts/gamma.html'])
+
+    def test_TemplateEdit(self):
+        self._Write(os.path.join('templates', 'postpage.html'),
+                    open(os.path.join('templates', 'postpage.html')).read() + '\n')
+        self._AssertRebuilt(['posts/alpha.html', 'posts/beta.html', 'posts/gamma.html', 'posts/delta.html'])
+
+        self._Write(os.path.join('templates', 'feed.xml'), open(os.path.join('templates', 'feed.xml')).read() + '\n')
+        self._AssertRebuilt(['feed.xml'])
+
+    def test_NewPost(self):
+        self._WritePost('2014.01.05 - Epsilon', 'Epsilon text.\n')
+        self._AssertRebuilt(['index.html', 'feed.xml', 'sitemap.xml', 'posts/delta.html', 'posts/epsilon.html'],
+                            self._PAGES + ['posts/epsilon.html'])
+
+    def test_DeletedPost(self):
+        os.remove(os.path.join('posts', '2014.01.04 - Delta'))
+        self._AssertRebuilt(['index.html', 'feed.xml', 'sitemap.xml', 'posts/gamma.html'],
+                            [p for p in self._PAGES if p != 'posts/delta.html'])
+
+    def test_ImageEdit(self):
+        # Pages only link to images, so none is generated again, but the image is copied again.
+        self._Write(os.path.join('imgs', 'a.png'), 'edited image')
+        self._AssertRebuilt([])
+
+        with open(os.path.join('out', 'img', 'imgs_a.png')) as image_file:
+            self.assertEqual('edited image', image_file.read())
+
+    def test_UnknownFunctionsOfGeneratedPagesOnly(self):
+        configs = []
+        parse_config = blogula._ParseConfig
+
+        def ParseConfig(config_path):
+            configs.append(parse_config(config_path))
+            return configs[-1]
+
+        blogula._ParseConfig = ParseConfig
+
+        try:
+            # The description shows on the homepage, and as text and in the body of the post page.
+            self._WritePost('2014.01.02 - Beta', 'Tags: one\nBeta \\missing{x} text.\n\nMore beta text.\n')
+            self._AssertRebuilt(['index.html', 'posts/beta.html'])
+            self._AssertRebuilt([])
+        finally:
+            blogula._ParseConfig = parse_config
+
+        self.assertEqual({'missing': 3}, configs[0].function_registry.unknown_names)
+        self.assertEqual({}, configs[1].function_registry.unknown_names)
+
+    def test_InfoEdit(self):
+        self._Write('info', _INFO.replace('Description: A blog', 'Description: Another blog'))
+        self._AssertRebuilt(self._PAGES)
+
+def _Units(path, unit):
+    if not isinstance(unit, output.Dir):
+        return {path: unit}
+
+    units = {}
+
+    for (subpath, subunit) in unit.units.iteritems():
+        units.update(_Units(os.path.join(path, subpath), subunit))
+
+    return units
+
+def _UnitState(unit):
+    if isinstance(unit, output.File):
+        return (type(unit), unit.mime_type, unit.crawl_mode, unit.content)
+
+    if isinstance(unit, output.Copy):
+        return (type(unit), unit.crawl_mode, unit.original_path)
+
+    return (type(unit), unit.crawl_mode)
+
+if __name__ == '__main__':
+    unittest.main()
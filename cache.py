@@ -0,0 +1,145 @@
+import cPickle
+import collections
+import os
+import os.path
+import tempfile
+
+class DiskCache(object):
+    """A directory of pickled values, keyed by strings, whose least recently used entries
+    are removed past max_size. Failing to read or write an entry is never an error."""
+
+    def __init__(self, dir_path, max_size):
+        assert isinstance(dir_path, str)
+        assert isinstance(max_size, int)
+        assert max_size > 0
+
+        self._dir_path = dir_path
+        self._max_size = max_size
+        self._size = None
+
+    def Get(self, key):
+        entry_path = self._EntryPath(key)
+
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                value = cPickle.load(entry_file)
+
+            os.utime(entry_path, None)
+
+            return value
+        except (IOError, OSError, EOFError, ValueError, TypeError, AttributeError, ImportError,
+                cPickle.UnpicklingError):
+            return None
+
+    def Put(self, key, value):
+        try:
+            data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError, RuntimeError):
+            return
+
+        try:
+            if not os.path.isdir(self._dir_path):
+                os.makedirs(self._dir_path)
+
+            # Write to a temporary file and rename it into place, so readers never see a
+            # partially written entry.
+            (temp_fd, temp_path) = tempfile.mkstemp(dir=self._dir_path, prefix='.tmp-')
+
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                temp_file.write(data)
+
+            os.rename(temp_path, self._EntryPath(key))
+        except (IOError, OSError):
+            return
+
+        if self._size is not None:
+            self._size = self._size + len(data)
+
+        self._Evict()
+
+    def _EntryPath(self, key):
+        return os.path.join(self._dir_path, key)
+
+    def _Evict(self):
+        if self._size is not None and self._size <= self._max_size:
+            return
+
+        try:
+            entries = []
+
+            for entry_name in os.listdir(self._dir_path):
+                if entry_name.startswith('.tmp-'):
+                    continue
+
+                entry_stat = os.stat(os.path.join(self._dir_path, entry_name))
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_name))
+
+            self._size = sum(entry_size for (_, entry_size, _) in entries)
+
+            if self._size <= self._max_size:
+                return
+
+            # Evict down to a bit below the limit, so the directory is not listed again on
+            # every following Put.
+            entries.sort()
+
+            for (_, entry_size, entry_name) in entries:
+                if self._size <= self._max_size * 3 // 4:
+                    break
+
+                os.remove(os.path.join(self._dir_path, entry_name))
+                self._size = self._size - entry_size
+        except (IOError, OSError):
+            self._size = None
+
+    @property
+    def dir_path(self):
+        return self._dir_path
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+class MemoryCache(object):
+    """An in-memory cache of up to max_entries values, in front of an optional DiskCache."""
+
+    def __init__(self, max_entries, backing_cache=None):
+        assert isinstance(max_entries, int)
+        assert max_entries > 0
+        assert backing_cache is None or isinstance(backing_cache, DiskCache)
+
+        self._max_entries = max_entries
+        self._backing_cache = backing_cache
+        self._values = collections.OrderedDict()
+
+    def Get(self, key):
+        value = self._values.pop(key, None)
+
+        if value is None and self._backing_cache is not None:
+            value = self._backing_cache.Get(key)
+
+        if value is not None:
+            self._Remember(key, value)
+
+        return value
+
+    def Put(self, key, value):
+        self._values.pop(key, None)
+        self._Remember(key, value)
+
+        if self._backing_cache is not None:
+            self._backing_cache.Put(key, value)
+
+    def _Remember(self, key, value):
+        self._values[key] = value
+
+        while len(self._values) > self._max_entries:
+            self._values.popitem(last=False)
+
+    @property
+    def max_entries(self):
+        return self._max_entries
+
+    @property
+    def backing_cache(self):
+        return self._backing_cache
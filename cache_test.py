@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
+
+    def test_GetAndPut(self):
+        disk_cache = cache.DiskCache(os.path.join(self._dir_path, 'c'), 1024 * 1024)
+
+        self.assertIsNone(disk_cache.Get('key'))
+
+        disk_cache.Put('key', ('hello', [1, 2, 3]))
+
+        self.assertEqual(('hello', [1, 2, 3]), disk_cache.Get('key'))
+        self.assertEqual(('hello', [1, 2, 3]), cache.DiskCache(disk_cache.dir_path, 1024).Get('key'))
+
+    def test_CorruptEntryIsAMiss(self):
+        disk_cache = cache.DiskCache(self._dir_path, 1024 * 1024)
+
+        with open(os.path.join(self._dir_path, 'key'), 'wb') as entry_file:
+            entry_file.write('not a pickle')
+
+        self.assertIsNone(disk_cache.Get('key'))
+
+    def test_EvictsLeastRecentlyUsed(self):
+        disk_cache = cache.DiskCache(self._dir_path, 4000)
+
+        for ii in range(3):
+            disk_cache.Put('key%d' % ii, 'x' * 1000)
+            os.utime(os.path.join(self._dir_path, 'key%d' % ii), (ii, ii))
+
+        disk_cache.Put('key3', 'x' * 1000)
+        disk_cache.Put('key4', 'x' * 1000)
+
+        self.assertIsNone(disk_cache.Get('key0'))
+        self.assertIsNone(disk_cache.Get('key1'))
+        self.assertIsNotNone(disk_cache.Get('key4'))
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self._dir_path, e))
+                                 for e in os.listdir(self._dir_path)), 4000)
+
+class TestMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
+
+    def test_EvictsLeastRecentlyUsed(self):
+        memory_cache = cache.MemoryCache(2)
+
+        memory_cache.Put('key0', 0)
+        memory_cache.Put('key1', 1)
+        memory_cache.Get('key0')
+        memory_cache.Put('key2', 2)
+
+        self.assertEqual(0, memory_cache.Get('key0'))
+        self.assertIsNone(memory_cache.Get('key1'))
+        self.assertEqual(2, memory_cache.Get('key2'))
+
+    def test_FallsBackToBackingCache(self):
+        disk_cache = cache.DiskCache(self._dir_path, 1024 * 1024)
+        disk_cache.Put('key0', 'from disk')
+        memory_cache = cache.MemoryCache(1, disk_cache)
+
+        memory_cache.Put('key1', 'written through')
+
+        self.assertEqual('from disk', memory_cache.Get('key0'))
+        self.assertEqual('written through', memory_cache.Get('key1'))
+        self.assertEqual('written through', disk_cache.Get('key1'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import collections
+
+import errors
+import model
+
+class FunctionRegistry(object):
+    """Maps the name of every function a Text can hold, builtin or from the config, to how it
+    is evaluated to text and to HTML. Unknown names evaluate to nothing and are counted."""
+
+    def __init__(self):
+        self._text_handlers = {}
+        self._html_handlers = {}
+        self._unknown_names = collections.Counter()
+
+        for (name, (text_format, html_format)) in _BUILTIN_FORMATS.iteritems():
+            self.RegisterFormat(name, text_format, html_format)
+
+    def Register(self, name, text_handler, html_handler):
+        assert isinstance(name, str)
+        assert callable(text_handler)
+        assert callable(html_handler)
+
+        self._text_handlers[name] = text_handler
+        self._html_handlers[name] = html_handler
+
+    def RegisterFormat(self, name, text_format, html_format):
+        assert isinstance(text_format, str)
+        assert isinstance(html_format, str)
+
+        self.Register(name, _FormatHandler(name, text_format), _FormatHandler(name, html_format))
+
+    def EvaluateToText(self, function):
+        return self._Evaluate(self._text_handlers, function)
+
+    def EvaluateToHTML(self, function):
+        return self._Evaluate(self._html_handlers, function)
+
+    def _Evaluate(self, handlers, function):
+        assert isinstance(function, model.Function)
+
+        handler = handlers.get(function.name)
+
+        if handler is None:
+            self._unknown_names[function.name] += 1
+            return ''
+
+        # Every evaluated function is followed by a space, like the words around it.
+        return handler(function.arg_list) + ' '
+
+    def IsKnown(self, name):
+        return name in self._text_handlers
+
+    def UnknownNamesReport(self):
+        if len(self._unknown_names) == 0:
+            return None
+
+        return 'Unknown functions, skipped: %s' % ', '.join(
+            '%s (%d)' % (name, count) for (name, count) in sorted(self._unknown_names.iteritems()))
+
+    @property
+    def names(self):
+        return frozenset(self._text_handlers.iterkeys())
+
+    @property
+    def unknown_names(self):
+        return self._unknown_names
+
+class _FormatHandler(object):
+    # A function whose arguments fill in a str.format string. It is a class rather than a
+    # closure, so a registry can be pickled.
+
+    def __init__(self, name, handler_format):
+        self._name = name
+        self._handler_format = handler_format
+
+    def __call__(self, arg_list):
+        try:
+            return self._handler_format.format(*arg_list)
+        except (IndexError, KeyError, ValueError):
+            raise errors.Error('Function %s does not fit its %d arguments' % (self._name, len(arg_list)))
+
+# Builtin functions are defined the same way as the ones in the config, as a text and an HTML
+# str.format string for each name.
+_BUILTIN_FORMATS = {
+    'slash': ('\\', '&#92;'),
+    'brace-beg': ('{{', '{{'),
+    'brace-end': ('}}', '}}'),
+    'f': ('{0}', '\\({0}\\)'),
+    'def': ('{0}', '<strong>{0}</strong>'),
+    'ref': ('{0}', '<a href="#">{0}</a>'),
+}
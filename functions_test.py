@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import pickle
+import unittest
+
+import errors
+import functions
+import model
+
+class TestFunctionRegistry(unittest.TestCase):
+    def test_Builtins(self):
+        registry = functions.FunctionRegistry()
+
+        self.assertEqual('\\ ', registry.EvaluateToText(model.Function('slash', [])))
+        self.assertEqual('&#92; ', registry.EvaluateToHTML(model.Function('slash', [])))
+        self.assertEqual('{ ', registry.EvaluateToHTML(model.Function('brace-beg', [])))
+        self.assertEqual('x^2 ', registry.EvaluateToText(model.Function('f', ['x^2'])))
+        self.assertEqual('\\(x^2\\) ', registry.EvaluateToHTML(model.Function('f', ['x^2'])))
+        self.assertEqual('<strong>term</strong> ', registry.EvaluateToHTML(model.Function('def', ['term'])))
+
+    def test_RegisterFormat(self):
+        registry = functions.FunctionRegistry()
+        registry.RegisterFormat('abbr', '{0}', '<abbr title="{1}">{0}</abbr>')
+
+        self.assertEqual('HTML ', registry.EvaluateToText(model.Function('abbr', ['HTML', 'Hypertext'])))
+        self.assertEqual('<abbr title="Hypertext">HTML</abbr> ',
+                         registry.EvaluateToHTML(model.Function('abbr', ['HTML', 'Hypertext'])))
+        self.assertIn('abbr', registry.names)
+        self.assertTrue(registry.IsKnown('abbr'))
+        self.assertTrue(registry.IsKnown('slash'))
+        self.assertFalse(registry.IsKnown('kbd'))
+
+        with self.assertRaises(errors.Error):
+            registry.EvaluateToHTML(model.Function('abbr', ['HTML']))
+
+    def test_UnknownNamesReport(self):
+        registry = functions.FunctionRegistry()
+
+        self.assertIsNone(registry.UnknownNamesReport())
+        self.assertEqual('', registry.EvaluateToText(model.Function('kbd', ['x'])))
+        self.assertEqual('', registry.EvaluateToHTML(model.Function('kbd', ['y'])))
+        self.assertEqual('', registry.EvaluateToHTML(model.Function('cite', [])))
+        self.assertEqual('Unknown functions, skipped: cite (1), kbd (2)', registry.UnknownNamesReport())
+
+    def test_Pickle(self):
+        registry = functions.FunctionRegistry()
+        registry.RegisterFormat('kbd', '{0}', '<kbd>{0}</kbd>')
+        registry = pickle.loads(pickle.dumps(registry))
+
+        self.assertEqual('<kbd>C-x</kbd> ', registry.EvaluateToHTML(model.Function('kbd', ['C-x'])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import collections
+
+import pygments
+import pygments.formatters
+import pygments.lexers
+import pygments.util
+
+import cache
+import errors
+import utils
+
+# Bump this whenever the way highlighted code is stored changes, so older entries are ignored.
+_HIGHLIGHT_VERSION = '3'
+# How much of a block of unknown language is looked at to guess its lexer. Guessing runs
+# every lexer Pygments has over it, so the cost of a guess must not grow with the block.
+_GUESS_PREFIX_SIZE = 4096
+_FORMATTER_OPTIONS = {'linenos': True, 'cssclass': 'code-block-highlight', 'cssstyles': 'font-size:0.75em;'}
+
+class CodeHighlighter(object):
+    """Turns the code of code blocks into highlighted HTML, guessing the lexer of languages
+    Pygments does not know, and keeping the results in an optional highlight cache."""
+
+    def __init__(self, highlight_cache=None, lexer_aliases=None):
+        assert highlight_cache is None or isinstance(highlight_cache, cache.DiskCache)
+        assert lexer_aliases is None or isinstance(lexer_aliases, dict)
+
+        self._highlight_cache = highlight_cache
+        self._lexer_aliases = lexer_aliases if lexer_aliases is not None else {}
+        self._formatter = pygments.formatters.HtmlFormatter(**_FORMATTER_OPTIONS)
+        self._lexers = {}
+        self._guessed_blocks = collections.defaultdict(list)
+
+        # Aliases come from the config, so one which names no lexer is an error, rather than a
+        # reason to guess.
+        for (language, lexer_name) in sorted(self._lexer_aliases.iteritems()):
+            if self._Lexer(language) is None:
+                raise errors.Error('Language %s is an alias of unknown lexer %s' % (language, lexer_name))
+
+    def Highlight(self, code, language, block_name):
+        assert isinstance(code, str)
+        assert isinstance(language, str)
+        assert isinstance(block_name, str)
+
+        lexer = self._Lexer(language)
+
+        if self._highlight_cache is None:
+            (guessed_lexer_name, code_html) = self._Highlight(code, lexer)
+        else:
+            # A guessed lexer depends only on the code, which is part of the key anyway.
+            lexer_name = lexer.aliases[0] if lexer is not None else ''
+            key = utils.HashText('\0'.join([_HIGHLIGHT_VERSION, pygments.__version__,
+                                            repr(sorted(_FORMATTER_OPTIONS.iteritems())), lexer_name, code]))
+            highlighted = self._highlight_cache.Get(key)
+
+            if highlighted is None:
+                highlighted = self._Highlight(code, lexer)
+                self._highlight_cache.Put(key, highlighted)
+
+            (guessed_lexer_name, code_html) = highlighted
+
+        if guessed_lexer_name is not None:
+            self._guessed_blocks[guessed_lexer_name].append('%s (%s)' % (block_name, language))
+
+        return code_html
+
+    def GuessedLexersReport(self):
+        if len(self._guessed_blocks) == 0:
+            return None
+
+        return 'Code blocks of unknown languages, by guessed lexer:\n%s' % '\n'.join(
+            '  %s: %s' % (lexer_name, ', '.join(block_names))
+            for (lexer_name, block_names) in sorted(self._guessed_blocks.iteritems()))
+
+    def _Highlight(self, code, lexer):
+        # Returns the name of the guessed lexer, if there was a guess, along with the HTML.
+        if lexer is not None:
+            return (None, pygments.highlight(code, lexer, self._formatter))
+
+        lexer = pygments.lexers.guess_lexer(code[:_GUESS_PREFIX_SIZE])
+
+        return (lexer.name, pygments.highlight(code, lexer, self._formatter))
+
+    def _Lexer(self, language):
+        # Lexers are found by name once per language, including the languages no lexer has.
+        if language in self._lexers:
+            return self._lexers[language]
+
+        try:
+            lexer = pygments.lexers.get_lexer_by_name(self._lexer_aliases.get(language, language))
+        except pygments.util.ClassNotFound:
+            lexer = None
+
+        self._lexers[language] = lexer
+
+        return lexer
+
+    @property
+    def highlight_cache(self):
+        return self._highlight_cache
+
+    @property
+    def lexer_aliases(self):
+        return self._lexer_aliases
+
+    @property
+    def guessed_blocks(self):
+        return self._guessed_blocks
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+import errors
+import highlight
+
+class TestCodeHighlighter(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
+
+    def test_SameAsPygments(self):
+        code = 'int main() {\n    return 0;\n}\n'
+        formatter = highlight.pygments.formatters.HtmlFormatter(linenos=True, cssclass='code-block-highlight',
+                                                                cssstyles='font-size:0.75em;')
+        code_html = highlight.pygments.highlight(code, highlight.pygments.lexers.get_lexer_by_name('c'), formatter)
+
+        self.assertEqual(code_html, highlight.CodeHighlighter().Highlight(code, 'c', '/a#1'))
+
+    def test_UnknownLanguageIsGuessed(self):
+        highlighter = highlight.CodeHighlighter()
+
+        self.assertIn('code-block-highlight', highlighter.Highlight('x = 1\n', 'no-such-language', '/a#1'))
+        self.assertIn('code-block-highlight', highlighter.Highlight('<p>x</p>\n', 'no-such-language', '/a#1'))
+
+    def test_HighlightCache(self):
+        highlight_cache = cache.DiskCache(os.path.join(self._dir_path, 'highlight'), 1024 * 1024)
+        code_html = highlight.CodeHighlighter(highlight_cache).Highlight('x = 1\n', 'python', '/a#1')
+
+        self.assertEqual(1, len(os.listdir(highlight_cache.dir_path)))
+
+        # A later highlighter reads the HTML back, without highlighting the code again.
+        pygments_highlight = highlight.pygments.highlight
+
+        def FailHighlight(*args, **kwargs):
+            raise AssertionError('Code highlighted again')
+
+        highlight.pygments.highlight = FailHighlight
+
+        try:
+            self.assertEqual(code_html,
+                             highlight.CodeHighlighter(highlight_cache).Highlight('x = 1\n', 'python', '/a#1'))
+        finally:
+            highlight.pygments.highlight = pygments_highlight
+
+        highlight.CodeHighlighter(highlight_cache).Highlight('x = 1\n', 'ruby', '/a#1')
+        highlight.CodeHighlighter(highlight_cache).Highlight('x = 2\n', 'python', '/a#1')
+
+        self.assertEqual(3, len(os.listdir(highlight_cache.dir_path)))
+
+    def test_LexerAliases(self):
+        highlighter = highlight.CodeHighlighter(lexer_aliases={'c11': 'c'})
+
+        self.assertEqual(highlight.CodeHighlighter().Highlight('int x;\n', 'c', '/a#1'),
+                         highlighter.Highlight('int x;\n', 'c11', '/a#1'))
+        self.assertIsNone(highlighter.GuessedLexersReport())
+
+        with self.assertRaises(errors.Error):
+            highlight.CodeHighlighter(lexer_aliases={'c11': 'no-such-lexer'})
+
+    def test_GuessedLexersReport(self):
+        highlighter = highlight.CodeHighlighter()
+
+        with _GuessHTMLOrText():
+            highlighter.Highlight('x = 1\n', 'python', '/a#1')
+            highlighter.Highlight('<p>x</p>\n', 'no-such-language', '/a#2')
+            highlighter.Highlight('x\n', 'other-language', '/b#1')
+            highlighter.Highlight('<p>y</p>\n' * 10000, 'no-such-language', '/c#1')
+
+        self.assertEqual('Code blocks of unknown languages, by guessed lexer:\n'
+                         '  HTML: /a#2 (no-such-language), /c#1 (no-such-language)\n'
+                         '  Text only: /b#1 (other-language)',
+                         highlighter.GuessedLexersReport())
+
+    def test_GuessedLexerCached(self):
+        # A block read back from the cache is still reported, with the lexer guessed for it.
+        highlight_cache = cache.DiskCache(os.path.join(self._dir_path, 'highlight'), 1024 * 1024)
+        highlighter = highlight.CodeHighlighter(highlight_cache)
+
+        with _GuessHTMLOrText():
+            highlight.CodeHighlighter(highlight_cache).Highlight('<p>x</p>\n', 'no-such-language', '/a#1')
+
+        highlighter.Highlight('<p>x</p>\n', 'no-such-language', '/b#1')
+
+        self.assertEqual('Code blocks of unknown languages, by guessed lexer:\n  HTML: /b#1 (no-such-language)',
+                         highlighter.GuessedLexersReport())
+
+class _GuessHTMLOrText(object):
+    # Makes guesses independent of the heuristics of the Pygments version at hand.
+    def __enter__(self):
+        self._guess_lexer = highlight.pygments.lexers.guess_lexer
+        highlight.pygments.lexers.guess_lexer = lambda code: highlight.pygments.lexers.get_lexer_by_name(
+            'html' if code.startswith('<') else 'text')
+
+    def __exit__(self, *exc_info):
+        highlight.pygments.lexers.guess_lexer = self._guess_lexer
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import cPickle
+import os
+import os.path
+import tempfile
+
+import errors
+import utils
+
+# Bump this whenever the structure of a saved manifest changes, so older ones are ignored.
+_MANIFEST_VERSION = 2
+
+class Manifest(object):
+    """The mtime, size and content hash of every input of one build, and a fingerprint of
+    what each of its outputs was rendered from."""
+
+    def __init__(self, output_dir, files, post_pages, output_fingerprints):
+        assert output_dir is None or isinstance(output_dir, str)
+        assert isinstance(files, dict)
+        assert all(isinstance(p, str) for p in files.keys())
+        assert all(isinstance(f, tuple) and len(f) == 3 for f in files.values())
+        assert isinstance(post_pages, dict)
+        assert all(isinstance(p, str) for p in post_pages.keys())
+        assert isinstance(output_fingerprints, dict)
+        assert all(isinstance(p, str) for p in output_fingerprints.keys())
+        assert all(isinstance(f, str) for f in output_fingerprints.values())
+
+        self._output_dir = output_dir
+        self._files = files
+        self._post_pages = post_pages
+        self._output_fingerprints = output_fingerprints
+
+    @staticmethod
+    def Load(manifest_path):
+        try:
+            with open(manifest_path, 'rb') as manifest_file:
+                (version, manifest_data) = cPickle.load(manifest_file)
+        except (IOError, OSError, EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+            return Manifest.Empty()
+
+        if version != _MANIFEST_VERSION:
+            return Manifest.Empty()
+
+        (output_dir, files, post_pages, output_fingerprints) = manifest_data
+
+        return Manifest(output_dir, files, post_pages, output_fingerprints)
+
+    @staticmethod
+    def Empty():
+        return Manifest(None, {}, {}, {})
+
+    def Save(self, manifest_path):
+        try:
+            manifest_dir = os.path.dirname(manifest_path)
+
+            if manifest_dir != '' and not os.path.isdir(manifest_dir):
+                os.makedirs(manifest_dir)
+
+            (temp_fd, temp_path) = tempfile.mkstemp(dir=manifest_dir or '.', prefix='.tmp-')
+
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                manifest_data = (self._output_dir, self._files, self._post_pages, self._output_fingerprints)
+                cPickle.dump((_MANIFEST_VERSION, manifest_data), temp_file, cPickle.HIGHEST_PROTOCOL)
+
+            os.rename(temp_path, manifest_path)
+        except (IOError, OSError) as e:
+            raise errors.Error(str(e))
+
+    def Scan(self, input_paths):
+        # Files whose mtime and size match this manifest keep their recorded content hash.
+        # Only the others are read and hashed.
+        files = {}
+
+        for input_path in input_paths:
+            try:
+                input_stat = os.stat(input_path)
+            except OSError:
+                continue
+
+            old_file = self._files.get(input_path)
+
+            if old_file is not None and old_file[0] == input_stat.st_mtime and old_file[1] == input_stat.st_size:
+                files[input_path] = old_file
+            else:
+                files[input_path] = (input_stat.st_mtime, input_stat.st_size, _HashFile(input_path))
+
+        return Manifest(self._output_dir, files, {}, {})
+
+    def ContentHash(self, input_path):
+        input_file = self._files.get(input_path)
+
+        if input_file is None:
+            return None
+
+        return input_file[2]
+
+    def WithOutputs(self, output_dir, post_pages, output_fingerprints):
+        return Manifest(output_dir, self._files, post_pages, output_fingerprints)
+
+    @property
+    def output_dir(self):
+        return self._output_dir
+
+    @property
+    def files(self):
+        return self._files
+
+    @property
+    def post_pages(self):
+        return self._post_pages
+
+    @property
+    def output_fingerprints(self):
+        return self._output_fingerprints
+
+def _HashFile(input_path):
+    if os.path.isdir(input_path):
+        return None
+
+    try:
+        with open(input_path, 'rb') as input_file:
+            return utils.HashText(input_file.read())
+    except IOError as e:
+        raise errors.Error(str(e))
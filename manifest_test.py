@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import manifest
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
+
+    def _Write(self, name, text, mtime):
+        path = os.path.join(self._dir_path, name)
+
+        with open(path, 'w') as f:
+            f.write(text)
+
+        os.utime(path, (mtime, mtime))
+
+        return path
+
+    def test_Scan(self):
+        path_a = self._Write('a', 'hello', 100)
+        path_b = self._Write('b', 'world', 100)
+        path_c = self._Write('c', 'other', 100)
+
+        first = manifest.Manifest.Empty().Scan([path_a, path_b, path_c])
+
+        self.assertEqual(set([path_a, path_b, path_c]), set(first.files))
+
+        self._Write('a', 'hellO', 200)
+        self._Write('b', 'world', 200)
+        os.remove(path_c)
+        path_d = self._Write('d', 'new', 100)
+
+        second = first.Scan([path_a, path_b, path_c, path_d])
+
+        self.assertEqual(set([path_a, path_b, path_d]), set(second.files))
+        self.assertNotEqual(first.ContentHash(path_a), second.ContentHash(path_a))
+        self.assertEqual(first.ContentHash(path_b), second.ContentHash(path_b))
+        self.assertIsNone(second.ContentHash(path_c))
+        self.assertIsNotNone(second.ContentHash(path_d))
+
+    def test_SameStatIsNotRead(self):
+        path_a = self._Write('a', 'hello', 100)
+        first = manifest.Manifest.Empty().Scan([path_a])
+
+        # Same size and mtime, so the content is assumed unchanged.
+        self._Write('a', 'jello', 100)
+
+        self.assertEqual(first.ContentHash(path_a), first.Scan([path_a]).ContentHash(path_a))
+
+    def test_SaveAndLoad(self):
+        path_a = self._Write('a', 'hello', 100)
+        manifest_path = os.path.join(self._dir_path, 'cache', 'manifest')
+        built = manifest.Manifest.Empty().Scan([path_a]).WithOutputs('out', {'/post': ('fp', 'post.html', [])},
+                                                                     {'index.html': 'fp'})
+
+        built.Save(manifest_path)
+        loaded = manifest.Manifest.Load(manifest_path)
+
+        self.assertEqual('out', loaded.output_dir)
+        self.assertEqual(built.files, loaded.files)
+        self.assertEqual(built.post_pages, loaded.post_pages)
+        self.assertEqual(built.output_fingerprints, loaded.output_fingerprints)
+        self.assertIsNone(manifest.Manifest.Load(os.path.join(self._dir_path, 'missing')).output_dir)
+
+if __name__ == '__main__':
+    unittest.main()
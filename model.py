@@ -1,10 +1,15 @@
 import datetime
+import os.path
 import re
 
+import errors
+
 class Atom(object):
-    pass
+    __slots__ = ()
 
 class Word(Atom):
+    __slots__ = ('_text',)
+
     def __init__(self, text):
         assert isinstance(text, str)
 
@@ -22,11 +27,19 @@ class Word(Atom):
     def __ne__(self, other):
         return not (self == other)
 
+    def __getstate__(self):
+        return self._text
+
+    def __setstate__(self, state):
+        self._text = state
+
     @property
     def text(self):
         return self._text
 
 class Function(Atom):
+    __slots__ = ('_name', '_arg_list')
+
     def __init__(self, name, arg_list):
         assert isinstance(name, str)
         assert isinstance(arg_list, list)
@@ -48,6 +61,12 @@ class Function(Atom):
     def __ne__(self, other):
         return not (self == other)
 
+    def __getstate__(self):
+        return (self._name, self._arg_list)
+
+    def __setstate__(self, state):
+        (self._name, self._arg_list) = state
+
     @property
     def name(self):
         return self._name
@@ -56,29 +75,119 @@ class Function(Atom):
     def arg_list(self):
         return self._arg_list
 
+# Rather than one Word per word, a Text keeps a single string with every word followed by a
+# space, which is also how words are rendered. Functions are kept apart, together with the
+# offset in that string where each of them goes.
 class Text(object):
+    __slots__ = ('_words_text', '_function_offsets', '_functions', '_hash')
+
     def __init__(self, atoms):
         assert isinstance(atoms, list)
         assert all(isinstance(a, Atom) for a in atoms)
+        assert all(a.text != '' and ' ' not in a.text for a in atoms if isinstance(a, Word))
+
+        words_text = []
+        words_text_len = 0
+        function_offsets = []
+        functions = []
+
+        for atom in atoms:
+            if isinstance(atom, Word):
+                words_text.append(atom.text)
+                words_text.append(' ')
+                words_text_len = words_text_len + len(atom.text) + 1
+            else:
+                function_offsets.append(words_text_len)
+                functions.append(atom)
+
+        self._words_text = ''.join(words_text)
+        self._function_offsets = tuple(function_offsets)
+        self._functions = tuple(functions)
+        self._hash = None
+
+    @staticmethod
+    def Compact(words_text, function_offsets, functions):
+        assert isinstance(words_text, str)
+        assert isinstance(function_offsets, tuple)
+        assert isinstance(functions, tuple)
+        assert len(function_offsets) == len(functions)
+        assert all(isinstance(f, Function) for f in functions)
 
-        self._atoms = atoms
+        text = Text.__new__(Text)
+        text._words_text = words_text
+        text._function_offsets = function_offsets
+        text._functions = functions
+        text._hash = None
+
+        return text
 
     def __hash__(self):
-        return hash(tuple(self._atoms))
+        # Texts are not changed after they are built, so the hash is computed only once.
+        if self._hash is None:
+            self._hash = hash((self._words_text, self._function_offsets, self._functions))
+
+        return self._hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
+
         if not isinstance(other, Text):
             return False
 
-        return len(self._atoms) == len(other._atoms) and \
-            all(x == y for (x,y) in zip(self._atoms, other._atoms))
+        if hash(self) != hash(other):
+            return False
+
+        return self._words_text == other._words_text and \
+            self._function_offsets == other._function_offsets and \
+            self._functions == other._functions
+
+    def __getstate__(self):
+        # The hash is left out, so a pickled Text never carries one from another process.
+        return (self._words_text, self._function_offsets, self._functions)
+
+    def __setstate__(self, state):
+        (self._words_text, self._function_offsets, self._functions) = state
+        self._hash = None
 
     def __ne__(self, other):
         return not (self == other)
 
     @property
     def atoms(self):
-        return self._atoms
+        # Built on every access. Code which only renders the text should use the compact
+        # form instead.
+        atoms = []
+        c_pos = 0
+
+        for (function_offset, function) in zip(self._function_offsets, self._functions):
+            atoms.extend(Text._SplitWords(self._words_text[c_pos:function_offset]))
+            atoms.append(function)
+            c_pos = function_offset
+
+        atoms.extend(Text._SplitWords(self._words_text[c_pos:]))
+
+        return atoms
+
+    @staticmethod
+    def _SplitWords(words_text):
+        if words_text == '':
+            return []
+
+        # Every word is followed by exactly one space.
+        return [Word(w) for w in words_text[:-1].split(' ')]
+
+    @property
+    def words_text(self):
+        return self._words_text
+
+    @property
+    def function_offsets(self):
+        return self._function_offsets
+
+    @property
+    def functions(self):
+        return self._functions
 
 class Info(object):
     def __init__(self, title, url, author, email, twitter, location, avatar_path, description, 
@@ -294,7 +403,8 @@ class Section(Unit):
         return self._subsections
 
 class Post(object):
-    def __init__(self, info, title, date, delta, series, tags, root_section, path):
+    def __init__(self, info, title, date, delta, series, tags, root_section, path, description=None,
+                 body_events_loader=None):
         assert isinstance(info, Info)
         assert isinstance(title, Text)
         assert isinstance(date, datetime.date)
@@ -302,8 +412,10 @@ class Post(object):
         assert all(s in info.series for s in series)
         assert isinstance(tags, list)
         assert all(isinstance(t, Text) for t in tags)
-        assert isinstance(root_section, Section)
+        assert isinstance(root_section, Section) or root_section is None
         assert isinstance(path, str)
+        assert (root_section is None) == (body_events_loader is not None)
+        assert (root_section is None) == isinstance(description, Text)
 
         self._info = info
         self._title = title
@@ -312,12 +424,17 @@ class Post(object):
         self._series = series
         self._tags = tags
         self._root_section = root_section
+        self._body_events_loader = body_events_loader
         self._path = path
         self._next_post = None
         self._prev_post = None
         self._next_post_by_series = dict((s, None) for s in series)
         self._prev_post_by_series = dict((s, None) for s in series)
-        self._description = Post._FindFirstTextualParagraph(root_section).cell.text
+
+        if root_section is not None:
+            self._description = Post.FindDescription(root_section)
+        else:
+            self._description = description
 
     def __lt__(self, other):
         assert isinstance(other, Post)
@@ -355,8 +472,21 @@ class Post(object):
 
     @property
     def root_section(self):
+        assert self._root_section is not None
+
         return self._root_section
 
+    def LoadBodyEvents(self):
+        # A lazy body is never built into a section tree. Its events are parsed again from
+        # the post file, as they are consumed.
+        assert self._body_events_loader is not None
+
+        return self._body_events_loader()
+
+    @property
+    def has_lazy_body(self):
+        return self._root_section is None
+
     @property
     def path(self):
         return self._path
@@ -381,14 +511,19 @@ class Post(object):
     def description(self):
         return self._description
 
+    @staticmethod
+    def FindDescription(root_section):
+        return Post._FindFirstTextualParagraph(root_section).cell.text
+
     @staticmethod
     def _FindFirstTextualParagraph(section):
-        if len(section.paragraphs) >= 1 and isinstance(section.paragraphs[0].cell, Textual):
-            return section.paragraphs[0]
-        elif len(section.subsections) >= 1:
-            return Post._FindFirstTextualParagraph(section.subsections[0])
-        else:
-            raise errors.Error('Post without description paragraph')
+        while True:
+            if len(section.paragraphs) >= 1 and isinstance(section.paragraphs[0].cell, Textual):
+                return section.paragraphs[0]
+            elif len(section.subsections) >= 1:
+                section = section.subsections[0]
+            else:
+                raise errors.Error('Post without description paragraph')
 
 class PostDB(object):
     def __init__(self, info, post_map, post_maps_by_series):
@@ -405,6 +540,37 @@ class PostDB(object):
         self._info = info
         self._post_map = post_map
         self._post_maps_by_series = post_maps_by_series
+        self._postpage_path_map = None
+        self._url_map = None
+
+    def IndexSlugs(self, title_to_text):
+        assert callable(title_to_text)
+
+        # The page of a post is named after the slug of its title. The slugs are found once, and
+        # two posts whose titles give the same slug are caught here, before any page is built.
+        postpage_path_map = {}
+        url_map = {}
+        post_paths_by_slug = {}
+
+        for post_path in sorted(self._post_map.iterkeys()):
+            slug = PostDB.Slug(title_to_text(self._post_map[post_path].title))
+
+            if slug in post_paths_by_slug:
+                raise errors.Error('Posts "%s" and "%s" have the same slug "%s"' %
+                                   (post_paths_by_slug[slug], post_path, slug))
+
+            post_paths_by_slug[slug] = post_path
+            postpage_path_map[post_path] = slug + '.html'
+            url_map[post_path] = os.path.join('/', self._info.output_posts_dir, slug + '.html')
+
+        self._postpage_path_map = postpage_path_map
+        self._url_map = url_map
+
+    @staticmethod
+    def Slug(title_text):
+        assert isinstance(title_text, str)
+
+        return '_'.join(w.translate(None, _NON_SLUG_CHARS) for w in title_text.lower().split())
 
     @property
     def info(self):
@@ -417,3 +583,18 @@ class PostDB(object):
     @property
     def post_maps_by_series(self):
         return self._post_maps_by_series
+
+    @property
+    def postpage_path_map(self):
+        assert self._postpage_path_map is not None
+
+        return self._postpage_path_map
+
+    @property
+    def url_map(self):
+        assert self._url_map is not None
+
+        return self._url_map
+
+# Every character a slug drops, which is all but lowercase letters, digits and underscores.
+_NON_SLUG_CHARS = ''.join(chr(c) for c in range(256) if re.match('[a-z0-9_]', chr(c)) is None)
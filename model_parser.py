@@ -1,13 +1,20 @@
+import array
+import bisect
 import collections
 import datetime
+import functools
+import multiprocessing
 import os
 import os.path
 import re
 
 import yaml
 
+import cache
 import errors
+import manifest
 import model
+import post_index
 import utils
 
 class SourcePos(object):
@@ -86,6 +93,144 @@ class Token(object):
     def source_pos(self):
         return self._source_pos
 
+# Token type codes, as stored in a TokenStream.
+_WORD = 0
+_BLOB = 1
+_SLASH = 2
+_LIST_MARKER = 3
+_CELL_MARKER = 4
+_SECTION_MARKER = 5
+_PARAGRAPH_END = 6
+
+_TOKEN_TYPE_NAMES = ('word', 'blob', 'slash', 'list-marker', 'cell-marker', 'section-marker', 'paragraph-end')
+
+class TokenStream(object):
+    """The tokens of a text, stored column-wise in parallel arrays, with their contents sliced
+    out of the text only when asked for."""
+
+    def __init__(self, text, types, starts, ends, start_lines, end_lines):
+        assert isinstance(types, array.array)
+        assert isinstance(starts, array.array)
+        assert isinstance(ends, array.array)
+        assert isinstance(start_lines, array.array)
+        assert isinstance(end_lines, array.array)
+        assert len(types) == len(starts) == len(ends) == len(start_lines) == len(end_lines)
+
+        self._text = text
+        self._types = types
+        self._starts = starts
+        self._ends = ends
+        self._start_lines = start_lines
+        self._end_lines = end_lines
+
+    def __len__(self):
+        return len(self._types)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.TokenAt(ii) for ii in range(*key.indices(len(self._types)))]
+
+        return self.TokenAt(key)
+
+    def TypeAt(self, pos):
+        return self._types[pos]
+
+    def ContentAt(self, pos):
+        if self._types[pos] == _BLOB:
+            return self._text[self._starts[pos]+1:self._ends[pos]-1]
+
+        return self._text[self._starts[pos]:self._ends[pos]]
+
+    def TokenAt(self, pos):
+        source_pos = SourcePos(self._start_lines[pos], self._end_lines[pos], self._starts[pos], self._ends[pos])
+        return Token(_TOKEN_TYPE_NAMES[self._types[pos]], self.ContentAt(pos), source_pos)
+
+    def ToTokens(self):
+        return [self.TokenAt(ii) for ii in range(len(self._types))]
+
+class TokenWindow(object):
+    """The tokens of a text like a TokenStream, but scanned one paragraph at a time, keeping
+    only the last two paragraphs."""
+
+    def __init__(self, text, c_pos):
+        self._text = text
+        self._columns = _NewTokenColumns()
+        (self._types, self._starts, self._ends, self._start_lines, self._end_lines) = self._columns
+        self._chunks = _ScanTokenChunks(text, c_pos, self._columns)
+        self._base = 0
+        self._last_chunk_len = 0
+        # Reading the token at this index scans the next chunk. Once every chunk is scanned,
+        # it is past the end.
+        self._scan_index = 0
+
+        self._ScanChunk()
+
+    def __len__(self):
+        return self._base + len(self._types)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(len(self))
+            return [self.TokenAt(ii) for ii in range(max(start, self._base), stop, step)]
+
+        return self.TokenAt(key)
+
+    def TypeAt(self, pos):
+        # Called for nearly every token, so the common case is checked inline.
+        index = pos - self._base
+
+        if 0 <= index < self._scan_index:
+            return self._types[index]
+
+        return self._types[self._Index(pos)]
+
+    def ContentAt(self, pos):
+        index = pos - self._base
+
+        if not 0 <= index < self._scan_index:
+            index = self._Index(pos)
+
+        if self._types[index] == _BLOB:
+            return self._text[self._starts[index]+1:self._ends[index]-1]
+
+        return self._text[self._starts[index]:self._ends[index]]
+
+    def TokenAt(self, pos):
+        index = self._Index(pos)
+        source_pos = SourcePos(self._start_lines[index], self._end_lines[index], self._starts[index], self._ends[index])
+        return Token(_TOKEN_TYPE_NAMES[self._types[index]], self.ContentAt(pos), source_pos)
+
+    def _Index(self, pos):
+        index = pos - self._base
+
+        if index == self._scan_index:
+            self._ScanChunk()
+            index = pos - self._base
+
+        if index < 0:
+            raise IndexError('Token %d was already released' % pos)
+
+        return index
+
+    def _ScanChunk(self):
+        released_len = len(self._types) - self._last_chunk_len
+
+        for column in self._columns:
+            del column[:released_len]
+
+        self._base = self._base + released_len
+        kept_len = len(self._types)
+
+        try:
+            next(self._chunks)
+        except StopIteration:
+            self._last_chunk_len = kept_len
+            self._scan_index = len(self._types)
+            return
+
+        self._last_chunk_len = len(self._types) - kept_len
+        self._scan_index = len(self._types) - 1
+
 def ParseInfo(info_path):
     info_text = utils.QuickRead(info_path)
 
@@ -113,7 +258,7 @@ def ParseInfo(info_path):
     if not all(isinstance(s, str) for s in series_raw):
         raise errors.Error('Invalid Series entry')
 
-    series = frozenset(_ParseSmallText(s) for s in series_raw)
+    series = frozenset(_ParseSmallTextInterned(s) for s in series_raw)
 
     nr_of_posts_in_feed = utils.Extract(info_raw, 'NrOfPostsInFeed', int)
     posts_dir = utils.Extract(info_raw, 'PostsDir', str)
@@ -140,31 +285,90 @@ def ParseInfo(info_path):
                       nr_of_posts_in_feed=nr_of_posts_in_feed, posts_dir=posts_dir, output_dir=output_dir,
                       output_homepage_path=output_homepage_path, output_posts_dir=output_posts_dir)
 
-def ParsePostDB(info):
+def ParsePostDB(info, parse_cache=None, jobs=1, input_manifest=None, parse_states=None,
+                lazy_bodies=False, headers_index=None):
+    assert parse_cache is None or isinstance(parse_cache, (cache.DiskCache, cache.MemoryCache))
+    assert isinstance(jobs, int)
+    assert jobs >= 1
+    assert input_manifest is None or isinstance(input_manifest, manifest.Manifest)
+    assert parse_states is None or isinstance(parse_states, dict)
+    assert isinstance(lazy_bodies, bool)
+    assert headers_index is None or isinstance(headers_index, post_index.PostIndex)
+
+    _ResetSmallTexts(info)
+
     post_map = collections.OrderedDict()
     post_maps_by_series = dict((s, collections.OrderedDict()) for s in info.series)
     post_list = []
     post_lists_by_series = dict((s, []) for s in info.series)
+    post_paths = ListPostPaths(info)
 
-    try:
-        for dirpath, subdirs, post_paths_last in os.walk(info.posts_dir):
-            for post_path_last in post_paths_last:
-                post_path_full = os.path.join(dirpath, post_path_last)
-                post_path = post_path_full[len(info.posts_dir):]
+    # With a manifest, the content hash of unchanged posts is already known, and their parse
+    # results can come straight out of the parse cache, without reading the post file.
+    if input_manifest is not None:
+        content_hashes = [input_manifest.ContentHash(p) for (_, p) in post_paths]
+    else:
+        content_hashes = [None for _ in post_paths]
 
-                if not _PostValidPath(post_path):
-                    continue
+    # Parse states are kept by the caller between builds, so an edited post is parsed again
+    # starting from its last version. They stay in this process, so a pool does not use them.
+    # They also hold on to the text of every post, so lazy bodies do not use them either.
+    if parse_states is not None and jobs == 1 and not lazy_bodies:
+        post_paths_full = frozenset(p for (_, p) in post_paths)
 
-                post = _ParsePost(info, post_path, post_path_full)
-                post_list.append(post)
+        for post_path_full in parse_states.keys():
+            if post_path_full not in post_paths_full:
+                del parse_states[post_path_full]
 
-                for s in post.series:
-                    post_lists_by_series[s].append(post)
-    except IOError as e:
-        raise errors.Error(e)
+        parse_state_list = [parse_states.setdefault(p, PostParseState()) for (_, p) in post_paths]
+    else:
+        parse_state_list = [None for _ in post_paths]
+
+    load_args = [(post_path_full, content_hash, parse_cache, parse_state, lazy_bodies)
+                 for ((_, post_path_full), content_hash, parse_state)
+                 in zip(post_paths, content_hashes, parse_state_list)]
+
+    # Lazy bodies only need headers, so unchanged posts in the headers index are not loaded.
+    if lazy_bodies and headers_index is not None:
+        indexed_headers = [headers_index.Get(post_path, content_hash)
+                           for ((post_path, _), content_hash) in zip(post_paths, content_hashes)]
+    else:
+        indexed_headers = [None for _ in post_paths]
+
+    missing_load_args = [a for (a, h) in zip(load_args, indexed_headers) if h is None]
+
+    if jobs == 1 or len(missing_load_args) <= 1:
+        loaded_missing_post_texts = (_LoadPostText(a) for a in missing_load_args)
+    else:
+        loaded_missing_post_texts = iter(_LoadPostTextsInParallel(missing_load_args, jobs))
+
+    loaded_post_texts = ((h, None) if h is not None else next(loaded_missing_post_texts)
+                         for h in indexed_headers)
+
+    # Posts are built in walk order, so the first error is the same one a serial parse
+    # would have reported.
+    # With lazy bodies, a post keeps only its headers and description. Its body is loaded
+    # again, from the parse cache or the post file, whenever a page is generated from it.
+    for ((post_path, _), load_arg, loaded_post_text) in zip(post_paths, load_args, loaded_post_texts):
+        if lazy_bodies:
+            body_events_loader = functools.partial(_LoadPostEvents, load_arg[0], load_arg[1], parse_cache)
+        else:
+            body_events_loader = None
+
+        post = _ParsePost(info, post_path, loaded_post_text, body_events_loader)
+        post_list.append(post)
+
+        if headers_index is not None and load_arg[1] is not None:
+            headers_index.Put(post_path, load_arg[1], (post.series, post.tags, post.description))
+
+        for s in post.series:
+            post_lists_by_series[s].append(post)
 
     post_list.sort()
 
+    if headers_index is not None:
+        headers_index.Retain(frozenset(post_path for (post_path, _) in post_paths))
+
     for post in post_list:
         post_map[post.path] = post
 
@@ -185,6 +389,28 @@ def ParsePostDB(info):
 
     return model.PostDB(info=info, post_map=post_map, post_maps_by_series=post_maps_by_series)
 
+def ListPostPaths(info):
+    post_paths = []
+
+    try:
+        for dirpath, subdirs, post_paths_last in os.walk(info.posts_dir):
+            for post_path_last in post_paths_last:
+                post_path_full = os.path.join(dirpath, post_path_last)
+                post_path = post_path_full[len(info.posts_dir):]
+
+                if not _PostValidPath(post_path):
+                    continue
+
+                post_paths.append((post_path, post_path_full))
+    except IOError as e:
+        raise errors.Error(e)
+
+    return post_paths
+
+def LoadPostIndex(index_path, info):
+    # The headers in the index are parse results, so those of another parser version are not used.
+    return post_index.PostIndex.Load(index_path, info.posts_dir, _PARSER_VERSION)
+
 _POST_PATH_RE = re.compile(r'^(\d\d\d\d).(\d\d).(\d\d)(-\d+)?\s*-\s*(.+)$')
 
 def _PostValidPath(post_path):
@@ -193,14 +419,115 @@ def _PostValidPath(post_path):
 
     return match_obj is not None
 
-def _ParsePost(info, post_path, post_path_full):
+def _LoadPostText(load_args):
+    # Runs in pool workers as well, so it takes a single picklable argument and returns
+    # errors instead of raising them.
+    (post_path_full, content_hash, parse_cache, parse_state, lazy_bodies) = load_args
+
+    try:
+        # Only the description is kept out of a lazy body, so the body is parsed only as far
+        # as it. The rest is parsed when the page of the post is generated.
+        if lazy_bodies:
+            parse_result = _LoadPostHeaders(post_path_full)
+        else:
+            parse_result = _LoadParseResult(post_path_full, content_hash, parse_cache, parse_state)
+
+        return (parse_result, None)
+    except errors.Error as e:
+        return (None, e)
+
+def _LoadPostHeaders(post_path_full):
+    post_text = utils.QuickMap(post_path_full)
+
+    try:
+        (body_pos, series, tags) = _ParsePostHeaders(post_text)
+        description = _FindDescription(_SectionEvents(TokenWindow(post_text, body_pos), 0, 0, False))
+
+        return (series, tags, description)
+    finally:
+        utils.Unmap(post_text)
+
+def _FindDescription(events):
+    # Finds the same paragraph as model.Post.FindDescription, reading only the events up to
+    # it. The first paragraph of a section is the description if it is textual. Otherwise,
+    # the description is looked for in the first subsection of the section.
+    section_level = None
+    saw_paragraph = False
+
+    for (kind, level, payload, _) in events:
+        if kind == SECTION_START and (section_level is None or level == section_level + 1):
+            section_level = level
+            saw_paragraph = False
+        elif kind == PARAGRAPH and level == section_level and not saw_paragraph:
+            if isinstance(payload.cell, model.Textual):
+                return payload.cell.text
+
+            saw_paragraph = True
+        elif kind == SECTION_END and level == section_level:
+            break
+
+    raise errors.Error('Post without description paragraph')
+
+def _LoadPostEvents(post_path_full, content_hash, parse_cache):
+    # With a parse cache, the body is walked from its cached tree, which is parsed and put
+    # there first if missing, so the next build of an unchanged post does not parse it.
+    # Without one, the body is parsed straight into events.
+    if parse_cache is None:
+        return _ParsePostFileEvents(post_path_full)
+
+    (_, _, root_section) = _LoadParseResult(post_path_full, content_hash, parse_cache, None)
+
+    return SectionEvents(root_section, 0)
+
+def _ParsePostFileEvents(post_path_full):
+    post_text = utils.QuickMap(post_path_full)
+
+    try:
+        for event in ParsePostEvents(post_text):
+            yield event
+    finally:
+        utils.Unmap(post_text)
+
+def _LoadParseResult(post_path_full, content_hash, parse_cache, parse_state):
+    if content_hash is not None and parse_cache is not None:
+        parse_result = parse_cache.Get(_ParseCacheKey(content_hash))
+
+        if parse_result is not None:
+            return parse_result
+
+    post_text = utils.QuickMap(post_path_full)
+
+    try:
+        return _ParsePostTextCached(post_text, parse_cache, parse_state)
+    finally:
+        utils.Unmap(post_text)
+
+def _LoadPostTextsInParallel(load_args, jobs):
+    pool = multiprocessing.Pool(jobs)
+
+    try:
+        chunk_size = max(1, len(load_args) // (jobs * 4))
+        loaded_post_texts = pool.map(_LoadPostText, load_args, chunk_size)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return loaded_post_texts
+
+def _ParsePost(info, post_path, loaded_post_text, body_events_loader=None):
     post_path_base = os.path.basename(post_path)
     match_obj = _POST_PATH_RE.match(post_path_base)
 
     if match_obj is None:
         raise errors.Error('Invalid blog post path')
 
-    post_text = utils.QuickRead(post_path_full)
+    (parse_result, load_error) = loaded_post_text
+
+    if load_error is not None:
+        raise load_error
 
     title_raw = match_obj.group(5)
     title = _ParseSmallText(title_raw)
@@ -218,13 +545,23 @@ def _ParsePost(info, post_path, post_path_full):
     else:
         delta = 0
 
-    (series, tags, root_section) = _ParsePostText(post_text)
+    (series, tags, body) = parse_result
+
+    # Parse results which come from the parse cache or from a pool worker hold their own
+    # copies of the series and tags, so they are interned again here.
+    series = [_InternSmallText(s) for s in series]
+    tags = [_InternSmallText(t) for t in tags]
+
+    if body_events_loader is not None:
+        return model.Post(info=info, title=title, date=date, delta=delta, series=series, tags=tags,
+                          root_section=None, path=post_path, description=body,
+                          body_events_loader=body_events_loader)
 
     return model.Post(info=info, title=title, date=date, delta=delta, series=series, tags=tags, 
-                      root_section=root_section, path=post_path)
+                      root_section=body, path=post_path)
 
 def _ParseSmallText(small_text):
-    tokens = _Tokenize(small_text)
+    tokens = _ScanTokens(small_text)
     (new_pos, small) = _ParseText(tokens, 0)
 
     # The last element of tokens is a paragraph-end, so it is not considered.
@@ -233,16 +570,61 @@ def _ParseSmallText(small_text):
 
     return small
 
-def _ParsePostText(post_text):
-    new_pos = _SkipWS(post_text, 0, 0)
-    (new_pos, series_raw) = _ParseSeriesHeader(post_text, new_pos)
-    series = [_ParseSmallText(s) for s in series_raw.split(',')] if series_raw else []
+# Series and tags are shared by many posts. Each distinct one is parsed once, and every post
+# refers to the same Text for it, so comparing them mostly comes down to an identity check.
+# The tables are reset by every ParsePostDB, so they only hold those of the current posts.
+_SMALL_TEXTS = {}
+_SMALL_TEXTS_BY_RAW = {}
 
-    new_pos = _SkipWS(post_text, new_pos, 0)
-    (new_pos, tags_raw) = _ParseTagsHeader(post_text, new_pos)
-    tags = [_ParseSmallText(t) for t in tags_raw.split(',')] if tags_raw else []
+def _ResetSmallTexts(info):
+    _SMALL_TEXTS.clear()
+    _SMALL_TEXTS_BY_RAW.clear()
+
+    for s in info.series:
+        _InternSmallText(s)
 
-    tokens = _Tokenize(post_text[new_pos:])
+def _ParseSmallTextInterned(small_text):
+    small = _SMALL_TEXTS_BY_RAW.get(small_text)
+
+    if small is None:
+        small = _InternSmallText(_ParseSmallText(small_text))
+        _SMALL_TEXTS_BY_RAW[small_text] = small
+
+    return small
+
+def _InternSmallText(small):
+    return _SMALL_TEXTS.setdefault(small, small)
+
+# Bump this whenever a change to the parser or the model changes what _ParsePostText
+# returns, so stale parse cache entries, and headers in the post index, are not picked up.
+_PARSER_VERSION = '2'
+
+def _ParsePostTextCached(post_text, parse_cache, parse_state=None):
+    if parse_state is not None:
+        parse_text = parse_state.Reparse
+    else:
+        parse_text = _ParsePostText
+
+    if parse_cache is None:
+        return parse_text(post_text)
+
+    key = _ParseCacheKey(utils.HashText(post_text))
+    parse_result = parse_cache.Get(key)
+
+    if parse_result is None:
+        parse_result = parse_text(post_text)
+        parse_cache.Put(key, parse_result)
+
+    return parse_result
+
+def _ParseCacheKey(content_hash):
+    return utils.HashText(_PARSER_VERSION + '\0' + content_hash)
+
+_TOKEN_WINDOW_MIN_SIZE = 1024 * 1024
+
+def _ParsePostText(post_text):
+    (new_pos, series, tags) = _ParsePostHeaders(post_text)
+    tokens = _PostBodyTokens(post_text, new_pos)
     (new_t_pos, root_section) = _ParseSection(tokens, 0, 0, False)
 
     if new_t_pos < len(tokens):
@@ -251,6 +633,243 @@ def _ParsePostText(post_text):
 
     return (series, tags, root_section)
 
+# Kinds of events, as produced by ParsePostEvents and SectionEvents. Every event is a tuple
+# of kind, section level and payload. The payload of a SECTION_START is the section title,
+# that of a PARAGRAPH is the paragraph, and a SECTION_END has none.
+SECTION_START = 'section-start'
+SECTION_END = 'section-end'
+PARAGRAPH = 'paragraph'
+
+def ParsePostEvents(post_text):
+    # Parses the body of a post into a stream of events, in document order, without
+    # building the section tree. Errors are raised when reached, so some events may have
+    # been produced before them.
+    (new_pos, _, _) = _ParsePostHeaders(post_text)
+    tokens = _PostBodyTokens(post_text, new_pos)
+    new_t_pos = 0
+
+    for (kind, level, payload, new_t_pos) in _SectionEvents(tokens, 0, 0, False):
+        yield (kind, level, payload)
+
+    if new_t_pos < len(tokens):
+        print tokens[new_t_pos-30:new_t_pos+30]
+        raise errors.Error('M')
+
+def PostEvents(post):
+    # The events of the body of a post. A tree is only walked when the post already holds
+    # one. A lazy body is parsed straight into events, from the post file.
+    if post.has_lazy_body:
+        return post.LoadBodyEvents()
+
+    return SectionEvents(post.root_section, 0)
+
+def SectionEvents(root_section, root_level):
+    # Produces the same events as ParsePostEvents, from an already built section tree.
+    pending_sections = [(root_section, root_level)]
+
+    while len(pending_sections) >= 1:
+        (section, level) = pending_sections.pop()
+
+        # A None section marks where the section one level up ends.
+        if section is None:
+            yield (SECTION_END, level, None)
+            continue
+
+        yield (SECTION_START, level, section.title)
+
+        for paragraph in section.paragraphs:
+            yield (PARAGRAPH, level, paragraph)
+
+        pending_sections.append((None, level))
+
+        for subsection in reversed(section.subsections):
+            pending_sections.append((subsection, level + 1))
+
+class PostParseState(object):
+    """What is kept from the last parse of a post, so that an edited version of it is parsed
+    again only from the paragraphs which changed."""
+
+    def __init__(self):
+        self._Remember('', [], [], [])
+
+    def Reparse(self, post_text):
+        (body_pos, series, tags) = _ParsePostHeaders(post_text)
+        body_text = post_text[body_pos:]
+
+        try:
+            (chunk_starts, chunk_ends, chunk_items) = self._Rechunk(body_text)
+            (_, root_section) = _BuildSection(_ChunkEvents(chunk_items), 0)
+        except (errors.Error, _ChunkMismatch):
+            # The full parser reports errors just as it always does. It also handles whatever
+            # does not fit the chunked model.
+            self._Remember('', [], [], [])
+            return _ParsePostText(post_text)
+
+        self._Remember(body_text, chunk_starts, chunk_ends, chunk_items)
+
+        return (series, tags, root_section)
+
+    def _Remember(self, body_text, chunk_starts, chunk_ends, chunk_items):
+        self._body_text = body_text
+        self._chunk_starts = chunk_starts
+        self._chunk_ends = chunk_ends
+        self._chunk_items = chunk_items
+
+    def _Rechunk(self, body_text):
+        old_body_text = self._body_text
+        prefix_len = _CommonPrefixLen(old_body_text, body_text)
+        suffix_len = _CommonSuffixLen(old_body_text, body_text,
+                                      min(len(old_body_text), len(body_text)) - prefix_len)
+
+        # A chunk is reused from the front if all of it, and the character after it which
+        # decides where it ends, is unchanged.
+        kept_front = bisect.bisect_left(self._chunk_ends, prefix_len)
+        chunk_starts = self._chunk_starts[:kept_front]
+        chunk_ends = self._chunk_ends[:kept_front]
+        chunk_items = self._chunk_items[:kept_front]
+
+        # Scanning resumes after the reused chunks, and stops at the first chunk boundary in
+        # the unchanged suffix which was also a boundary before the edit. From there on, the
+        # old chunks are reused, at shifted positions.
+        c_pos = chunk_ends[-1] if kept_front > 0 else 0
+        suffix_start = len(body_text) - suffix_len
+        shift = len(body_text) - len(old_body_text)
+        old_chunk_start_indices = dict((start, ii) for (ii, start) in enumerate(self._chunk_starts))
+        columns = _NewTokenColumns()
+        chunk_start = _SkipWS(body_text, c_pos, 0)
+
+        for _ in _ScanTokenChunks(body_text, c_pos, columns):
+            chunk_end = _SkipWS(body_text, columns[2][-1], 0)
+            chunk_starts.append(chunk_start)
+            chunk_ends.append(chunk_end)
+            chunk_items.append(_ParseChunkItems(TokenStream(body_text, *columns)))
+
+            for column in columns:
+                del column[:]
+
+            old_index = old_chunk_start_indices.get(chunk_end - shift)
+
+            if chunk_end >= suffix_start and chunk_end < len(body_text) and old_index is not None:
+                chunk_starts.extend(start + shift for start in self._chunk_starts[old_index:])
+                chunk_ends.extend(end + shift for end in self._chunk_ends[old_index:])
+                chunk_items.extend(self._chunk_items[old_index:])
+                break
+
+            chunk_start = chunk_end
+
+        return (chunk_starts, chunk_ends, chunk_items)
+
+class _ChunkMismatch(Exception):
+    pass
+
+def _ParseChunkItems(tokens):
+    # Parses the section titles and paragraphs of a chunk, on their own. Titles are given
+    # the level of their section-markers, which is checked against the nesting later.
+    items = []
+    new_pos = 0
+
+    while new_pos < len(tokens) and tokens.TypeAt(new_pos) == _PARAGRAPH_END:
+        new_pos = new_pos + 1
+
+    while new_pos < len(tokens):
+        if tokens.TypeAt(new_pos) == _SECTION_MARKER:
+            level = len(tokens.ContentAt(new_pos))
+            (new_pos, title) = _ParseSectionTitle(tokens, new_pos, level)
+            items.append((SECTION_START, level, title))
+
+            while new_pos < len(tokens) and tokens.TypeAt(new_pos) == _PARAGRAPH_END:
+                new_pos = new_pos + 1
+        else:
+            (new_pos, paragraph) = _ParseParagraph(tokens, new_pos)
+
+            if paragraph is None:
+                raise _ChunkMismatch()
+
+            items.append((PARAGRAPH, None, paragraph))
+
+    return items
+
+def _ChunkEvents(chunk_items):
+    # Yields the same events as _SectionEvents for the root section, out of the items of
+    # every chunk. A title closes open sections until it fits right under one of them.
+    yield (SECTION_START, 0, model.Text([model.Word('.root')]), None)
+
+    depth = 1
+
+    for items in chunk_items:
+        for (kind, level, payload) in items:
+            if kind == PARAGRAPH:
+                yield (PARAGRAPH, depth - 1, payload, None)
+                continue
+
+            if level > depth:
+                raise _ChunkMismatch()
+
+            while depth > level:
+                depth = depth - 1
+                yield (SECTION_END, depth, None, None)
+
+            yield (SECTION_START, level, payload, None)
+            depth = depth + 1
+
+    while depth > 0:
+        depth = depth - 1
+        yield (SECTION_END, depth, None, None)
+
+_COMPARE_BLOCK_SIZE = 4096
+
+def _CommonPrefixLen(text, other_text):
+    # Compares whole blocks first, and characters only in the block which differs.
+    max_len = min(len(text), len(other_text))
+    c_pos = 0
+
+    while c_pos < max_len and text[c_pos:c_pos+_COMPARE_BLOCK_SIZE] == other_text[c_pos:c_pos+_COMPARE_BLOCK_SIZE]:
+        c_pos = c_pos + _COMPARE_BLOCK_SIZE
+
+    c_pos = min(c_pos, max_len)
+
+    while c_pos < max_len and text[c_pos] == other_text[c_pos]:
+        c_pos = c_pos + 1
+
+    return c_pos
+
+def _CommonSuffixLen(text, other_text, max_len):
+    text_len = len(text)
+    other_text_len = len(other_text)
+    c_len = 0
+
+    while c_len + _COMPARE_BLOCK_SIZE <= max_len and \
+            text[text_len-c_len-_COMPARE_BLOCK_SIZE:text_len-c_len] == \
+            other_text[other_text_len-c_len-_COMPARE_BLOCK_SIZE:other_text_len-c_len]:
+        c_len = c_len + _COMPARE_BLOCK_SIZE
+
+    c_len = min(c_len, max_len)
+
+    while c_len < max_len and text[text_len-c_len-1] == other_text[other_text_len-c_len-1]:
+        c_len = c_len + 1
+
+    return c_len
+
+def _ParsePostHeaders(post_text):
+    new_pos = _SkipWS(post_text, 0, 0)
+    (new_pos, series_raw) = _ParseSeriesHeader(post_text, new_pos)
+    series = [_ParseSmallTextInterned(s) for s in series_raw.split(',')] if series_raw else []
+
+    new_pos = _SkipWS(post_text, new_pos, 0)
+    (new_pos, tags_raw) = _ParseTagsHeader(post_text, new_pos)
+    tags = [_ParseSmallTextInterned(t) for t in tags_raw.split(',')] if tags_raw else []
+
+    return (new_pos, series, tags)
+
+def _PostBodyTokens(post_text, c_pos):
+    # Tokens of large posts are scanned a paragraph at a time, as the parser needs them, so
+    # they are never all in memory at once. Smaller posts are scanned in one go, which is
+    # a bit faster to parse from.
+    if len(post_text) - c_pos >= _TOKEN_WINDOW_MIN_SIZE:
+        return TokenWindow(post_text, c_pos)
+
+    return _ScanTokens(post_text[c_pos:])
+
 _SERIES_HEADER_RE = re.compile('Series:\s*(.+)')
 
 def _ParseSeriesHeader(text, c_pos):
@@ -282,113 +901,144 @@ def _ParseTagsHeader(text, c_pos):
     return (new_pos, header_raw)
 
 def _ParseSection(tokens, c_pos, level, has_title):
-    new_pos = c_pos
+    return _BuildSection(_SectionEvents(tokens, c_pos, level, has_title), c_pos)
+
+def _BuildSection(events, c_pos):
+    # Builds the section tree out of the events of a section, each with the token position
+    # after it.
+    open_sections = []
+
+    for (kind, _, payload, new_pos) in events:
+        if kind == PARAGRAPH:
+            open_sections[-1][1].append(payload)
+        elif kind == SECTION_START:
+            open_sections.append((payload, [], []))
+        else:
+            (section_title, section_paragraphs, section_subsections) = open_sections.pop()
+            section = model.Section(section_title, section_paragraphs, section_subsections)
 
-    if has_title:
-        if new_pos >= len(tokens):
-            return (c_pos, None)
+            if len(open_sections) == 0:
+                return (new_pos, section)
 
-        if tokens[new_pos].token_type != 'section-marker':
-            return (c_pos, None)
+            open_sections[-1][2].append(section)
 
-        if tokens[new_pos].content != ('=' * level):
-            return (c_pos, None)
+    return (c_pos, None)
 
-        new_pos = new_pos + 1
-        (new_pos, title) = _ParseText(tokens, new_pos)
+def _SectionEvents(tokens, c_pos, level, has_title):
+    # Yields the events of the section at c_pos, each with the token position after it.
+    if has_title:
+        (new_pos, title) = _ParseSectionTitle(tokens, c_pos, level)
 
         if title is None:
-            raise errors.Error('V')
+            return
+    else:
+        new_pos = c_pos
+        title = model.Text([model.Word('.root')])
 
-        if new_pos >= len(tokens):
-            raise errors.Error('X')
+    # Sections which are still open are only counted, rather than kept on the call stack, so
+    # arbitrarily deep nesting does not run into the recursion limit. The innermost open
+    # section has level + depth - 1, and its subsections must have level + depth.
+    depth = 0
 
-        if tokens[new_pos].token_type != 'section-marker':
-            print tokens[new_pos-20:new_pos+20]
-            raise errors.Error('Q')
+    while True:
+        section_level = level + depth
+        depth = depth + 1
 
-        if tokens[new_pos].content != ('=' * level):
-            raise errors.Error('Y')
+        yield (SECTION_START, section_level, title, new_pos)
 
-        new_pos = new_pos + 1
-    else:
-        title = model.Text([model.Word('.root')])
+        # Skip newlines after the title, represented as paragraph-ends.
+        while new_pos < len(tokens) and tokens.TypeAt(new_pos) == _PARAGRAPH_END:
+            new_pos = new_pos + 1
 
-    # Skip newlines after the title, represented as paragraph-ends.
-    while new_pos < len(tokens) and tokens[new_pos].token_type == 'paragraph-end':
-        new_pos = new_pos + 1
+        while new_pos < len(tokens):
+            (new_pos, paragraph) = _ParseParagraph(tokens, new_pos)
 
-    (new_pos, paragraphs) = _ParseParagraphs(tokens, new_pos)
-    sections = []
+            if paragraph is None:
+                break
 
-    while new_pos < len(tokens):
-        (new_pos, section) = _ParseSection(tokens, new_pos, level + 1, True)
+            yield (PARAGRAPH, section_level, paragraph, new_pos)
 
-        if section is None:
-            break
+        while True:
+            (title_pos, title) = _ParseSectionTitle(tokens, new_pos, level + depth)
+
+            if title is not None:
+                new_pos = title_pos
+                break
+
+            depth = depth - 1
 
-        sections.append(section)
+            yield (SECTION_END, level + depth, None, new_pos)
 
-    return (new_pos, model.Section(title, paragraphs, sections))
+            if depth == 0:
+                return
 
-def _ParseParagraphs(tokens, c_pos):
+def _ParseSectionTitle(tokens, c_pos, level):
     new_pos = c_pos
-    paragraphs = []
 
-    while new_pos < len(tokens):
-        (new_pos, paragraph) = _ParseParagraph(tokens, new_pos)
+    if new_pos >= len(tokens):
+        return (c_pos, None)
 
-        if paragraph is None:
-            break
+    if tokens.TypeAt(new_pos) != _SECTION_MARKER:
+        return (c_pos, None)
 
-        paragraphs.append(paragraph)
+    # Section-markers are runs of '=', so only their length needs checking.
+    if len(tokens.ContentAt(new_pos)) != level:
+        return (c_pos, None)
 
-    return (new_pos, paragraphs)
+    new_pos = new_pos + 1
+    (new_pos, title) = _ParseText(tokens, new_pos)
 
-def _ParseParagraph(tokens, c_pos):
-    (new_pos, textual) = _ParseTextual(tokens, c_pos)
-    if textual:
-        return (new_pos, model.Paragraph(textual))
+    if title is None:
+        raise errors.Error('V')
 
-    (new_pos, list_c) = _ParseList(tokens, c_pos)
-    if list_c:
-        return (new_pos, model.Paragraph(list_c))
+    if new_pos >= len(tokens):
+        raise errors.Error('X')
 
-    (new_pos, formula) = _ParseFormula(tokens, c_pos)
-    if formula:
-        return (new_pos, model.Paragraph(formula))
+    if tokens.TypeAt(new_pos) != _SECTION_MARKER:
+        print tokens[new_pos-20:new_pos+20]
+        raise errors.Error('Q')
 
-    (new_pos, code_block) = _ParseCodeBlock(tokens, c_pos)
-    if code_block:
-        return (new_pos, model.Paragraph(code_block))
+    if len(tokens.ContentAt(new_pos)) != level:
+        raise errors.Error('Y')
 
-    (new_pos, image) = _ParseImage(tokens, c_pos)
-    if image:
-        return (new_pos, model.Paragraph(image))
+    return (new_pos + 1, title)
 
-    return (c_pos, None)
+def _ParseParagraph(tokens, c_pos):
+    # The header text is parsed just once. The token which follows it decides the type of the
+    # cell, so there is no need to backtrack and try each cell type in turn.
+    (new_pos, header_text) = _ParseText(tokens, c_pos)
+
+    if new_pos >= len(tokens) or tokens.TypeAt(new_pos) == _PARAGRAPH_END:
+        (new_pos, cell) = _ParseTextual(tokens, new_pos, header_text)
+    elif tokens.TypeAt(new_pos) == _LIST_MARKER:
+        (new_pos, cell) = _ParseList(tokens, new_pos, header_text)
+    elif tokens.TypeAt(new_pos) == _CELL_MARKER:
+        (new_pos, cell) = _ParseCell(tokens, new_pos + 1, header_text)
+    else:
+        cell = None
 
-def _ParseTextual(tokens, c_pos):
-    (new_pos, text) = _ParseText(tokens, c_pos)
+    if cell is None:
+        return (c_pos, None)
+
+    return (new_pos, model.Paragraph(cell))
 
+def _ParseTextual(tokens, c_pos, text):
     if text is None:
         return (c_pos, None)
 
-    if new_pos >= len(tokens):
-        return (new_pos, model.Textual(text))
-    elif tokens[new_pos].token_type == 'paragraph-end':
-        return (new_pos + 1, model.Textual(text))
+    if c_pos >= len(tokens):
+        return (c_pos, model.Textual(text))
     else:
-        # The List will have to fail here.
-        return (c_pos, None)
+        # The current token is a paragraph-end.
+        return (c_pos + 1, model.Textual(text))
 
-def _ParseList(tokens, c_pos):
+def _ParseList(tokens, c_pos, header_text):
     # header_text can be None here.
-    (new_pos, header_text) = _ParseText(tokens, c_pos)
+    new_pos = c_pos
     items = []
 
     while new_pos < len(tokens):
-        if tokens[new_pos].token_type != 'list-marker':
+        if tokens.TypeAt(new_pos) != _LIST_MARKER:
             break
 
         (new_pos, item) = _ParseText(tokens, new_pos + 1)
@@ -403,172 +1053,135 @@ def _ParseList(tokens, c_pos):
 
     if new_pos >= len(tokens):
         return (new_pos, model.List(header_text, items))
-    elif tokens[new_pos].token_type == 'paragraph-end':
+    elif tokens.TypeAt(new_pos) == _PARAGRAPH_END:
         return (new_pos + 1, model.List(header_text, items))
     else:
         # Raise here for the list as well.
         print tokens[new_pos-20:new_pos+20]
         raise errors.Error('Q')
 
-def _ParseFormula(tokens, c_pos):
+def _ParseCell(tokens, c_pos, header_text):
     # header_text can be None here.
-    (new_pos, header_text) = _ParseText(tokens, c_pos)
-
-    if new_pos >= len(tokens):
+    if c_pos >= len(tokens):
         return (c_pos, None)
 
-    if tokens[new_pos].token_type != 'cell-marker':
+    if tokens.TypeAt(c_pos) != _WORD:
         return (c_pos, None)
 
-    new_pos = new_pos + 1
+    cell_parser = _CELL_PARSERS.get(tokens.ContentAt(c_pos))
 
-    if new_pos >= len(tokens):
+    if cell_parser is None:
         return (c_pos, None)
 
-    if tokens[new_pos].token_type != 'word' or tokens[new_pos].content != 'formula':
-        return (c_pos, None)
+    return cell_parser(tokens, c_pos + 1, header_text)
 
-    new_pos = new_pos + 1
+def _ParseFormula(tokens, c_pos, header_text):
+    new_pos = c_pos
 
     if new_pos >= len(tokens):
         raise errors.Error('F1')
 
-    if tokens[new_pos].token_type != 'blob':
+    if tokens.TypeAt(new_pos) != _BLOB:
         raise errors.Error('F2')
 
-    formula = tokens[new_pos].content
+    formula = tokens.ContentAt(new_pos)
     new_pos = new_pos + 1
 
     if new_pos >= len(tokens):
         return (new_pos, model.Formula(header_text, formula))
-    elif tokens[new_pos].token_type == 'paragraph-end':
+    elif tokens.TypeAt(new_pos) == _PARAGRAPH_END:
         return (new_pos + 1, model.Formula(header_text, formula))
     else:
         raise errors.Error('F3') 
 
-def _ParseCodeBlock(tokens, c_pos):
-    # header_text can be None here.
-    (new_pos, header_text) = _ParseText(tokens, c_pos)
-
-    if new_pos >= len(tokens):
-        return (c_pos, None)
-
-    if tokens[new_pos].token_type != 'cell-marker':
-        return (c_pos, None)
-
-    new_pos = new_pos + 1
-
-    if new_pos >= len(tokens):
-        return (c_pos, None)
-
-    if tokens[new_pos].token_type != 'word' or tokens[new_pos].content != 'code':
-        return (c_pos, None)
-
-    new_pos = new_pos + 1
+def _ParseCodeBlock(tokens, c_pos, header_text):
+    new_pos = c_pos
 
     if new_pos >= len(tokens):
         raise errors.Error('W1')
 
-    if tokens[new_pos].token_type != 'blob':
+    if tokens.TypeAt(new_pos) != _BLOB:
         raise errors.Error('W2')
 
-    language = tokens[new_pos].content
+    language = tokens.ContentAt(new_pos)
     new_pos = new_pos + 1
 
     if new_pos >= len(tokens):
         raise errors.Error('W1')
 
-    if tokens[new_pos].token_type != 'blob':
+    if tokens.TypeAt(new_pos) != _BLOB:
         raise errors.Error('W2')
 
-    code = tokens[new_pos].content
+    code = tokens.ContentAt(new_pos)
     new_pos = new_pos + 1
 
     if new_pos >= len(tokens):
         return (new_pos, model.CodeBlock(header_text, language, code))
-    elif tokens[new_pos].token_type == 'paragraph-end':
+    elif tokens.TypeAt(new_pos) == _PARAGRAPH_END:
         return (new_pos + 1, model.CodeBlock(header_text, language, code))
     else:
         raise errors.Error('W3')
 
-def _ParseImage(tokens, c_pos):
-    # header_text can be None here.
-    (new_pos, header_text) = _ParseText(tokens, c_pos)
-
-    if new_pos >= len(tokens):
-        return (c_pos, None)
-
-    if tokens[new_pos].token_type != 'cell-marker':
-        return (c_pos, None)
-
-    new_pos = new_pos + 1
-
-    if new_pos >= len(tokens):
-        return (c_pos, None)
-
-    if tokens[new_pos].token_type != 'word' or tokens[new_pos].content != 'image':
-        return (c_pos, None)
-
-    new_pos = new_pos + 1
+def _ParseImage(tokens, c_pos, header_text):
+    new_pos = c_pos
 
     if new_pos >= len(tokens):
         raise errors.Error('I1')
 
-    if tokens[new_pos].token_type != 'blob':
+    if tokens.TypeAt(new_pos) != _BLOB:
         raise errors.Error('I2')
 
-    path = tokens[new_pos].content
+    path = tokens.ContentAt(new_pos)
     new_pos = new_pos + 1
 
     if new_pos >= len(tokens):
         return (new_pos, model.Image(header_text, path))
-    elif tokens[new_pos].token_type == 'paragraph-end':
+    elif tokens.TypeAt(new_pos) == _PARAGRAPH_END:
         return (new_pos + 1, model.Image(header_text, path))
     else:
         raise errors.Error('I3') 
 
+_CELL_PARSERS = {
+    'formula': _ParseFormula,
+    'code': _ParseCodeBlock,
+    'image': _ParseImage
+}
+
 def _ParseText(tokens, c_pos):
-    atoms = []
+    # Builds the compact form of the Text directly, without a Word object for every word.
+    words = []
+    words_text_len = 0
+    function_offsets = []
+    functions = []
     new_pos = c_pos
-
-    while new_pos < len(tokens):
-        (new_pos, atom) = _ParseAtom(tokens, new_pos)
-
-        if atom is None:
+    tokens_len = len(tokens)
+
+    while new_pos < tokens_len:
+        token_type = tokens.TypeAt(new_pos)
+
+        if token_type == _WORD:
+            word = tokens.ContentAt(new_pos)
+            words.append(word)
+            words_text_len = words_text_len + len(word) + 1
+            new_pos = new_pos + 1
+        elif token_type == _SLASH:
+            (new_pos, function) = _ParseFunction(tokens, new_pos)
+            function_offsets.append(words_text_len)
+            functions.append(function)
+        else:
             break
 
-        atoms.append(atom)
-
-    if len(atoms) == 0:
+    if new_pos == c_pos:
         return (c_pos, None)
 
-    return (new_pos, model.Text(atoms))
+    words_text = ' '.join(words) + ' ' if len(words) > 0 else ''
 
-def _ParseAtom(tokens, c_pos):
-    (new_pos, word) = _ParseWord(tokens, c_pos)
-
-    if word is not None:
-        return (new_pos, word)
-
-    (new_pos, function) = _ParseFunction(tokens, c_pos)
-
-    if function is not None:
-        return (new_pos, function)
-
-    return (c_pos, None)
-
-def _ParseWord(tokens, c_pos):
-    new_pos = c_pos
-
-    if tokens[new_pos].token_type != 'word':
-        return (new_pos, None)
-
-    return (new_pos + 1, model.Word(tokens[new_pos].content))
+    return (new_pos, model.Text.Compact(words_text, tuple(function_offsets), tuple(functions)))
 
 def _ParseFunction(tokens, c_pos):
     new_pos = c_pos
 
-    if tokens[new_pos].token_type != 'slash':
+    if tokens.TypeAt(new_pos) != _SLASH:
         return (new_pos, None)
 
     new_pos = new_pos + 1
@@ -576,169 +1189,164 @@ def _ParseFunction(tokens, c_pos):
     if new_pos > len(tokens):
         raise errors.Error('C')
 
-    if tokens[new_pos].token_type != 'word':
+    if tokens.TypeAt(new_pos) != _WORD:
         print tokens[c_pos-20:c_pos+20]
         raise errors.Error('D')
 
-    name = tokens[new_pos].content
+    name = tokens.ContentAt(new_pos)
     new_pos = new_pos + 1
     arg_list = []
 
-    while new_pos < len(tokens) and tokens[new_pos].token_type == 'blob':
-        arg_list.append(tokens[new_pos].content)
+    while new_pos < len(tokens) and tokens.TypeAt(new_pos) == _BLOB:
+        arg_list.append(tokens.ContentAt(new_pos))
         new_pos = new_pos + 1
 
     return (new_pos, model.Function(name, arg_list))
 
-_WORD_RE = re.compile(r'([^{}\\*%=\s]+)', flags=re.UNICODE)
 _WS_RE = re.compile(r'[ \t]+')
-_SLASH_RE = re.compile(r'(\\)')
-_LIST_MARKER_RE = re.compile(r'([*])')
-_CELL_MARKER_RE = re.compile(r'(%)')
-_SECTION_MARKER_RE = re.compile(r'(=+)')
+_BRACE_RE = re.compile(r'[{}]')
+
+_TOKEN_RE = re.compile(
+    r'(?:(?P<word>[^{}\\*%=\s]+)'
+    r'|(?P<blob>\{)'
+    r'|(?P<slash>\\)'
+    r'|(?P<list_marker>[*])'
+    r'|(?P<cell_marker>%)'
+    r'|(?P<section_marker>=+)'
+    r'|(?P<newline>\n[ \t]*(?P<paragraph_end>(?:[ \t]*\n)*)))'
+    r'[ \t]*', flags=re.UNICODE)
+
+_SIMPLE_TOKEN_TYPES = {
+    'word': _WORD,
+    'slash': _SLASH,
+    'list_marker': _LIST_MARKER,
+    'cell_marker': _CELL_MARKER,
+    'section_marker': _SECTION_MARKER
+}
 
 def _Tokenize(text):
-    tokens = []
-    c_pos = _SkipWS(text, 0, 0)
-    c_line = 0
+    return _ScanTokens(text).ToTokens()
 
-    while c_pos < len(text):
-        (new_pos, word) = _TryWord(text, c_pos, c_line)
-        if word is not None:
-            tokens.append(word)
-            c_pos = _SkipWS(text, new_pos, c_line)
-            continue
+def _ScanTokens(text):
+    columns = _NewTokenColumns()
 
-        (new_pos, new_line, blob) = _TryBlob(text, c_pos, c_line)
-        if blob is not None:
-            tokens.append(blob)
-            c_pos = _SkipWS(text, new_pos, c_line)
-            c_line = new_line
-            continue
+    for _ in _ScanTokenChunks(text, 0, columns):
+        pass
 
-        (new_pos, slash) = _TrySpecialSequence(text, 'slash', _SLASH_RE, c_pos, c_line)
-        if slash is not None:
-            tokens.append(slash)
-            c_pos = _SkipWS(text, new_pos, c_line)
-            continue
+    return TokenStream(text, *columns)
 
-        (new_pos, list_marker) = _TrySpecialSequence(text, 'list-marker', _LIST_MARKER_RE, c_pos, c_line)
-        if list_marker is not None:
-            tokens.append(list_marker)
-            c_pos = _SkipWS(text, new_pos, c_line)
-            continue
+def _ScanTokenChunks(text, c_pos, columns):
+    # Appends the tokens of text from c_pos onwards to columns, a tuple of parallel arrays
+    # as kept by a TokenStream, and yields after every paragraph-end. Positions are offsets
+    # into text, and lines count from c_pos.
+    (types, starts, ends, start_lines, end_lines) = columns
 
-        (new_pos, cell_marker) = _TrySpecialSequence(text, 'cell-marker', _CELL_MARKER_RE, c_pos, c_line)
-        if cell_marker is not None:
-            tokens.append(cell_marker)
-            c_pos = _SkipWS(text, new_pos, c_line)
-            continue
+    # Bound once, as these are called for every token.
+    types_append = types.append
+    starts_append = starts.append
+    ends_append = ends.append
+    start_lines_append = start_lines.append
+    end_lines_append = end_lines.append
 
-        (new_pos, section_marker) = _TrySpecialSequence(text, 'section-marker', _SECTION_MARKER_RE, c_pos, c_line)
-        if section_marker is not None:
-            tokens.append(section_marker)
-            c_pos = _SkipWS(text, new_pos, c_line)
-            continue
+    c_pos = _SkipWS(text, c_pos, 0)
+    c_line = 0
+    text_len = len(text)
+    token_match = _TOKEN_RE.match
+    last_type = _PARAGRAPH_END
 
-        # Reached some form of newline.
+    while c_pos < text_len:
+        match_obj = token_match(text, c_pos)
 
-        if text[c_pos] != '\n':
+        if match_obj is None:
             print c_line
             print text[c_pos:c_pos+100]
             raise errors.Error('A')
 
-        c_pos = c_pos + 1
-        c_line = c_line + 1
-
-        c_pos = _SkipWS(text, c_pos, c_line)
-        (new_pos, new_line, paragraph_end) = _TryParagraphEnd(text, c_pos, c_line)
-
-        if paragraph_end:
-            tokens.append(paragraph_end)
+        kind = match_obj.lastgroup
+
+        if kind in _SIMPLE_TOKEN_TYPES:
+            (start, end) = match_obj.span(kind)
+            last_type = _SIMPLE_TOKEN_TYPES[kind]
+            types_append(last_type)
+            starts_append(start)
+            ends_append(end)
+            start_lines_append(c_line)
+            end_lines_append(c_line)
+            c_pos = match_obj.end(0)
+        elif kind == 'blob':
+            (new_pos, new_line) = _ScanBlob(text, c_pos, c_line)
+            last_type = _BLOB
+            types_append(_BLOB)
+            starts_append(c_pos)
+            ends_append(new_pos)
+            start_lines_append(c_line)
+            end_lines_append(new_line)
             c_pos = _SkipWS(text, new_pos, c_line)
             c_line = new_line
-            continue
-
-    if len(tokens) >= 1 and tokens[-1].token_type != 'paragraph-end':
-        tokens.append(Token('paragraph-end', '', SourcePos(c_line, c_line, c_pos, c_pos)))
-
-    return tokens
-
-def _TryWord(text, c_pos, c_line):
-    word_match = _WORD_RE.match(text, c_pos)
-
-    if word_match is None:
-        return (c_pos, None)
-
-    source_pos = SourcePos(c_line, c_line, word_match.start(0), word_match.end(0))
-    token = Token('word', word_match.group(1), source_pos)
+        else:
+            # Reached a newline. It is a paragraph-end if it is followed by at least one more
+            # (whitespace only) line or by a section-marker.
+            c_line = c_line + 1
+            (end_start, end_end) = match_obj.span('paragraph_end')
+            c_pos = match_obj.end(0)
+
+            if end_end > end_start or text[end_end:end_end+1] == '=':
+                new_line = c_line + _CountNewlines(text, end_start, end_end)
+                last_type = _PARAGRAPH_END
+                types_append(_PARAGRAPH_END)
+                starts_append(end_start)
+                ends_append(end_end)
+                start_lines_append(c_line)
+                end_lines_append(new_line)
+                c_line = new_line
+
+                yield
+
+    if last_type != _PARAGRAPH_END:
+        types_append(_PARAGRAPH_END)
+        starts_append(c_pos)
+        ends_append(c_pos)
+        start_lines_append(c_line)
+        end_lines_append(c_line)
+
+        yield
+
+def _NewTokenColumns():
+    return (array.array('b'), array.array('i'), array.array('i'), array.array('i'), array.array('i'))
+
+def _ScanBlob(text, c_pos, c_line):
+    # Jumps from brace to brace, instead of looking at every character of the blob.
+    brace_counter = 1
+    new_pos = c_pos + 1
+    brace_search = _BRACE_RE.search
 
-    return (word_match.end(0), token)
+    while brace_counter > 0:
+        brace_match = brace_search(text, new_pos)
 
-def _TryBlob(text, c_pos, c_line):
-    if text[c_pos] != '{':
-        return (c_pos, c_line, None)
+        if brace_match is None:
+            new_pos = len(text)
+            break
 
-    brace_counter = 1
-    new_pos = c_pos + 1
-    new_line = c_line
+        new_pos = brace_match.end(0)
 
-    while brace_counter > 0 and new_pos < len(text):
-        if text[new_pos] == '{':
+        if text[new_pos-1] == '{':
             brace_counter = brace_counter + 1
-        elif text[new_pos] == '}':
+        else:
             brace_counter = brace_counter - 1
-        elif text[new_pos] == '\n':
-            new_line = new_line + 1
-
-        new_pos = new_pos + 1
 
     if brace_counter > 0:
         print text[c_pos:c_pos+150]
         print text[new_pos-150:new_pos+150]
         raise errors.Error('B')
 
-    source_pos = SourcePos(c_line, new_line, c_pos, new_pos)
-    token = Token('blob', text[c_pos+1:new_pos-1], source_pos)
-
-    return (new_pos, new_line, token)
-
-def _TrySpecialSequence(text, sequence_type, sequence_re, c_pos, c_line):
-    sequence_match = sequence_re.match(text, c_pos)
-
-    if sequence_match is None:
-        return (c_pos, None)
-
-    source_pos = SourcePos(c_line, c_line, sequence_match.start(0), sequence_match.end(0))
-    token = Token(sequence_type, sequence_match.group(1), source_pos)
-
-    return (sequence_match.end(0), token)
-
-def _TryParagraphEnd(text, c_pos, c_line):
-    new_pos = c_pos
-    new_line = c_line
-    saw_end = False
-
-    while 1:
-        new_new_pos = _SkipWS(text, new_pos, c_line)
-
-        if text[new_new_pos:new_new_pos+1] == '\n':
-            new_pos = new_new_pos + 1
-            new_line = new_line + 1
-            saw_end = True
-        else:
-            break
-
-    if text[new_pos:new_pos+1] == '=':
-        saw_end = True
+    return (new_pos, c_line + _CountNewlines(text, c_pos, new_pos))
 
-    if not saw_end:
-        return (c_pos, c_line, None)
+def _CountNewlines(text, start, end):
+    # Memory-mapped post files have no count method, so the range is sliced out of them.
+    if isinstance(text, str):
+        return text.count('\n', start, end)
 
-    source_pos = SourcePos(c_line, new_line, c_pos, new_pos)
-    token = Token('paragraph-end', text[c_pos:new_pos], source_pos)
-    
-    return (new_pos, new_line, token)
+    return text[start:end].count('\n')
 
 def _SkipWS(text, c_pos, c_line):
     ws_match = _WS_RE.match(text, c_pos)
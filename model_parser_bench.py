@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+import argparse
+import random
+import re
+import sys
+import time
+
+import errors
+import model_parser as mp
+
+# The tokenizer the parser started out with, which _Tokenize and _ScanBlob replaced. It is
+# kept here, rather than in model_parser, as a reference to check and benchmark them against.
+
+_WORD_RE = re.compile(r'([^{}\\*%=\s]+)', flags=re.UNICODE)
+_SLASH_RE = re.compile(r'(\\)')
+_LIST_MARKER_RE = re.compile(r'([*])')
+_CELL_MARKER_RE = re.compile(r'(%)')
+_SECTION_MARKER_RE = re.compile(r'(=+)')
+
+def _TokenizeStepwise(text):
+    # Tries every token type in turn at each position.
+    tokens = []
+    c_pos = mp._SkipWS(text, 0, 0)
+    c_line = 0
+
+    while c_pos < len(text):
+        (new_pos, word) = _TryWord(text, c_pos, c_line)
+        if word is not None:
+            tokens.append(word)
+            c_pos = mp._SkipWS(text, new_pos, c_line)
+            continue
+
+        (new_pos, new_line, blob) = _TryBlob(text, c_pos, c_line)
+        if blob is not None:
+            tokens.append(blob)
+            c_pos = mp._SkipWS(text, new_pos, c_line)
+            c_line = new_line
+            continue
+
+        (new_pos, slash) = _TrySpecialSequence(text, 'slash', _SLASH_RE, c_pos, c_line)
+        if slash is not None:
+            tokens.append(slash)
+            c_pos = mp._SkipWS(text, new_pos, c_line)
+            continue
+
+        (new_pos, list_marker) = _TrySpecialSequence(text, 'list-marker', _LIST_MARKER_RE, c_pos, c_line)
+        if list_marker is not None:
+            tokens.append(list_marker)
+            c_pos = mp._SkipWS(text, new_pos, c_line)
+            continue
+
+        (new_pos, cell_marker) = _TrySpecialSequence(text, 'cell-marker', _CELL_MARKER_RE, c_pos, c_line)
+        if cell_marker is not None:
+            tokens.append(cell_marker)
+            c_pos = mp._SkipWS(text, new_pos, c_line)
+            continue
+
+        (new_pos, section_marker) = _TrySpecialSequence(text, 'section-marker', _SECTION_MARKER_RE, c_pos, c_line)
+        if section_marker is not None:
+            tokens.append(section_marker)
+            c_pos = mp._SkipWS(text, new_pos, c_line)
+            continue
+
+        # Reached some form of newline.
+
+        if text[c_pos] != '\n':
+            print c_line
+            print text[c_pos:c_pos+100]
+            raise errors.Error('A')
+
+        c_pos = c_pos + 1
+        c_line = c_line + 1
+
+        c_pos = mp._SkipWS(text, c_pos, c_line)
+        (new_pos, new_line, paragraph_end) = _TryParagraphEnd(text, c_pos, c_line)
+
+        if paragraph_end:
+            tokens.append(paragraph_end)
+            c_pos = mp._SkipWS(text, new_pos, c_line)
+            c_line = new_line
+            continue
+
+    if len(tokens) >= 1 and tokens[-1].token_type != 'paragraph-end':
+        tokens.append(mp.Token('paragraph-end', '', mp.SourcePos(c_line, c_line, c_pos, c_pos)))
+
+    return tokens
+
+def _TryWord(text, c_pos, c_line):
+    word_match = _WORD_RE.match(text, c_pos)
+
+    if word_match is None:
+        return (c_pos, None)
+
+    source_pos = mp.SourcePos(c_line, c_line, word_match.start(0), word_match.end(0))
+    token = mp.Token('word', word_match.group(1), source_pos)
+
+    return (word_match.end(0), token)
+
+def _TryBlob(text, c_pos, c_line):
+    if text[c_pos] != '{':
+        return (c_pos, c_line, None)
+
+    (new_pos, new_line) = mp._ScanBlob(text, c_pos, c_line)
+    source_pos = mp.SourcePos(c_line, new_line, c_pos, new_pos)
+    token = mp.Token('blob', text[c_pos+1:new_pos-1], source_pos)
+
+    return (new_pos, new_line, token)
+
+def _ScanBlobStepwise(text, c_pos, c_line):
+    # Looks at one character at a time.
+    brace_counter = 1
+    new_pos = c_pos + 1
+    new_line = c_line
+
+    while brace_counter > 0 and new_pos < len(text):
+        if text[new_pos] == '{':
+            brace_counter = brace_counter + 1
+        elif text[new_pos] == '}':
+            brace_counter = brace_counter - 1
+        elif text[new_pos] == '\n':
+            new_line = new_line + 1
+
+        new_pos = new_pos + 1
+
+    if brace_counter > 0:
+        print text[c_pos:c_pos+150]
+        print text[new_pos-150:new_pos+150]
+        raise errors.Error('B')
+
+    return (new_pos, new_line)
+
+def _TrySpecialSequence(text, sequence_type, sequence_re, c_pos, c_line):
+    sequence_match = sequence_re.match(text, c_pos)
+
+    if sequence_match is None:
+        return (c_pos, None)
+
+    source_pos = mp.SourcePos(c_line, c_line, sequence_match.start(0), sequence_match.end(0))
+    token = mp.Token(sequence_type, sequence_match.group(1), source_pos)
+
+    return (sequence_match.end(0), token)
+
+def _TryParagraphEnd(text, c_pos, c_line):
+    new_pos = c_pos
+    new_line = c_line
+    saw_end = False
+
+    while 1:
+        new_new_pos = mp._SkipWS(text, new_pos, c_line)
+
+        if text[new_new_pos:new_new_pos+1] == '\n':
+            new_pos = new_new_pos + 1
+            new_line = new_line + 1
+            saw_end = True
+        else:
+            break
+
+    if text[new_pos:new_pos+1] == '=':
+        saw_end = True
+
+    if not saw_end:
+        return (c_pos, c_line, None)
+
+    source_pos = mp.SourcePos(c_line, new_line, c_pos, new_pos)
+    token = mp.Token('paragraph-end', text[c_pos:new_pos], source_pos)
+    
+    return (new_pos, new_line, token)
+
+def _MakePostText(size, seed):
+    rng = random.Random(seed)
+    words = ['hello', 'world', 'parser', 'tokens', 'are', 'cheap', 'when', 'done', 'right', 'x+y']
+    paragraphs = []
+    length = 0
+    level = 0
+
+    while length < size:
+        kind = rng.randint(0, 9)
+
+        if kind == 0 and len(paragraphs) >= 1:
+            level = rng.randint(1, min(level + 1, 3))
+            paragraph = '=' * level + ' '.join(rng.choice(words) for _ in range(4)) + '=' * level
+        elif kind == 1:
+            paragraph = 'Items:\n' + '\n'.join('*' + ' '.join(rng.choice(words) for _ in range(6))
+                                               for _ in range(4))
+        elif kind == 2:
+            paragraph = 'Some code:\n%code{python}{def f(x):\n    return {x: x + 1}\n}'
+        else:
+            paragraph = ' '.join(rng.choice(words) if rng.random() > 0.05 else '\\def{term}'
+                                 for _ in range(60))
+
+        paragraphs.append(paragraph)
+        length = length + len(paragraph) + 2
+
+    return '\n\n'.join(paragraphs)
+
+def _MakeCodePostText(size, seed):
+    rng = random.Random(seed)
+    lines = ['def f(x):', '    return {x: [y for y in range(x)]}', 'int main() { return 0; }',
+             '    if (x) { y = {1, 2, 3}; }', '# just a comment with some words in it', '']
+    paragraphs = []
+    length = 0
+
+    while length < size:
+        code = '\n'.join(rng.choice(lines) for _ in range(rng.randint(50, 400)))
+        paragraph = 'A listing:\n%code{python}{' + code + '}\n\nSome text after the listing.'
+        paragraphs.append(paragraph)
+        length = length + len(paragraph) + 2
+
+    return '\n\n'.join(paragraphs)
+
+def _Throughput(tokenize, text, repeats):
+    best = None
+
+    for _ in range(repeats):
+        start = time.time()
+        tokenize(text)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return (len(text) / (1024.0 * 1024.0)) / best
+
+def _TokenListBytes(tokens):
+    total = sys.getsizeof(tokens)
+
+    for token in tokens:
+        total = total + sys.getsizeof(token) + sys.getsizeof(token.__dict__) + \
+            sys.getsizeof(token.content) + sys.getsizeof(token.source_pos) + \
+            sys.getsizeof(token.source_pos.__dict__)
+
+    return total
+
+def _TokenStreamBytes(tokens):
+    return sys.getsizeof(tokens) + sum(sys.getsizeof(column) for column in
+        (tokens._types, tokens._starts, tokens._ends, tokens._start_lines, tokens._end_lines))
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(description='Benchmarks for the post parser')
+    arg_parser.add_argument('--size', metavar='BYTES', type=int, default=200 * 1024,
+                            help='Approximate size of the generated post')
+    arg_parser.add_argument('--repeats', metavar='N', type=int, default=5,
+                            help='Number of runs to take the best time from')
+    args = arg_parser.parse_args(argv[1:])
+
+    text = _MakePostText(args.size, 0)
+
+    token_list = _TokenizeStepwise(text)
+    token_stream = mp._ScanTokens(text)
+
+    if token_list != token_stream.ToTokens():
+        raise AssertionError('Tokenizers disagree')
+
+    stepwise = _Throughput(_TokenizeStepwise, text, args.repeats)
+    single_pass = _Throughput(mp._Tokenize, text, args.repeats)
+    stream = _Throughput(mp._ScanTokens, text, args.repeats)
+
+    print 'Tokenize (%d bytes, %d tokens)' % (len(text), len(token_list))
+    print '  stepwise:     %6.2f MB/s' % stepwise
+    print '  single-pass:  %6.2f MB/s (%.2fx)' % (single_pass, single_pass / stepwise)
+    print '  token stream: %6.2f MB/s (%.2fx)' % (stream, stream / stepwise)
+    code_text = _MakeCodePostText(args.size, 0)
+    fast_scan_blob = mp._ScanBlob
+
+    try:
+        mp._ScanBlob = _ScanBlobStepwise
+        stepwise_blob_tokens = mp._ScanTokens(code_text).ToTokens()
+        stepwise_blob = _Throughput(mp._ScanTokens, code_text, args.repeats)
+    finally:
+        mp._ScanBlob = fast_scan_blob
+
+    if stepwise_blob_tokens != mp._ScanTokens(code_text).ToTokens():
+        raise AssertionError('Blob scanners disagree')
+
+    fast_blob = _Throughput(mp._ScanTokens, code_text, args.repeats)
+
+    print 'Tokenize code listings (%d bytes)' % len(code_text)
+    print '  stepwise blobs: %6.2f MB/s' % stepwise_blob
+    print '  brace jumping:  %6.2f MB/s (%.2fx)' % (fast_blob, fast_blob / stepwise_blob)
+    print 'Parse'
+    print '  post text:    %6.2f MB/s' % _Throughput(mp._ParsePostText, text, args.repeats)
+    print 'Token memory'
+    print '  token list:   %8d bytes' % _TokenListBytes(token_list)
+    print '  token stream: %8d bytes' % _TokenStreamBytes(token_stream)
+
+if __name__ == '__main__':
+    main(sys.argv)
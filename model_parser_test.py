@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
 
+import os
+import pickle
+import random
 import re
+import shutil
+import tempfile
 import unittest
 
+import cache
 import errors
+import manifest
+import model
 import model_parser as mp
+import model_parser_bench as mpb
+import post_index
 
 class TestSourcePos(unittest.TestCase):
     def test_constructor(self):
@@ -56,6 +66,78 @@ class TestToken(unittest.TestCase):
         self.assertNotEqual(token_1, token_4)
         self.assertNotEqual(token_1, ['word', 'abraccarda', source_pos_1])
 
+class TestTokenStream(unittest.TestCase):
+    def test_Accessors(self):
+        tokens = mp._ScanTokens('hello \\def{space}\n\n=x=')
+
+        self.assertEqual(9, len(tokens))
+        self.assertEqual(mp._WORD, tokens.TypeAt(0))
+        self.assertEqual('hello', tokens.ContentAt(0))
+        self.assertEqual(mp._SLASH, tokens.TypeAt(1))
+        self.assertEqual(mp._BLOB, tokens.TypeAt(3))
+        self.assertEqual('space', tokens.ContentAt(3))
+        self.assertEqual(mp._PARAGRAPH_END, tokens.TypeAt(4))
+        self.assertEqual('\n', tokens.ContentAt(4))
+        self.assertEqual(mp.Token('blob', 'space', mp.SourcePos(0, 0, 10, 17)), tokens[3])
+        self.assertEqual([mp.Token('section-marker', '=', mp.SourcePos(2, 2, 19, 20)),
+                          mp.Token('word', 'x', mp.SourcePos(2, 2, 20, 21))], tokens[5:7])
+
+    def test_ToTokens(self):
+        text = 'hello\nworld\n\n\\def{space}\n   \nList\n*hello\n*world\n\n%code{C++}{x = x + 1}'
+
+        self.assertEqual(mpb._TokenizeStepwise(text), mp._ScanTokens(text).ToTokens())
+
+class TestTokenWindow(unittest.TestCase):
+    def test_SameAsTokenStream(self):
+        text = 'hello\nworld\n\n\\def{space}\n   \nList\n*hello\n*world\n\n%code{C++}{x = x + 1}\n=x='
+        stream_tokens = mp._ScanTokens(text)
+        window_tokens = mp.TokenWindow(text, 0)
+
+        for ii in range(len(stream_tokens)):
+            self.assertEqual(stream_tokens.TypeAt(ii), window_tokens.TypeAt(ii))
+            self.assertEqual(stream_tokens.ContentAt(ii), window_tokens.ContentAt(ii))
+            self.assertEqual(stream_tokens[ii], window_tokens[ii])
+
+        self.assertEqual(len(stream_tokens), len(window_tokens))
+
+    def test_ReleasesOldParagraphs(self):
+        window_tokens = mp.TokenWindow('one\n\ntwo\n\nthree\n\nfour', 0)
+
+        self.assertEqual(2, len(window_tokens))
+        self.assertEqual(mp._PARAGRAPH_END, window_tokens.TypeAt(1))
+        self.assertEqual(4, len(window_tokens))
+        self.assertEqual(mp._PARAGRAPH_END, window_tokens.TypeAt(3))
+        self.assertEqual('three', window_tokens.ContentAt(4))
+        self.assertEqual('two', window_tokens.ContentAt(2))
+        self.assertEqual(mp._PARAGRAPH_END, window_tokens.TypeAt(5))
+        self.assertEqual('four', window_tokens.ContentAt(6))
+        self.assertEqual(mp._PARAGRAPH_END, window_tokens.TypeAt(7))
+        self.assertEqual(8, len(window_tokens))
+
+        with self.assertRaises(IndexError):
+            window_tokens.TypeAt(2)
+
+    def test_ParsePostTextSameAsTokenStream(self):
+        post_text = 'Tags: one\n\nhello \\f{x} world\n\n=A=\n\nItems\n*a\n*b\n\n==B==\nSome %code{c}{{\n\n}}'
+        parse_result = mp._ParsePostText(post_text)
+        window_min_size = mp._TOKEN_WINDOW_MIN_SIZE
+
+        try:
+            mp._TOKEN_WINDOW_MIN_SIZE = 0
+            window_parse_result = mp._ParsePostText(post_text)
+        finally:
+            mp._TOKEN_WINDOW_MIN_SIZE = window_min_size
+
+        (_, _, root_section) = parse_result
+        (_, _, window_root_section) = window_parse_result
+
+        self.assertEqual(parse_result[1], window_parse_result[1])
+        self.assertEqual(root_section.paragraphs[0].cell.text, window_root_section.paragraphs[0].cell.text)
+        self.assertEqual(root_section.subsections[0].paragraphs[0].cell.items,
+                         window_root_section.subsections[0].paragraphs[0].cell.items)
+        self.assertEqual(root_section.subsections[0].subsections[0].paragraphs[0].cell.code,
+                         window_root_section.subsections[0].subsections[0].paragraphs[0].cell.code)
+
 class TestTokenize(unittest.TestCase):
     def test_TryTokenize_Words(self):
         tokens = mp._Tokenize('hello world')
@@ -202,156 +284,513 @@ class TestTokenize(unittest.TestCase):
                           mp.Token('word', 'hello', mp.SourcePos(11, 11, 81, 86)),
                           mp.Token('paragraph-end', '', mp.SourcePos(11, 11, 86, 86))], tokens)
 
+    def test_TryTokenize_SameAsStepwise(self):
+        texts = ['', '  \t ', 'hello', 'hello world\n  \n  \n\t  \nhow are you?',
+                 'hello\nworld\n\n\\def{space}\n   \n' +
+                 'List\n*hello\n*world\n\n%code{C++}{x = x + 1}\n\n=section=hello',
+                 '=Title=\n\n==Sub== \n  text {a\n{b}\n} more\n\n\n\n', 'a\n=b\n\n']
+
+        for text in texts:
+            self.assertEqual(mpb._TokenizeStepwise(text), mp._Tokenize(text))
+
+    def test_TryTokenize_ErrorOnStrayCharacter(self):
+        with self.assertRaises(errors.Error):
+            mp._Tokenize('hello } world')
+
+        with self.assertRaises(errors.Error):
+            mp._Tokenize('hello {world')
+
 class TestTokenizeHelpers(unittest.TestCase):
-    def test_TryWord_OneWord(self):
-        (new_pos, word) = mp._TryWord('hello', 0, 0)
+    # Single tokens, as _Tokenize finds them at the start of a text or after others.
+
+    def _Token(self, text, index):
+        return mp._Tokenize(text)[index]
+
+    def test_Word_OneWord(self):
+        self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(0, 0, 0, 5)), self._Token('hello', 0))
+
+    def test_Word_OneWord2(self):
+        self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(1, 1, 10, 15)), self._Token('hello \n   hello', 1))
+
+    def test_Word_OneWordSymbolsAndNonASCII(self):
+        text = 'hello-world-\xce\xb5'
+
+        self.assertEqual(mp.Token('word', text, mp.SourcePos(0, 0, 0, len(text))), self._Token(text, 0))
+
+    def test_Word_TwoWords(self):
+        self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(0, 0, 0, 5)), self._Token('hello world', 0))
+
+    def test_Word_OneWordAndSomethingElse(self):
+        for something_else in ['\n', '{x}', '\\x', '=', '*']:
+            self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(0, 0, 0, 5)),
+                             self._Token('hello%s' % something_else, 0))
+
+    def test_Blob_OneBlob(self):
+        self.assertEqual(mp.Token('blob', 'hello', mp.SourcePos(0, 0, 0, 7)), self._Token('{hello}', 0))
+
+    def test_Blob_OneBlob2(self):
+        self.assertEqual(mp.Token('blob', 'hello', mp.SourcePos(1, 1, 10, 17)), self._Token('hello  \n  {hello}', 1))
+
+    def test_Blob_ComplexBlob(self):
+        self.assertEqual(mp.Token('blob', 'hello world \n how are you today?', mp.SourcePos(0, 1, 0, 34)),
+                         self._Token('{hello world \n how are you today?}', 0))
+
+    def test_Blob_EvenMoreComplexBlob(self):
+        self.assertEqual(mp.Token('blob', 'hello world {lala} \n how are you today{\n{\n}}?', mp.SourcePos(0, 3, 0, 47)),
+                         self._Token('{hello world {lala} \n how are you today{\n{\n}}?}', 0))
+
+    def test_Blob_OneWordSymbolsandNonASCII(self):
+        text = '{hello-world-\xce\xb5}'
+
+        self.assertEqual(mp.Token('blob', text[1:-1], mp.SourcePos(0, 0, 0, len(text))), self._Token(text, 0))
+
+    def test_Blob_OneBlobAndSomethingElse(self):
+        self.assertEqual(mp.Token('blob', 'hello', mp.SourcePos(0, 0, 0, 7)), self._Token('{hello}  \n', 0))
+
+    def test_Blob_ErrorWhenForgotBraceEnd(self):
+        with self.assertRaises(errors.Error):
+            mp._Tokenize('{hello-world')
+
+        with self.assertRaises(errors.Error):
+            mp._Tokenize('{hello-world{}')
+
+    def test_ScanBlob(self):
+        for (text, c_pos, end) in [('{}', 0, (2, 3)), ('{a {b} c}  ', 0, (9, 3)), ('{\n{\n\n}\n}\n{}', 0, (8, 7)),
+                                   ('xx {a\n}', 3, (7, 4)), ('{{{}}{}}}', 0, (8, 3))]:
+            self.assertEqual(end, mp._ScanBlob(text, c_pos, 3))
 
-        self.assertEqual(5, new_pos)
-        self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(0, 0, 0, 5)), word)
+    def test_ScanBlob_ErrorWhenForgotBraceEnd(self):
+        for text in ['{', '{hello\n', '{a{b}', '{{{}}']:
+            with self.assertRaises(errors.Error):
+                mp._ScanBlob(text, 0, 0)
 
-    def test_TryWord_OneWord2(self):
-        (new_pos, word) = mp._TryWord('hello \n   hello', 10, 1)
+    def test_SectionMarker_OneSectionMarker(self):
+        self.assertEqual(mp.Token('section-marker', '=', mp.SourcePos(0, 0, 0, 1)), self._Token('=', 0))
 
-        self.assertEqual(15, new_pos)
-        self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(1, 1, 10, 15)), word)
+    def test_SectionMarker_OneSectionMarker2(self):
+        self.assertEqual(mp.Token('section-marker', '=', mp.SourcePos(1, 1, 10, 11)), self._Token('hello  \n  =', 2))
 
-    def test_TryWord_OneWordSymbolsAndNonASCII(self):
-        (new_pos, word) = mp._TryWord('hello-world-ε', 0, 0)
+    def test_SectionMarker_ManySectionMarkers(self):
+        self.assertEqual(mp.Token('section-marker', '===', mp.SourcePos(0, 0, 0, 3)), self._Token('===', 0))
 
-        self.assertEqual(13, new_pos)
-        self.assertEqual(mp.Token('word', 'hello-world-ε', mp.SourcePos(0, 0, 0, 13)), word)
+    def test_SectionMarker_OneSectionMarkerAndSomethingElse(self):
+        self.assertEqual(mp.Token('section-marker', '=', mp.SourcePos(0, 0, 0, 1)), self._Token('=  \n', 0))
 
-    def test_TryWord_TwoWords(self):
-        (new_pos, word) = mp._TryWord('hello world', 0, 0)
+    def test_ParagraphEnd_AtTextEnd(self):
+        self.assertEqual(mp.Token('paragraph-end', '', mp.SourcePos(1, 1, 2, 2)), self._Token('a\n', 1))
 
-        self.assertEqual(5, new_pos)
-        self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(0, 0, 0, 5)), word)
+    def test_ParagraphEnd_BeforeSection(self):
+        self.assertEqual(mp.Token('paragraph-end', '', mp.SourcePos(1, 1, 2, 2)), self._Token('a\n=', 1))
 
-    def scaffold_TryWord_OneWordAndSomethingElse(self, something_else):
-        (new_pos, word) = mp._TryWord('hello%s' % something_else, 0, 0)
+    def test_ParagraphEnd_ComplexParagraphEnd(self):
+        self.assertEqual(mp.Token('paragraph-end', '\n\t  \n', mp.SourcePos(1, 3, 4, 9)), self._Token('a  \n\n\t  \n', 1))
 
-        self.assertEqual(5, new_pos)
-        self.assertEqual(mp.Token('word', 'hello', mp.SourcePos(0, 0, 0, 5)), word)
+    def test_ParagraphEnd_ComplexParagraphEnd2(self):
+        self.assertEqual(mp.Token('paragraph-end', '\n', mp.SourcePos(1, 2, 4, 5)), self._Token('a  \n\n\t  ', 1))
 
-    def test_TryWord_OneWordAndSomethingElse(self):
-        self.scaffold_TryWord_OneWordAndSomethingElse('\n')
-        self.scaffold_TryWord_OneWordAndSomethingElse('{')
-        self.scaffold_TryWord_OneWordAndSomethingElse('{')
-        self.scaffold_TryWord_OneWordAndSomethingElse('\\')
-        self.scaffold_TryWord_OneWordAndSomethingElse('=')
-        self.scaffold_TryWord_OneWordAndSomethingElse('*')
+    def test_ParagraphEnd_ComplexParagraphEnd3(self):
+        self.assertEqual(mp.Token('paragraph-end', '\n\t  \n', mp.SourcePos(1, 3, 4, 9)),
+                         self._Token('a  \n\n\t  \n=', 1))
 
-    def test_TryBlob_OneBlob(self):
-        (new_pos, new_line, blob) = mp._TryBlob('{hello}', 0, 0)
+    def test_SkipWS(self):
+        self.assertEqual(3, mp._SkipWS('  \t', 0, 0))
+        self.assertEqual(3, mp._SkipWS('  \thello', 0, 0))
+        self.assertEqual(3, mp._SkipWS('  \t\nhello', 0, 0))
 
-        self.assertEqual(7, new_pos)
-        self.assertEqual(0, new_line)
-        self.assertEqual(mp.Token('blob', 'hello', mp.SourcePos(0, 0, 0, 7)), blob)
+class TestParseParagraph(unittest.TestCase):
+    def test_Textual(self):
+        (new_pos, paragraph) = mp._ParseParagraph(mp._ScanTokens('hello world\n\nnext'), 0)
 
-    def test_TryBlob_OneBlob2(self):
-        (new_pos, new_line, blob) = mp._TryBlob('hello  \n  {hello}', 10, 1)
+        self.assertEqual(3, new_pos)
+        self.assertIsInstance(paragraph.cell, model.Textual)
+        self.assertEqual(model.Text([model.Word('hello'), model.Word('world')]), paragraph.cell.text)
 
-        self.assertEqual(17, new_pos)
-        self.assertEqual(1, new_line)
-        self.assertEqual(mp.Token('blob', 'hello', mp.SourcePos(1, 1, 10, 17)), blob)
+    def test_TextualWithFunctions(self):
+        (new_pos, paragraph) = mp._ParseParagraph(mp._ScanTokens('\\slash a \\f{x}{y} b\n\nnext'), 0)
+        atoms = [model.Function('slash', []), model.Word('a'), model.Function('f', ['x', 'y']),
+                 model.Word('b')]
 
-    def test_TryBlob_ComplexBlob(self):
-        (new_pos, new_line, blob) = mp._TryBlob('{hello world \n how are you today?}', 0, 0)
+        self.assertEqual(9, new_pos)
+        self.assertEqual(model.Text(atoms), paragraph.cell.text)
+        self.assertEqual(atoms, paragraph.cell.text.atoms)
+        self.assertEqual('a b ', paragraph.cell.text.words_text)
+        self.assertEqual((0, 2), paragraph.cell.text.function_offsets)
+        self.assertEqual(paragraph.cell.text, pickle.loads(pickle.dumps(paragraph.cell.text, 2)))
 
-        self.assertEqual(34, new_pos)
-        self.assertEqual(1, new_line)
-        self.assertEqual(mp.Token('blob', 'hello world \n how are you today?', mp.SourcePos(0, 1, 0, 34)), blob)
+    def test_List(self):
+        (new_pos, paragraph) = mp._ParseParagraph(mp._ScanTokens('Items\n*one\n*two'), 0)
 
-    def test_TryBlob_EvenMoreComplexBlob(self):
-        (new_pos, new_line, blob) = mp._TryBlob('{hello world {lala} \n how are you today{\n{\n}}?}', 0, 0)
+        self.assertEqual(6, new_pos)
+        self.assertIsInstance(paragraph.cell, model.List)
+        self.assertEqual(model.Text([model.Word('Items')]), paragraph.cell.header_text)
+        self.assertEqual([model.Text([model.Word('one')]), model.Text([model.Word('two')])],
+                         paragraph.cell.items)
 
-        self.assertEqual(47, new_pos)
-        self.assertEqual(3, new_line)
-        self.assertEqual(mp.Token('blob', 'hello world {lala} \n how are you today{\n{\n}}?', mp.SourcePos(0, 3, 0, 47)), blob)
+    def test_CodeBlock(self):
+        (new_pos, paragraph) = mp._ParseParagraph(mp._ScanTokens('Code %code{C++}{x = 1;}'), 0)
 
-    def test_TryBlob_OneWordSymbolsandNonASCII(self):
-        (new_pos, new_line, blob) = mp._TryBlob('{hello-world-ε}', 0, 0)
+        self.assertEqual(6, new_pos)
+        self.assertIsInstance(paragraph.cell, model.CodeBlock)
+        self.assertEqual('C++', paragraph.cell.language)
+        self.assertEqual('x = 1;', paragraph.cell.code)
 
-        self.assertEqual(15, new_pos)
-        self.assertEqual(0, new_line)
-        self.assertEqual(mp.Token('blob', 'hello-world-ε', mp.SourcePos(0, 0, 0, 15)), blob)
+    def test_Image(self):
+        (new_pos, paragraph) = mp._ParseParagraph(mp._ScanTokens('%image{a.png}'), 0)
 
-    def test_TryBlob_OneBlobAndSomethingElse(self):
-        (new_pos, new_line, blob) = mp._TryBlob('{hello}  \n', 0, 0)
+        self.assertEqual(4, new_pos)
+        self.assertIsInstance(paragraph.cell, model.Image)
+        self.assertIsNone(paragraph.cell.header_text)
+        self.assertEqual('a.png', paragraph.cell.path)
 
-        self.assertEqual(7, new_pos)
-        self.assertEqual(0, new_line)
-        self.assertEqual(mp.Token('blob', 'hello', mp.SourcePos(0, 0, 0, 7)), blob)
+    def test_NoParagraph(self):
+        self.assertEqual((0, None), mp._ParseParagraph(mp._ScanTokens('=Title='), 0))
+        self.assertEqual((0, None), mp._ParseParagraph(mp._ScanTokens('hello %unknown{x}'), 0))
 
-    def test_TryBlob_ErrorWhenForgotBraceEnd(self):
+    def test_ErrorOnBadCell(self):
         with self.assertRaises(errors.Error):
-            mp._TryBlob('{hello-world-ε', 0, 0)
+            mp._ParseParagraph(mp._ScanTokens('%code{C++}'), 0)
+
+class TestParseSection(unittest.TestCase):
+    def test_NestedSections(self):
+        tokens = mp._ScanTokens('intro\n\n=One=\n\none\n\n==Two==\n\ntwo\n\n=Three=\n\nthree')
+        (new_pos, root) = mp._ParseSection(tokens, 0, 0, False)
 
+        self.assertEqual(len(tokens), new_pos)
+        self.assertEqual(model.Text([model.Word('.root')]), root.title)
+        self.assertEqual(1, len(root.paragraphs))
+        self.assertEqual([model.Text([model.Word('One')]), model.Text([model.Word('Three')])],
+                         [s.title for s in root.subsections])
+        self.assertEqual(model.Text([model.Word('Two')]), root.subsections[0].subsections[0].title)
+        self.assertEqual([], root.subsections[1].subsections)
+
+    def test_DeeplyNestedSections(self):
+        depth = 1500
+        text = 'intro\n\n' + '\n\n'.join('%sx%s\n\ny' % ('=' * l, '=' * l) for l in range(1, depth + 1))
+        tokens = mp._ScanTokens(text)
+        (new_pos, section) = mp._ParseSection(tokens, 0, 0, False)
+
+        self.assertEqual(len(tokens), new_pos)
+
+        for _ in range(depth):
+            self.assertEqual(1, len(section.subsections))
+            section = section.subsections[0]
+
+        self.assertEqual([], section.subsections)
+
+    def test_ErrorOnUnclosedTitle(self):
         with self.assertRaises(errors.Error):
-            mp._TryBlob('{hello-world-ε{}', 0, 0)
+            mp._ParseSection(mp._ScanTokens('=One'), 0, 0, False)
 
-    def test_TrySpecialSequence_OneSpecialSequence(self):
-        re_marker = re.compile(r'(=+)')
-        (new_pos, marker) = mp._TrySpecialSequence('=', 'section-marker', re_marker, 0, 0)
+class TestParsePostEvents(unittest.TestCase):
+    def test_Events(self):
+        events = list(mp.ParsePostEvents('Tags: x\n\nhello\n\n=A=\n\nItems\n*a\n\n==B==\none\n\n=C=\ntwo'))
 
-        self.assertEqual(1, new_pos)
-        self.assertEqual(mp.Token('section-marker', '=', mp.SourcePos(0, 0, 0, 1)), marker)
+        self.assertEqual([(mp.SECTION_START, 0), (mp.PARAGRAPH, 0), (mp.SECTION_START, 1), (mp.PARAGRAPH, 1),
+                          (mp.SECTION_START, 2), (mp.PARAGRAPH, 2), (mp.SECTION_END, 2), (mp.SECTION_END, 1),
+                          (mp.SECTION_START, 1), (mp.PARAGRAPH, 1), (mp.SECTION_END, 1), (mp.SECTION_END, 0)],
+                         [(kind, level) for (kind, level, _) in events])
+        self.assertEqual(model.Text([model.Word('A')]), events[2][2])
+        self.assertIsInstance(events[3][2].cell, model.List)
 
-    def test_TrySpecialSequence_OneSpecialSequence2(self):
-        re_marker = re.compile(r'(=+)')
-        (new_pos, marker) = mp._TrySpecialSequence('hello  \n  =', 'section-marker', re_marker, 10, 1)
+    def test_SameAsSectionEvents(self):
+        post_text = 'Series: s\n\nhello \\f{x}\n\n=A=\n\n%code{c}{x}\n\n==B==\none\n\n===C===\n\n=D=\ntwo'
+        (_, _, root_section) = mp._ParsePostText(post_text)
+        events = list(mp.ParsePostEvents(post_text))
+        tree_events = list(mp.SectionEvents(root_section, 0))
 
-        self.assertEqual(11, new_pos)
-        self.assertEqual(mp.Token('section-marker', '=', mp.SourcePos(1, 1, 10, 11)), marker)
+        self.assertEqual([(kind, level) for (kind, level, _) in tree_events],
+                         [(kind, level) for (kind, level, _) in events])
+        self.assertEqual([payload.cell.__class__ for (kind, _, payload) in tree_events if kind == mp.PARAGRAPH],
+                         [payload.cell.__class__ for (kind, _, payload) in events if kind == mp.PARAGRAPH])
 
-    def test_TrySpecialSequence_ManySpecialSequences(self):
-        re_marker = re.compile(r'(=+)')
-        (new_pos, marker) = mp._TrySpecialSequence('===', 'section-marker', re_marker, 0, 0)
+    def test_ErrorAfterEvents(self):
+        events = mp.ParsePostEvents('hello\n\n==A==\nworld')
 
-        self.assertEqual(3, new_pos)
-        self.assertEqual(mp.Token('section-marker', '===', mp.SourcePos(0, 0, 0, 3)), marker)
+        self.assertEqual(mp.SECTION_START, next(events)[0])
+        self.assertEqual(mp.PARAGRAPH, next(events)[0])
 
-    def test_TrySpecialSequence_OneSpecialSequenceAndSomethingElse(self):
-        re_marker = re.compile(r'(=+)')
-        (new_pos, marker) = mp._TrySpecialSequence('=  \n', 'section-marker', re_marker, 0, 0)
+        with self.assertRaises(errors.Error):
+            list(events)
+
+class TestPostParseState(unittest.TestCase):
+    def _AssertSameAsFullParse(self, parse_state, post_text):
+        (series, tags, root_section) = parse_state.Reparse(post_text)
+        (full_series, full_tags, full_root_section) = mp._ParsePostText(post_text)
+        events = list(mp.SectionEvents(root_section, 0))
+        full_events = list(mp.SectionEvents(full_root_section, 0))
+
+        self.assertEqual(full_series, series)
+        self.assertEqual(full_tags, tags)
+        self.assertEqual([(kind, level) for (kind, level, _) in full_events],
+                         [(kind, level) for (kind, level, _) in events])
+        self.assertEqual([payload for (kind, _, payload) in full_events if kind == mp.SECTION_START],
+                         [payload for (kind, _, payload) in events if kind == mp.SECTION_START])
+        self.assertEqual([payload.cell.__class__ for (kind, _, payload) in full_events if kind == mp.PARAGRAPH],
+                         [payload.cell.__class__ for (kind, _, payload) in events if kind == mp.PARAGRAPH])
+
+        return root_section
+
+    def test_Edits(self):
+        parse_state = mp.PostParseState()
+        post_text = 'Tags: x\n\nhello\n\n=A=\n\none two\n\n==B==\n*a\n*b\n\n=C=\nthree'
+
+        self._AssertSameAsFullParse(parse_state, post_text)
+        self._AssertSameAsFullParse(parse_state, post_text.replace('one two', 'one \\f{two}'))
+        self._AssertSameAsFullParse(parse_state, post_text.replace('\n\n==B==', '\n\nnew\n\n==B=='))
+        self._AssertSameAsFullParse(parse_state, post_text.replace('one two\n\n', ''))
+        self._AssertSameAsFullParse(parse_state, post_text.replace('three', '==D==\nthree'))
+        self._AssertSameAsFullParse(parse_state, post_text.replace('Tags: x', 'Series: s'))
+        self._AssertSameAsFullParse(parse_state, post_text.replace('\n\n==B==', '\n\n%code{c}{x\n\ny}\n\n==B=='))
+
+    def test_UnchangedParagraphsAreReused(self):
+        parse_state = mp.PostParseState()
+        (_, _, root_section) = parse_state.Reparse('first\n\n=A=\n\nsecond\n\nthird')
+        new_root_section = self._AssertSameAsFullParse(parse_state, 'first\n\n=A=\n\nsecond word\n\nthird')
+
+        self.assertIs(root_section.paragraphs[0], new_root_section.paragraphs[0])
+        self.assertIsNot(root_section.subsections[0].paragraphs[0], new_root_section.subsections[0].paragraphs[0])
+        self.assertIs(root_section.subsections[0].paragraphs[1], new_root_section.subsections[0].paragraphs[1])
+
+    def test_ErrorThenFixed(self):
+        parse_state = mp.PostParseState()
+        post_text = 'hello\n\n=A=\n\nworld'
+
+        self._AssertSameAsFullParse(parse_state, post_text)
 
-        self.assertEqual(1, new_pos)
-        self.assertEqual(mp.Token('section-marker', '=', mp.SourcePos(0, 0, 0, 1)), marker)
+        with self.assertRaises(errors.Error):
+            parse_state.Reparse(post_text.replace('=A=', '==A=='))
 
-    def test_TryParagraphEnd_OneParagraphEndWithWS(self):
-        (new_pos, new_line, paragraph_end) = mp._TryParagraphEnd('\n', 0, 0)
+        self._AssertSameAsFullParse(parse_state, post_text.replace('world', 'there'))
+
+    def test_RandomEdits(self):
+        rng = random.Random(14)
+        pieces = ['a', ' ', '\n', '\n\n', '=', '=T=\n', '==T==\n', '*i\n', '{', '}', '\\f{x}', '%code{c}{']
+        parse_state = mp.PostParseState()
+        post_text = 'Tags: x\n\nhello\n\n=A=\n\none two\n\n==B==\n*a\n*b\n\n=C=\nthree'
 
-        self.assertEqual(1, new_pos)
-        self.assertEqual(mp.Token('paragraph-end', '\n', mp.SourcePos(0, 1, 0, 1)), paragraph_end)
+        for _ in range(300):
+            pos = rng.randint(0, len(post_text))
+            post_text = post_text[:pos] + rng.choice(pieces) + post_text[pos + rng.randint(0, 3):]
 
-    def test_TryParagraphEnd_OneParagraphEndWithSection(self):
-        (new_pos, new_line, paragraph_end) = mp._TryParagraphEnd('=', 0, 0)
+            try:
+                mp._ParsePostText(post_text)
+            except errors.Error:
+                with self.assertRaises(errors.Error):
+                    parse_state.Reparse(post_text)
+                continue
 
-        self.assertEqual(0, new_pos)
-        self.assertEqual(mp.Token('paragraph-end', '', mp.SourcePos(0, 0, 0, 0)), paragraph_end)
+            self._AssertSameAsFullParse(parse_state, post_text)
 
-    def test_TryParagraphEnd_ComplexParagraphEnd(self):
-        (new_pos, new_line, paragraph_end) = mp._TryParagraphEnd('  \n\n\t  \n', 0, 0)
+class TestParsePostTextCached(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
 
-        self.assertEqual(8, new_pos)
-        self.assertEqual(mp.Token('paragraph-end', '  \n\n\t  \n', mp.SourcePos(0, 3, 0, 8)), paragraph_end)
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
 
-    def test_TryParagraphEnd_ComplexParagraphEnd2(self):
-        (new_pos, new_line, paragraph_end) = mp._TryParagraphEnd('  \n\n\t  ', 0, 0)
+    def test_SecondParseComesFromCache(self):
+        parse_cache = cache.DiskCache(self._dir_path, 1024 * 1024)
+        post_text = 'Tags: one, two\n\nhello world\n\n=Section=\n\ntext'
 
-        self.assertEqual(4, new_pos)
-        self.assertEqual(mp.Token('paragraph-end', '  \n\n', mp.SourcePos(0, 2, 0, 4)), paragraph_end)
+        (series, tags, root_section) = mp._ParsePostTextCached(post_text, parse_cache)
+
+        self.assertEqual(1, len(os.listdir(self._dir_path)))
 
-    def test_TryParagraphEnd_ComplexParagraphEnd3(self):
-        (new_pos, new_line, paragraph_end) = mp._TryParagraphEnd('  \n\n\t  \n=', 0, 0)
+        (cached_series, cached_tags, cached_root_section) = mp._ParsePostTextCached(post_text, parse_cache)
+
+        self.assertIsNot(root_section, cached_root_section)
+        self.assertEqual(series, cached_series)
+        self.assertEqual(tags, cached_tags)
+        self.assertEqual(root_section.paragraphs[0].cell.text, cached_root_section.paragraphs[0].cell.text)
+        self.assertEqual(root_section.subsections[0].title, cached_root_section.subsections[0].title)
 
-        self.assertEqual(8, new_pos)
-        self.assertEqual(mp.Token('paragraph-end', '  \n\n\t  \n', mp.SourcePos(0, 3, 0, 8)), paragraph_end)
+    def test_NoCache(self):
+        (series, tags, root_section) = mp._ParsePostTextCached('hello', None)
+
+        self.assertEqual([], series)
+        self.assertEqual([], tags)
+        self.assertEqual(model.Text([model.Word('hello')]), root_section.paragraphs[0].cell.text)
+
+class TestParsePostDB(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+        self._series = model.Text([model.Word('Series')])
+        self._info = model.Info(title=model.Text([model.Word('Blog')]), url='example.com', author='A',
+                                email='a@example.com', twitter='a', location='B', avatar_path='a.jpg',
+                                description=model.Text([model.Word('Blog')]),
+                                series=frozenset([self._series]), nr_of_posts_in_feed=10,
+                                posts_dir=self._dir_path, output_dir='out', output_homepage_path='index.html',
+                                output_posts_dir='posts')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
+
+    def _WritePost(self, name, text):
+        with open(os.path.join(self._dir_path, name), 'w') as post_file:
+            post_file.write(text)
+
+    def test_ParallelSameAsSerial(self):
+        for ii in range(12):
+            series = 'Series: Series\n' if ii % 3 == 0 else ''
+            self._WritePost('2014.01.%02d - Post %d' % (28 - ii, ii), '%sPost number %d.\n' % (series, ii))
+
+        self._WritePost('2014.01.16-1 - Later Post', 'Same day.\n')
+        self._WritePost('not a post', 'Ignored.\n')
+
+        serial_post_db = mp.ParsePostDB(self._info)
+        parallel_post_db = mp.ParsePostDB(self._info, jobs=3)
+
+        self.assertEqual(13, len(serial_post_db.post_map))
+        self.assertEqual(serial_post_db.post_map.keys(), parallel_post_db.post_map.keys())
+        self.assertEqual(serial_post_db.post_maps_by_series[self._series].keys(),
+                         parallel_post_db.post_maps_by_series[self._series].keys())
+
+        for post in parallel_post_db.post_map.values():
+            serial_post = serial_post_db.post_map[post.path]
+
+            self.assertEqual(serial_post.description, post.description)
+            self.assertEqual(serial_post.next_post and serial_post.next_post.path,
+                             post.next_post and post.next_post.path)
+            self.assertEqual(serial_post.prev_post_by_series.get(self._series) and
+                             serial_post.prev_post_by_series[self._series].path,
+                             post.prev_post_by_series.get(self._series) and
+                             post.prev_post_by_series[self._series].path)
+
+    def test_ParallelReportsFirstError(self):
+        for ii in range(6):
+            self._WritePost('2014.01.%02d - Post %d' % (ii + 1, ii), 'Post number %d.\n' % ii)
+
+        self._WritePost('2014.02.01 - Bad Blob', 'An {unclosed blob.\n')
+        self._WritePost('2014.02.02 - Bad Char', 'A } stray brace.\n')
+
+        with self.assertRaises(errors.Error) as serial_error:
+            mp.ParsePostDB(self._info)
+
+        with self.assertRaises(errors.Error) as parallel_error:
+            mp.ParsePostDB(self._info, jobs=4)
+
+        self.assertEqual(str(serial_error.exception), str(parallel_error.exception))
+
+    def test_SeriesAndTagsAreShared(self):
+        for ii in range(4):
+            self._WritePost('2014.01.%02d - Post %d' % (ii + 1, ii), 'Series: Series\nTags: one,two\nText.\n')
+
+        # Each ParsePostDB resets the shared texts, so the posts are checked before the next one.
+        for jobs in (1, 2):
+            posts = mp.ParsePostDB(self._info, jobs=jobs).post_map.values()
 
-    def test_SkipWS(self):
-        self.assertEqual(3, mp._SkipWS('  \t', 0, 0))
-        self.assertEqual(3, mp._SkipWS('  \thello', 0, 0))
-        self.assertEqual(3, mp._SkipWS('  \t\nhello', 0, 0))
+            self.assertIs(self._series, posts[0].series[0])
+            self.assertTrue(all(p.series[0] is posts[0].series[0] for p in posts))
+            self.assertTrue(all(p.tags[1] is posts[0].tags[1] for p in posts))
+            self.assertIs(mp._ParseSmallTextInterned(' two'), posts[0].tags[1])
+
+    def test_SeriesAndTagsOfOldPostsAreDropped(self):
+        self._WritePost('2014.01.01 - Post', 'Tags: old\nText.\n')
+        mp.ParsePostDB(self._info)
+        self._WritePost('2014.01.01 - Post', 'Tags: new\nText.\n')
+        mp.ParsePostDB(self._info)
+
+        self.assertNotIn(' old', mp._SMALL_TEXTS_BY_RAW)
+        self.assertNotIn(model.Text([model.Word('old')]), mp._SMALL_TEXTS)
+        self.assertIn(model.Text([model.Word('new')]), mp._SMALL_TEXTS)
+        self.assertIn(self._series, mp._SMALL_TEXTS)
+
+    def test_LazyBodies(self):
+        for ii in range(4):
+            self._WritePost('2014.01.%02d - Post %d' % (ii + 1, ii), 'Post number %d.\n\n=Part=\n\nMore.\n' % ii)
+
+        post_db = mp.ParsePostDB(self._info)
+        parse_cache = cache.DiskCache(os.path.join(self._dir_path, 'parse'), 1024 * 1024)
+
+        # With a parse cache, the first lazy post db puts the bodies there, and the second one
+        # walks them from there.
+        for lazy_post_db in (mp.ParsePostDB(self._info, lazy_bodies=True),
+                             mp.ParsePostDB(self._info, jobs=2, lazy_bodies=True),
+                             mp.ParsePostDB(self._info, parse_cache, lazy_bodies=True),
+                             mp.ParsePostDB(self._info, parse_cache, lazy_bodies=True)):
+            for post in lazy_post_db.post_map.values():
+                eager_post = post_db.post_map[post.path]
+
+                self.assertTrue(post.has_lazy_body)
+                self.assertFalse(eager_post.has_lazy_body)
+                self.assertEqual(eager_post.description, post.description)
+                self.assertEqual(self._TextualEvents(mp.SectionEvents(eager_post.root_section, 0)),
+                                 self._TextualEvents(mp.PostEvents(post)))
+                self.assertEqual(self._TextualEvents(mp.PostEvents(eager_post)), self._TextualEvents(mp.PostEvents(post)))
+
+        self.assertEqual(4, len(os.listdir(parse_cache.dir_path)))
+
+    def test_LazyBodiesParsedOnlyToDescription(self):
+        # The body is only parsed up to the description, so an error after it shows up once
+        # the events of the body are read.
+        self._WritePost('2014.01.01 - Post', 'Tags: one\nFirst text.\n\n=A=\n\nMore {text.\n')
+
+        with self.assertRaises(errors.Error):
+            mp.ParsePostDB(self._info)
+
+        post = mp.ParsePostDB(self._info, lazy_bodies=True).post_map.values()[0]
+
+        self.assertEqual(model.Text([model.Word('First'), model.Word('text.')]), post.description)
+        self.assertEqual([model.Text([model.Word('one')])], post.tags)
+
+        with self.assertRaises(errors.Error):
+            list(mp.PostEvents(post))
+
+    def test_FindDescription(self):
+        for post_text in ['First.', '*a\n*b\n\n=A=\n\nSecond.', '=A=\n\n==B==\n\nThird.\n\n=C=\n\nx',
+                          '%code{c}{x}\n\n=A=\n\n*a\n\n=B=\n\nFourth.', '', '=A=\n\n%code{c}{x}',
+                          '*a\n\n=A=\n\n*b\n\n==B==\n\nFifth.']:
+            try:
+                description = model.Post.FindDescription(mp._ParsePostText(post_text)[2])
+            except errors.Error:
+                description = None
+
+            try:
+                events_description = mp._FindDescription(mp._SectionEvents(mp._ScanTokens(post_text), 0, 0, False))
+            except errors.Error:
+                events_description = None
+
+            self.assertEqual(description, events_description)
+
+    def _TextualEvents(self, events):
+        # Paragraphs do not compare equal, so the text of the textual ones stands for them.
+        return [(kind, level, payload.cell.text if kind == mp.PARAGRAPH else payload)
+                for (kind, level, payload) in events]
+
+    def test_LazyBodiesFromHeadersIndex(self):
+        post_path_full = os.path.join(self._dir_path, '2014.01.01 - Post')
+        self._WritePost('2014.01.01 - Post', 'Tags: one\nFirst text.\n')
+        os.utime(post_path_full, (100, 100))
+        headers_index = post_index.PostIndex.Empty(self._dir_path, mp._PARSER_VERSION)
+        input_manifest = manifest.Manifest.Empty().Scan([post_path_full])
+        mp.ParsePostDB(self._info, input_manifest=input_manifest, lazy_bodies=True, headers_index=headers_index)
+
+        # Same size and mtime, so the index is trusted and the post file is not opened.
+        self._WritePost('2014.01.01 - Post', 'Tags: one\nOther text.\n')
+        os.utime(post_path_full, (100, 100))
+        input_manifest = input_manifest.Scan([post_path_full])
+        post = mp.ParsePostDB(self._info, input_manifest=input_manifest, lazy_bodies=True,
+                              headers_index=headers_index).post_map.values()[0]
+
+        self.assertEqual(model.Text([model.Word('First'), model.Word('text.')]), post.description)
+        self.assertEqual([model.Text([model.Word('one')])], post.tags)
+        self.assertEqual(['/2014.01.01 - Post'], headers_index.headers.keys())
+
+    def test_LoadPostIndex(self):
+        index_path = os.path.join(self._dir_path, 'index')
+        headers_index = mp.LoadPostIndex(index_path, self._info)
+        headers_index.Put('/a', 'hash-a', ([], [], model.Text([model.Word('Hello')])))
+        headers_index.Save(index_path)
+
+        self.assertEqual(['/a'], mp.LoadPostIndex(index_path, self._info).headers.keys())
+
+        parser_version = mp._PARSER_VERSION
+        mp._PARSER_VERSION = parser_version + '-next'
+
+        try:
+            self.assertEqual({}, mp.LoadPostIndex(index_path, self._info).headers)
+        finally:
+            mp._PARSER_VERSION = parser_version
 
 if __name__ == '__main__':
     unittest.main()
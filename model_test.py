@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+
+import errors
+import model
+
+class TestPostDB(unittest.TestCase):
+    def setUp(self):
+        self._info = model.Info(title=model.Text([model.Word('Blog')]), url='example.com', author='A',
+                                email='a@example.com', twitter='a', location='B', avatar_path='a.jpg',
+                                description=model.Text([model.Word('Blog')]), series=frozenset(),
+                                nr_of_posts_in_feed=10, posts_dir='posts', output_dir='out',
+                                output_homepage_path='index.html', output_posts_dir='posts')
+
+    def _PostDB(self, titles_by_path):
+        post_map = {}
+
+        for (post_path, title) in titles_by_path.iteritems():
+            title_text = model.Text([model.Word(w) for w in title.split()])
+            root_section = model.Section(model.Text([]), [model.Paragraph(model.Textual(title_text))], [])
+            post_map[post_path] = model.Post(info=self._info, title=title_text, date=datetime.date(2014, 1, 1),
+                                             delta=0, series=[], tags=[], root_section=root_section,
+                                             path=post_path)
+
+        return model.PostDB(info=self._info, post_map=post_map, post_maps_by_series={})
+
+    def test_IndexSlugs(self):
+        post_db = self._PostDB({'/first': 'First Post', '/second': 'C++ & You'})
+        post_db.IndexSlugs(lambda text: text.words_text)
+
+        self.assertEqual({'/first': 'first_post.html', '/second': 'c__you.html'}, post_db.postpage_path_map)
+        self.assertEqual({'/first': '/posts/first_post.html', '/second': '/posts/c__you.html'},
+                         post_db.url_map)
+
+    def test_IndexSlugs_Collision(self):
+        # Both titles lose their punctuation, and slug to "first_post".
+        post_db = self._PostDB({'/first': 'First Post', '/other': 'First, Post!'})
+
+        with self.assertRaises(errors.Error) as context:
+            post_db.IndexSlugs(lambda text: text.words_text)
+
+        self.assertIn('"first_post"', str(context.exception))
+        self.assertIn('"/first"', str(context.exception))
+        self.assertIn('"/other"', str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main()
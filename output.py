@@ -62,6 +62,13 @@ class Copy(Unit):
     def is_dir(self):
         return self._is_dir
 
+class Keep(Unit):
+    # A file written by an earlier build which is still up to date, and is left as it is.
+    def __init__(self, crawl_mode):
+        assert isinstance(crawl_mode, CrawlMode)
+
+        super(Keep, self).__init__(None, crawl_mode)
+
 class Dir(Unit):
     def __init__(self, crawl_mode):
         assert isinstance(crawl_mode, CrawlMode)
@@ -86,9 +93,10 @@ class Dir(Unit):
     def units(self):
         return self._units
 
-def WriteLocalOutput(base_dir_path, out_dir):
+def WriteLocalOutput(base_dir_path, out_dir, incremental=False):
     assert isinstance(base_dir_path, str)
     assert isinstance(out_dir, Dir)
+    assert isinstance(incremental, bool)
 
     def WriteUnit_(path, unit):
         if isinstance(unit, File):
@@ -99,7 +107,7 @@ def WriteLocalOutput(base_dir_path, out_dir):
             if unit.is_dir:
                 shutil.copytree(unit.original_path, path)
             else:
-                shutil.copy(unit.original_path, path)
+                shutil.copy2(unit.original_path, path)
         elif isinstance(unit, Dir):
             os.mkdir(path)
 
@@ -108,6 +116,16 @@ def WriteLocalOutput(base_dir_path, out_dir):
         else:
             assert False
 
+    if incremental and os.path.isdir(base_dir_path):
+        # Update the output dir in place. A failure leaves a partially updated directory
+        # behind, which the next full build replaces.
+        try:
+            _UpdateUnit(base_dir_path, out_dir)
+        except (IOError, OSError) as e:
+            raise errors.Error(str(e))
+
+        return
+
     # Create the base output dir.
     try:
         if os.path.exists(base_dir_path):
@@ -129,3 +147,72 @@ def WriteLocalOutput(base_dir_path, out_dir):
             print 'Warning: could not remove output directories'
 
         raise errors.Error(str(e))
+
+def _UpdateUnit(path, unit):
+    if isinstance(unit, File):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.isfile(path) and os.path.getsize(path) == len(unit.content):
+            with open(path) as unit_file:
+                if unit_file.read() == unit.content:
+                    return
+
+        unit_file = open(path, 'w')
+        unit_file.write(unit.content)
+        unit_file.close()
+    elif isinstance(unit, Keep):
+        if not os.path.isfile(path):
+            raise errors.Error('Kept output "%s" is missing' % path)
+    elif isinstance(unit, Copy):
+        _SyncCopy(unit.original_path, path)
+    elif isinstance(unit, Dir):
+        if os.path.exists(path) and not os.path.isdir(path):
+            os.remove(path)
+
+        if not os.path.exists(path):
+            os.mkdir(path)
+
+        for (subpath, subunit) in unit.units.iteritems():
+            _UpdateUnit(os.path.join(path, subpath), subunit)
+
+        for stale_path in os.listdir(path):
+            if stale_path not in unit.units:
+                _RemovePath(os.path.join(path, stale_path))
+    else:
+        assert False
+
+def _SyncCopy(original_path, path):
+    if os.path.isdir(original_path):
+        if os.path.exists(path) and not os.path.isdir(path):
+            os.remove(path)
+
+        if not os.path.exists(path):
+            shutil.copytree(original_path, path)
+            return
+
+        original_subpaths = os.listdir(original_path)
+
+        for subpath in original_subpaths:
+            _SyncCopy(os.path.join(original_path, subpath), os.path.join(path, subpath))
+
+        for stale_path in set(os.listdir(path)) - set(original_subpaths):
+            _RemovePath(os.path.join(path, stale_path))
+    else:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.isfile(path):
+            original_stat = os.stat(original_path)
+            copy_stat = os.stat(path)
+
+            # Copies are made with shutil.copy2, so an unchanged original has the same size and
+            # mtime as its copy.
+            if original_stat.st_size == copy_stat.st_size and original_stat.st_mtime == copy_stat.st_mtime:
+                return
+
+        shutil.copy2(original_path, path)
+
+def _RemovePath(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
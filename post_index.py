@@ -0,0 +1,94 @@
+import cPickle
+import os
+import os.path
+import tempfile
+
+import errors
+
+# Bump this whenever the structure of a saved index changes, so older ones are ignored. The
+# headers are parse results, so an index saved under another parser version is ignored too.
+_POST_INDEX_VERSION = 1
+
+class PostIndex(object):
+    """The series, tags and description of every post in a posts dir, by the content hash of
+    the text they were parsed from."""
+
+    def __init__(self, posts_dir, parser_version, headers):
+        assert posts_dir is None or isinstance(posts_dir, str)
+        assert isinstance(parser_version, str)
+        assert isinstance(headers, dict)
+        assert all(isinstance(p, str) for p in headers.keys())
+        assert all(isinstance(h, tuple) and len(h) == 2 for h in headers.values())
+
+        self._posts_dir = posts_dir
+        self._parser_version = parser_version
+        self._headers = headers
+
+    @staticmethod
+    def Load(index_path, posts_dir, parser_version):
+        try:
+            with open(index_path, 'rb') as index_file:
+                (version, index_parser_version, index_posts_dir, headers) = cPickle.load(index_file)
+        except (IOError, OSError, EOFError, ValueError, TypeError, AttributeError, ImportError,
+                cPickle.UnpicklingError):
+            return PostIndex.Empty(posts_dir, parser_version)
+
+        if (version != _POST_INDEX_VERSION or index_parser_version != parser_version or
+                index_posts_dir != posts_dir):
+            return PostIndex.Empty(posts_dir, parser_version)
+
+        return PostIndex(posts_dir, parser_version, headers)
+
+    @staticmethod
+    def Empty(posts_dir, parser_version):
+        return PostIndex(posts_dir, parser_version, {})
+
+    def Save(self, index_path):
+        try:
+            index_dir = os.path.dirname(index_path)
+
+            if index_dir != '' and not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+
+            (temp_fd, temp_path) = tempfile.mkstemp(dir=index_dir or '.', prefix='.tmp-')
+
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                cPickle.dump((_POST_INDEX_VERSION, self._parser_version, self._posts_dir, self._headers),
+                             temp_file, cPickle.HIGHEST_PROTOCOL)
+
+            os.rename(temp_path, index_path)
+        except (IOError, OSError) as e:
+            raise errors.Error(str(e))
+
+    def Get(self, post_path, content_hash):
+        post_headers = self._headers.get(post_path)
+
+        if post_headers is None or content_hash is None or post_headers[0] != content_hash:
+            return None
+
+        return post_headers[1]
+
+    def Put(self, post_path, content_hash, headers):
+        assert isinstance(post_path, str)
+        assert isinstance(content_hash, str)
+        assert isinstance(headers, tuple) and len(headers) == 3
+
+        self._headers[post_path] = (content_hash, headers)
+
+    def Retain(self, post_paths):
+        # Forgets the posts which are gone from the posts dir.
+        for post_path in self._headers.keys():
+            if post_path not in post_paths:
+                del self._headers[post_path]
+
+    @property
+    def posts_dir(self):
+        return self._posts_dir
+
+    @property
+    def parser_version(self):
+        return self._parser_version
+
+    @property
+    def headers(self):
+        return self._headers
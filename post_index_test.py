@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import model
+import post_index
+
+class TestPostIndex(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+        self._headers = ([], [model.Text([model.Word('tag')])], model.Text([model.Word('Hello')]))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
+
+    def test_GetMatchesContentHash(self):
+        index = post_index.PostIndex.Empty('posts', '1')
+        index.Put('/a', 'hash-a', self._headers)
+
+        self.assertEqual(self._headers, index.Get('/a', 'hash-a'))
+        self.assertIsNone(index.Get('/a', 'hash-b'))
+        self.assertIsNone(index.Get('/a', None))
+        self.assertIsNone(index.Get('/b', 'hash-a'))
+
+    def test_Retain(self):
+        index = post_index.PostIndex.Empty('posts', '1')
+        index.Put('/a', 'hash-a', self._headers)
+        index.Put('/b', 'hash-b', self._headers)
+        index.Retain(frozenset(['/b']))
+
+        self.assertEqual(['/b'], index.headers.keys())
+
+    def test_SaveAndLoad(self):
+        index_path = os.path.join(self._dir_path, 'cache', 'posts')
+        index = post_index.PostIndex.Empty('posts', '1')
+        index.Put('/a', 'hash-a', self._headers)
+        index.Save(index_path)
+
+        loaded = post_index.PostIndex.Load(index_path, 'posts', '1')
+
+        self.assertEqual(self._headers, loaded.Get('/a', 'hash-a'))
+        # An index of another posts dir is not used.
+        self.assertEqual({}, post_index.PostIndex.Load(index_path, 'other', '1').headers)
+
+    def test_ParserVersionChangeIgnoresIndex(self):
+        index_path = os.path.join(self._dir_path, 'posts')
+        index = post_index.PostIndex.Empty('posts', '1')
+        index.Put('/a', 'hash-a', self._headers)
+        index.Save(index_path)
+
+        self.assertEqual({}, post_index.PostIndex.Load(index_path, 'posts', '2').headers)
+        self.assertEqual(self._headers, post_index.PostIndex.Load(index_path, 'posts', '1').Get('/a', 'hash-a'))
+
+    def test_LoadMissingOrCorrupt(self):
+        index_path = os.path.join(self._dir_path, 'posts')
+
+        self.assertEqual({}, post_index.PostIndex.Load(index_path, 'posts', '1').headers)
+
+        with open(index_path, 'w') as index_file:
+            index_file.write('garbage')
+
+        self.assertEqual({}, post_index.PostIndex.Load(index_path, 'posts', '1').headers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import marshal
+import sys
+import types
+
+import Cheetah.Template as template
+from Cheetah.Version import Version as cheetah_version
+
+import cache
+import utils
+
+# Bump this whenever the way compiled templates are stored changes, so older ones are ignored.
+_COMPILED_TEMPLATE_VERSION = '1'
+_COMPILED_TEMPLATE_CLASS_NAME = 'CompiledTemplate'
+
+class TemplateRegistry(object):
+    """Compiles each template file once per build, or loads it from a compiled cache, and
+    hands out new instances of the compiled class."""
+
+    def __init__(self, compiled_cache=None):
+        assert compiled_cache is None or isinstance(compiled_cache, cache.DiskCache)
+
+        self._compiled_cache = compiled_cache
+        self._template_classes = {}
+
+    def New(self, template_path):
+        assert isinstance(template_path, str)
+
+        template_class = self._template_classes.get(template_path)
+
+        if template_class is None:
+            template_class = self._Compile(template_path)
+            self._template_classes[template_path] = template_class
+
+        return template_class()
+
+    def _Compile(self, template_path):
+        template_text = utils.QuickRead(template_path)
+
+        if self._compiled_cache is None:
+            return template.Template.compile(source=template_text)
+
+        key = utils.HashText('\0'.join([_COMPILED_TEMPLATE_VERSION, cheetah_version, sys.version,
+                                        template_text]))
+        template_code = _LoadCode(self._compiled_cache.Get(key))
+
+        if template_code is None:
+            module_text = template.Template.compile(source=template_text, returnAClass=False,
+                                                    className=_COMPILED_TEMPLATE_CLASS_NAME)
+            template_code = compile(module_text, template_path, 'exec')
+            self._compiled_cache.Put(key, marshal.dumps(template_code))
+
+        # Like the modules Cheetah compiles itself, the module is kept in sys.modules. Python
+        # clears the globals of a module once it is collected, which would break its class.
+        template_module_name = 'compiled_template_%s' % key
+        template_module = types.ModuleType(template_module_name)
+        template_module.__file__ = template_path
+        exec template_code in template_module.__dict__
+        sys.modules[template_module_name] = template_module
+
+        return getattr(template_module, _COMPILED_TEMPLATE_CLASS_NAME)
+
+    @property
+    def compiled_cache(self):
+        return self._compiled_cache
+
+def _LoadCode(code_data):
+    if code_data is None:
+        return None
+
+    try:
+        return marshal.loads(code_data)
+    except (EOFError, ValueError, TypeError):
+        return None
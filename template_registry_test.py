@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+import template_registry
+
+class TestTemplateRegistry(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+        self._template_path = os.path.join(self._dir_path, 'page.html')
+
+        with open(self._template_path, 'w') as template_file:
+            template_file.write('<p>$page.title</p>')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_path)
+
+    def _Render(self, registry, title):
+        page_template = registry.New(self._template_path)
+        page_template.page = {'title': title}
+
+        return str(page_template)
+
+    def test_CompilesOnce(self):
+        registry = template_registry.TemplateRegistry()
+
+        self.assertEqual('<p>one</p>', self._Render(registry, 'one'))
+        self.assertEqual('<p>two</p>', self._Render(registry, 'two'))
+        self.assertIs(registry.New(self._template_path).__class__, registry.New(self._template_path).__class__)
+
+    def test_CompiledCache(self):
+        compiled_cache = cache.DiskCache(os.path.join(self._dir_path, 'compiled'), 1024 * 1024)
+
+        self.assertEqual('<p>one</p>', self._Render(template_registry.TemplateRegistry(compiled_cache), 'one'))
+        self.assertEqual(1, len(os.listdir(compiled_cache.dir_path)))
+
+        # A later registry runs the cached code, without compiling the template again.
+        compile_template = template_registry.template.Template.__dict__['compile']
+
+        def FailCompile(*args, **kwargs):
+            raise AssertionError('Template compiled again')
+
+        template_registry.template.Template.compile = staticmethod(FailCompile)
+
+        try:
+            self.assertEqual('<p>two</p>', self._Render(template_registry.TemplateRegistry(compiled_cache), 'two'))
+        finally:
+            template_registry.template.Template.compile = compile_template
+
+    def test_CompiledCacheKeyedByText(self):
+        compiled_cache = cache.DiskCache(os.path.join(self._dir_path, 'compiled'), 1024 * 1024)
+        self._Render(template_registry.TemplateRegistry(compiled_cache), 'one')
+
+        with open(self._template_path, 'w') as template_file:
+            template_file.write('<h1>$page.title</h1>')
+
+        self.assertEqual('<h1>two</h1>', self._Render(template_registry.TemplateRegistry(compiled_cache), 'two'))
+        self.assertEqual(2, len(os.listdir(compiled_cache.dir_path)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,12 @@
+import hashlib
+import mmap
+import os
+
+import errors
+
+def HashText(text):
+    return hashlib.sha1(text).hexdigest()
+
 def QuickRead(path):
     try:
         f = open(path)
@@ -8,6 +17,22 @@ def QuickRead(path):
     except IOError as e:
         raise errors.Error(str(e))
 
+def QuickMap(path):
+    # Maps the file into memory instead of reading it, so only the parts which are looked at
+    # are paged in. Empty files cannot be mapped, and are returned as an empty string.
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except EnvironmentError as e:
+        raise errors.Error(str(e))
+
+def Unmap(text):
+    if isinstance(text, mmap.mmap):
+        text.close()
+
 def Extract(yaml_dict, field_name, type_constraint):
     if field_name not in yaml_dict:
         raise errors.Error('Entry %s is missing' % field_name)
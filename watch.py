@@ -0,0 +1,150 @@
+import os
+import os.path
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# How long to wait for a burst of changes, such as an editor saving several files, to settle.
+_SETTLE_TIME = 0.2
+
+class PollingWatcher(object):
+    """Waits for changes under a set of directories, or to a set of files, by polling mtimes."""
+
+    def __init__(self, dir_paths, file_paths, excluded_dir_paths, interval=0.5):
+        assert isinstance(dir_paths, list)
+        assert all(isinstance(p, str) for p in dir_paths)
+        assert isinstance(file_paths, list)
+        assert all(isinstance(p, str) for p in file_paths)
+        assert isinstance(excluded_dir_paths, list)
+        assert all(isinstance(p, str) for p in excluded_dir_paths)
+        assert isinstance(interval, float)
+        assert interval > 0
+
+        self._dir_paths = dir_paths
+        self._file_paths = file_paths
+        self._excluded_dir_paths = excluded_dir_paths
+        self._excluded_abs_dir_paths = frozenset(os.path.abspath(p) for p in excluded_dir_paths)
+        self._interval = interval
+        self._snapshot = self._Snapshot()
+
+    def Wait(self):
+        while True:
+            time.sleep(self._interval)
+            snapshot = self._Snapshot()
+
+            if snapshot != self._snapshot:
+                break
+
+        # The snapshot is taken before the caller rebuilds, so changes made while building
+        # are seen by the next call.
+        time.sleep(_SETTLE_TIME)
+        self._snapshot = self._Snapshot()
+
+    def Close(self):
+        pass
+
+    def _Snapshot(self):
+        snapshot = {}
+
+        for dir_path in self._dir_paths:
+            for (dirpath, subdir_names, file_names) in os.walk(dir_path):
+                # Excluded dirs are not walked into at all.
+                subdir_names[:] = [n for n in subdir_names
+                                   if os.path.abspath(os.path.join(dirpath, n)) not in self._excluded_abs_dir_paths]
+
+                for file_name in file_names:
+                    _StatInto(snapshot, os.path.join(dirpath, file_name))
+
+        for file_path in self._file_paths:
+            _StatInto(snapshot, file_path)
+
+        return snapshot
+
+    @property
+    def dir_paths(self):
+        return self._dir_paths
+
+    @property
+    def file_paths(self):
+        return self._file_paths
+
+    @property
+    def excluded_dir_paths(self):
+        return self._excluded_dir_paths
+
+class InotifyWatcher(object):
+    """Waits for changes under a set of directories, or to a set of files, using inotify."""
+
+    def __init__(self, dir_paths, file_paths, excluded_dir_paths):
+        assert pyinotify is not None
+        assert isinstance(dir_paths, list)
+        assert all(isinstance(p, str) for p in dir_paths)
+        assert isinstance(file_paths, list)
+        assert all(isinstance(p, str) for p in file_paths)
+        assert isinstance(excluded_dir_paths, list)
+        assert all(isinstance(p, str) for p in excluded_dir_paths)
+
+        self._dir_paths = dir_paths
+        self._file_paths = file_paths
+        self._excluded_dir_paths = excluded_dir_paths
+        self._excluded_abs_dir_paths = frozenset(os.path.abspath(p) for p in excluded_dir_paths)
+        self._watch_manager = pyinotify.WatchManager()
+        self._notifier = pyinotify.Notifier(self._watch_manager, lambda event: None)
+
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB)
+
+        for dir_path in dir_paths:
+            self._watch_manager.add_watch(dir_path, mask, rec=True, auto_add=True, quiet=True,
+                                          exclude_filter=self._IsExcluded)
+
+        for file_dir_path in set(os.path.dirname(p) or '.' for p in file_paths):
+            self._watch_manager.add_watch(file_dir_path, mask, quiet=True)
+
+    def Wait(self):
+        # Block for the first event, then drain whatever follows it shortly after.
+        if self._notifier.check_events(None):
+            self._notifier.read_events()
+            self._notifier.process_events()
+
+        while self._notifier.check_events(int(_SETTLE_TIME * 1000)):
+            self._notifier.read_events()
+            self._notifier.process_events()
+
+    def Close(self):
+        self._notifier.stop()
+
+    def _IsExcluded(self, path):
+        # Excluded dirs, and everything under them, get no watches.
+        path = os.path.abspath(path)
+
+        return any(path == p or path.startswith(p + os.sep) for p in self._excluded_abs_dir_paths)
+
+    @property
+    def dir_paths(self):
+        return self._dir_paths
+
+    @property
+    def file_paths(self):
+        return self._file_paths
+
+    @property
+    def excluded_dir_paths(self):
+        return self._excluded_dir_paths
+
+def NewWatcher(dir_paths, file_paths, excluded_dir_paths):
+    if pyinotify is not None:
+        return InotifyWatcher(dir_paths, file_paths, excluded_dir_paths)
+
+    return PollingWatcher(dir_paths, file_paths, excluded_dir_paths)
+
+def _StatInto(snapshot, path):
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return
+
+    snapshot[path] = (path_stat.st_mtime, path_stat.st_size)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import watch
+
+class TestPollingWatcher(unittest.TestCase):
+    def setUp(self):
+        self._dir_path = tempfile.mkdtemp()
+        self._mtime = 1000000000
+        os.mkdir(os.path.join(self._dir_path, 'posts'))
+        os.mkdir(os.path.join(self._dir_path, 'out'))
+        self._Write(os.path.join('posts', 'a'), 'a')
+        self._Write('config', 'config')
+        self._watchers = []
+
+    def tearDown(self):
+        for watcher in self._watchers:
+            watcher.Close()
+
+        shutil.rmtree(self._dir_path)
+
+    def _NewWatcher(self, dir_paths, file_paths, excluded_dir_paths):
+        return watch.PollingWatcher(dir_paths, file_paths, excluded_dir_paths, 0.01)
+
+    def _Watcher(self):
+        watcher = self._NewWatcher([self._dir_path], [os.path.join(self._dir_path, 'config')],
+                                   [os.path.join(self._dir_path, 'out')])
+        self._watchers.append(watcher)
+
+        return watcher
+
+    def _Write(self, path, text):
+        path = os.path.join(self._dir_path, path)
+
+        with open(path, 'w') as written_file:
+            written_file.write(text)
+
+        self._mtime = self._mtime + 10
+        os.utime(path, (self._mtime, self._mtime))
+
+    def _Returns(self, wait):
+        # Whether a call to wait returns within a second. One which does not is left blocked
+        # in its thread, until a later change lets it return.
+        wait_thread = threading.Thread(target=wait)
+        wait_thread.daemon = True
+        wait_thread.start()
+        wait_thread.join(1.0)
+
+        return not wait_thread.is_alive()
+
+    def test_NoChange(self):
+        self.assertFalse(self._Returns(self._Watcher().Wait))
+
+    def test_Touch(self):
+        watcher = self._Watcher()
+        os.utime(os.path.join(self._dir_path, 'posts', 'a'), (self._mtime + 5, self._mtime + 5))
+
+        self.assertTrue(self._Returns(watcher.Wait))
+
+    def test_Create(self):
+        watcher = self._Watcher()
+        os.mkdir(os.path.join(self._dir_path, 'posts', 'sub'))
+        self._Write(os.path.join('posts', 'sub', 'b'), 'b')
+
+        self.assertTrue(self._Returns(watcher.Wait))
+
+    def test_Delete(self):
+        watcher = self._Watcher()
+        os.remove(os.path.join(self._dir_path, 'posts', 'a'))
+
+        self.assertTrue(self._Returns(watcher.Wait))
+
+    def test_File(self):
+        watcher = self._Watcher()
+        self._Write('config', 'edited config')
+
+        self.assertTrue(self._Returns(watcher.Wait))
+
+    def test_ExcludedDir(self):
+        watcher = self._Watcher()
+        self._Write(os.path.join('out', 'index.html'), 'index')
+
+        self.assertFalse(self._Returns(watcher.Wait))
+
+    def test_Debounce(self):
+        # A burst of changes, closer together than the settle time, is waited for only once.
+        watcher = self._Watcher()
+
+        def Burst():
+            for ii in range(3):
+                self._Write(os.path.join('posts', 'b%d' % ii), 'b')
+                time.sleep(watch._SETTLE_TIME / 4)
+
+        burst_thread = threading.Thread(target=Burst)
+        burst_thread.start()
+
+        try:
+            self.assertTrue(self._Returns(watcher.Wait))
+        finally:
+            burst_thread.join()
+
+        self.assertFalse(self._Returns(watcher.Wait))
+
+@unittest.skipIf(watch.pyinotify is None, 'pyinotify is not installed')
+class TestInotifyWatcher(TestPollingWatcher):
+    def _NewWatcher(self, dir_paths, file_paths, excluded_dir_paths):
+        return watch.InotifyWatcher(dir_paths, file_paths, excluded_dir_paths)
+
+if __name__ == '__main__':
+    unittest.main()